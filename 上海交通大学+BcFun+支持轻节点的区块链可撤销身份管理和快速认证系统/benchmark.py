@@ -0,0 +1,286 @@
+import json
+import platform
+import sys
+import time
+from argparse import ArgumentParser
+from datetime import datetime
+from hashlib import sha256
+from blockchain import BlockChain
+from util import hashTool
+from util.lss import SecretShare
+
+# 基准测试
+# 覆盖加密、merkle 树与链操作的热点路径，全部在测试模式下离线运行，不读写区块存储，不访问网络
+# 每个用例至少运行 MIN_ITERATIONS 次、累计约 --time 秒，统计吞吐量与 p50 / p99 延迟
+# 指定基线时与基线比较，p50 比基线慢超过阈值的用例视为性能回退，程序以状态码 1 退出
+
+BLOCK_SIZES = (4, 64, 512, 4096)
+CHAIN_SIZES = (10, 1000, 100000)
+# (恢复门限 k, 份额数 n)，系统中使用 (2, 5)
+SHARE_SIZES = ((2, 5), (8, 16), (32, 64))
+# --quick 时使用的规模
+QUICK_BLOCK_SIZES = (4, 64)
+QUICK_CHAIN_SIZES = (10, 1000)
+QUICK_SHARE_SIZES = ((2, 5),)
+
+MIN_ITERATIONS = 5
+MAX_ITERATIONS = 100000
+# 延迟的绝对差小于该值（秒）时不视为回退，避免微秒级用例的计时抖动
+NOISE_FLOOR = 20e-6
+
+DEFAULT_BASELINE = "./benchmark_baseline.json"
+
+
+# 生成已签名的交易，按需扩充并复用，避免每个用例重复签名
+transactions_cache = []
+
+
+def make_transactions(count):
+    while len(transactions_cache) < count:
+        public_key, private_key = hashTool.generate_ECDSA_keys()
+        transaction = {"message": "Identity_Bench_%d" % len(transactions_cache), "from": public_key}
+        transaction["signature"] = hashTool.sign(private_key, transaction["message"].encode())
+        transaction["hash"] = sha256(bytes.fromhex(public_key) + transaction["message"].encode() +
+                                     transaction["signature"].encode()).hexdigest()
+        transactions_cache.append(transaction)
+    return [dict(transaction) for transaction in transactions_cache[:count]]
+
+
+# 测试模式下的 leader 节点，只有创世区块
+def make_node(max_transactions=8):
+    bc = BlockChain(test_mode=True, max_transactions=max_transactions)
+    bc.init()
+    return bc
+
+
+# 用一个真实区块为模板构造长链，区块哈希各不相同，只用于测量读取与索引，不做验证
+def make_long_chain(bc, length):
+    template = bc.generate_block(make_transactions(4))
+    previous_hash = bc.chain[0]["block_hash"]
+    chain = [bc.chain[0]]
+    for i in range(1, length):
+        block = dict(template, index=i, previous_hash=previous_hash,
+                     block_hash=sha256(b"bench block %d" % i).hexdigest())
+        chain.append(block)
+        previous_hash = block["block_hash"]
+    bc.chain = chain
+    bc.index.rebuild(bc.chain)
+
+
+# 每个用例的准备函数返回 (被测函数, 每次调用处理的条目数)
+# 被测函数接收调用序号，便于每次使用不同的输入
+def case_merkel_tree(size):
+    transactions = make_transactions(size)
+    return lambda i: hashTool.merkel_tree(transactions), size
+
+
+def case_chameleon_hash():
+    bc = make_node()
+    params = bc.chameleon_params
+    return lambda i: hashTool.chameleon_hash(params["g"], params["y"], "bench message %d" % i), 1
+
+
+def case_chameleon_verify():
+    bc = make_node()
+    params = bc.chameleon_params
+    r, s, ch = hashTool.chameleon_hash(params["g"], params["y"], "bench message")
+    return lambda i: hashTool.chameleon_verify(params["g"], params["y"], "bench message", r, s), 1
+
+
+def case_chameleon_adjust():
+    bc = make_node()
+    params = bc.chameleon_params
+    r, s, ch = hashTool.chameleon_hash(params["g"], params["y"], "bench message")
+    return lambda i: hashTool.chameleon_adjust(params["g"], params["x"], "bench message %d" % i, ch), 1
+
+
+def case_validate_signature():
+    transaction = make_transactions(1)[0]
+    message = transaction["message"].encode()
+    return lambda i: hashTool.validate_signature(transaction["from"], transaction["signature"], message), 1
+
+
+def case_validate_signatures(size):
+    items = [(t["from"], t["signature"], t["message"].encode()) for t in make_transactions(size)]
+    return lambda i: hashTool.validate_signatures(items), size
+
+
+def case_lss_recover(k, n):
+    model = SecretShare(hashTool.group)
+    shares = model.genShares(hashTool.group.random(hashTool.ZR), k=k, n=n)
+    subset = dict((i, shares[i]) for i in range(1, k + 1))
+    return lambda i: model.recover(subset), 1
+
+
+def case_lss_recover_in_exp(k, n):
+    model = SecretShare(hashTool.group)
+    g = hashTool.group.random(hashTool.G)
+    shares = model.genShares(hashTool.group.random(hashTool.ZR), k=k, n=n)
+    subset = dict((i, g ** shares[i]) for i in range(1, k + 1))
+    return lambda i: model.recoverInExp(subset), 1
+
+
+def case_generate_block(size):
+    bc = make_node(max_transactions=size)
+    transactions = make_transactions(size)
+    return lambda i: bc.generate_block(list(transactions)), size
+
+
+# 每次撤销一笔不同的交易；交易用完后自动出新区块补充
+def case_revoke_from_block(size):
+    bc = make_node(max_transactions=size)
+    pending = []
+
+    def revoke(i):
+        if not pending:
+            transactions = make_transactions(size)
+            # 哈希需要唯一，区块内交易的 message 附加区块高度
+            for transaction in transactions:
+                transaction["message"] += "_%d" % len(bc.chain)
+                transaction["hash"] = sha256(bytes.fromhex(transaction["from"]) + transaction["message"].encode() +
+                                             transaction["signature"].encode()).hexdigest()
+            bc.seal_block(transactions)
+            block_hash = bc.chain[-1]["block_hash"]
+            pending.extend({"block_hash": block_hash, "transaction_hash": t["hash"]} for t in transactions)
+        return bc.revoke_from_block(pending.pop())
+    return revoke, 1
+
+
+# 同步场景：follower 落后 10 个区块
+def case_send_block(length):
+    bc = make_node()
+    make_long_chain(bc, length)
+    latest_hash = bc.chain[max(len(bc.chain) - 11, 0)]["block_hash"]
+    return lambda i: bc.send_block(latest_hash), 1
+
+
+# 新节点从头同步全部区块头
+def case_send_block_headers(length):
+    bc = make_node()
+    make_long_chain(bc, length)
+    return lambda i: bc.send_block(None, header_only=True), length
+
+
+# 返回 [(用例名, 参数, 准备函数), ...]
+def build_cases(quick):
+    block_sizes = QUICK_BLOCK_SIZES if quick else BLOCK_SIZES
+    chain_sizes = QUICK_CHAIN_SIZES if quick else CHAIN_SIZES
+    share_sizes = QUICK_SHARE_SIZES if quick else SHARE_SIZES
+    cases = []
+    for size in block_sizes:
+        cases.append(("merkel_tree", "transactions=%d" % size, lambda size=size: case_merkel_tree(size)))
+    cases.append(("chameleon_hash", "", case_chameleon_hash))
+    cases.append(("chameleon_verify", "", case_chameleon_verify))
+    cases.append(("chameleon_adjust", "", case_chameleon_adjust))
+    cases.append(("validate_signature", "", case_validate_signature))
+    for size in block_sizes:
+        cases.append(("validate_signatures", "transactions=%d" % size,
+                      lambda size=size: case_validate_signatures(size)))
+    for k, n in share_sizes:
+        cases.append(("lss_recover", "k=%d,n=%d" % (k, n), lambda k=k, n=n: case_lss_recover(k, n)))
+        cases.append(("lss_recover_in_exp", "k=%d,n=%d" % (k, n), lambda k=k, n=n: case_lss_recover_in_exp(k, n)))
+    for size in block_sizes:
+        cases.append(("generate_block", "transactions=%d" % size, lambda size=size: case_generate_block(size)))
+        cases.append(("revoke_from_block", "transactions=%d" % size, lambda size=size: case_revoke_from_block(size)))
+    for length in chain_sizes:
+        cases.append(("send_block", "blocks=%d" % length, lambda length=length: case_send_block(length)))
+        cases.append(("send_block_headers", "blocks=%d" % length,
+                      lambda length=length: case_send_block_headers(length)))
+    return cases
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))]
+
+
+# 运行一个用例，返回 {"iterations", "throughput", "p50", "p99"}，延迟单位为秒，吞吐量为每秒处理的条目数
+def measure(fn, items, min_time):
+    # 预热：建立进程池、填充缓存
+    fn(-1)
+    samples = []
+    start = time.perf_counter()
+    while len(samples) < MAX_ITERATIONS and (len(samples) < MIN_ITERATIONS or
+                                              time.perf_counter() - start < min_time):
+        t = time.perf_counter()
+        fn(len(samples))
+        samples.append(time.perf_counter() - t)
+    return {
+        "iterations": len(samples),
+        "throughput": items * len(samples) / sum(samples),
+        "p50": percentile(samples, 50),
+        "p99": percentile(samples, 99)
+    }
+
+
+# 与基线比较，返回 (变化比例, 是否回退)；基线中没有该用例时返回 (None, False)
+def compare(result, base, threshold):
+    if base is None:
+        return None, False
+    change = result["p50"] / base["p50"] - 1
+    return change, change > threshold and result["p50"] - base["p50"] > NOISE_FLOOR
+
+
+def format_time(seconds):
+    if seconds < 1e-3:
+        return "%.1fus" % (seconds * 1e6)
+    if seconds < 1:
+        return "%.2fms" % (seconds * 1e3)
+    return "%.2fs" % seconds
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument('-q', '--quick', action="store_true", help='run only the small sizes')
+    parser.add_argument('-k', '--filter', default="", help='run only cases whose name contains FILTER')
+    parser.add_argument('-t', '--time', type=float, default=1.0, help='minimum seconds to run each case')
+    parser.add_argument('-b', '--baseline', default=DEFAULT_BASELINE, help='baseline file to compare with')
+    parser.add_argument('-s', '--save', action="store_true", help='save the results as the new baseline')
+    parser.add_argument('-r', '--threshold', type=float, default=0.2,
+                        help='flag a regression when p50 is slower than the baseline by this ratio')
+    args = parser.parse_args()
+
+    try:
+        baseline = json.load(open(args.baseline, "r"))
+    except FileNotFoundError:
+        baseline = {"environment": {}, "results": {}}
+    if baseline["environment"] and baseline["environment"].get("platform") != platform.platform():
+        print("Warning: baseline was recorded on {0}".format(baseline["environment"]["platform"]))
+
+    results = {}
+    regressions = []
+    print("{0:<42}{1:>10}{2:>16}{3:>12}{4:>12}{5:>10}".format("case", "iters", "items/s", "p50", "p99", "change"))
+    for name, params, setup in build_cases(args.quick):
+        key = name + ("[%s]" % params if params else "")
+        if args.filter not in name:
+            continue
+        fn, items = setup()
+        result = measure(fn, items, args.time)
+        results[key] = result
+        change, regressed = compare(result, baseline["results"].get(key), args.threshold)
+        if regressed:
+            regressions.append(key)
+        print("{0:<42}{1:>10}{2:>16.1f}{3:>12}{4:>12}{5:>10}{6}".format(
+            key, result["iterations"], result["throughput"], format_time(result["p50"]), format_time(result["p99"]),
+            "" if change is None else "%+.1f%%" % (change * 100), "  REGRESSION" if regressed else ""))
+        sys.stdout.flush()
+
+    if args.save:
+        # 只更新本次运行的用例，保留基线中的其他用例
+        baseline["environment"] = environment()
+        baseline["results"].update(results)
+        json.dump(baseline, open(args.baseline, "w"), indent=2, sort_keys=True)
+        print("Baseline saved to {0}".format(args.baseline))
+    if regressions:
+        print("{0} regression(s): {1}".format(len(regressions), ", ".join(regressions)))
+        sys.exit(1)
@@ -1,26 +1,156 @@
 #!/usr/bin/python
 # -*- coding:utf-8 -*-
 import requests
-from util import hashTool
+from util import hashTool, blockVerifier, blockCodec, txPool, metrics, tracing, chainIndex
+from util.chainIndex import ChainIndex
+from util.blockStore import BlockStore
+from util.lazyChain import LazyChain
+from util.prunedChain import PrunedChain
+from util.merkle import MerkleTree, verify_proof
+from util.transport import PeerTransport, peer_key
+from util.txPool import TransactionPool
+from util.txForwarder import TransactionForwarder
+from util.rwlock import RWLock
+from util.membership import Membership
 from datetime import datetime
 from hashlib import sha256
+from collections import OrderedDict
 import json
+import os
+import shutil
+import threading
+import time
 
+# 同步区块时每次请求的区块数
+SYNC_PAGE_SIZE = 1000
+# 同步时每收到多少个区块验证并写入一次，每个工作进程分到两个任务
+SYNC_BATCH_SIZE = 2 * blockVerifier.CHUNK_SIZE * blockVerifier.WORKERS
+# 重新同步整条链时，新链先写入该目录，全部验证通过后再换入
+SYNC_STAGING_PATH = './chain_data_staging'
+# 同步请求的连接与读取超时（秒）
+SYNC_TIMEOUT = (5, 60)
 
+# 转发交易给 leader 的连接与读取超时（秒），leader 需要验证整批交易的签名
+FORWARD_TIMEOUT = (2, 30)
+
+# leader 每生成多少个区块制作一次快照
+SNAPSHOT_INTERVAL = 100
+
+# 同步区块时优先使用二进制编码，对方不支持时返回 NDJSON
+SYNC_ACCEPT = blockCodec.CONTENT_TYPE + ", application/x-ndjson"
+
+# 监控指标，由 /metrics 输出
+GENERATE_BLOCK_SECONDS = metrics.histogram("bcfun_generate_block_seconds",
+                                           "Time to build the Merkle tree and chameleon hash of a new block")
+BROADCAST_BLOCK_SECONDS = metrics.histogram("bcfun_broadcast_block_seconds",
+                                            "Time to append a sealed block and push it to all peers")
+SEAL_BLOCK_SECONDS = metrics.histogram("bcfun_seal_block_seconds",
+                                       "Time to seal a batch of transactions, generate plus broadcast")
+SEALED_TRANSACTIONS = metrics.counter("bcfun_sealed_transactions_total", "Transactions sealed into blocks")
+SEAL_BLOCK_FAILURES = metrics.counter("bcfun_seal_block_failures_total", "Batches that failed to be sealed")
+SYNC_BLOCK_SECONDS = metrics.histogram("bcfun_sync_block_seconds", "Time of one sync_block run")
+SYNCED_BLOCKS = metrics.counter("bcfun_synced_blocks_total", "Blocks appended by sync_block")
+RECV_BLOCK_SECONDS = metrics.histogram("bcfun_recv_block_seconds", "Time to handle a pushed block")
+VERIFY_BLOCK_SECONDS = metrics.histogram("bcfun_verify_block_seconds",
+                                         "Chameleon hash and Merkle root verification of a received block")
+VERIFY_TRANSACTION_SECONDS = metrics.histogram("bcfun_verify_transaction_seconds",
+                                               "Hash and signature verification of one transaction")
+VERIFY_TRANSACTIONS_SECONDS = metrics.histogram("bcfun_verify_transactions_seconds",
+                                                "Verification of a batch of transactions")
+TRANSACTIONS = metrics.counter("bcfun_transactions_total", "Submitted transactions by admission result")
+
+# 交易接收结果 -> 指标标签
+ADMISSION_LABELS = {True: "accepted", False: "rejected", None: "pool_full"}
+
+# 区块头包含的字段，轻节点只保存区块头
+HEADER_KEYS = ("index", "timestamp", "previous_hash", "merkle_root", "block_hash", "r", "s")
+
+
+def block_header(block):
+    header = {}
+    for key in HEADER_KEYS:
+        header[key] = block[key]
+    return header
+
+
+# 将一批验证结果追加到重新同步的链中，全部验证通过时返回 True
+def stage_batch(chain, blocks, verification):
+    length = len(chain)
+    chain.extend(verification)
+    return len(chain) - length == len(blocks)
+
+
+# 快照与区块修改中被签名的内容：除 signature 以外的全部字段
+def signed_message(data):
+    body = {}
+    for key in data:
+        if key != "signature":
+            body[key] = data[key]
+    return json.dumps(body, sort_keys=True).encode()
+
+
+# 将已应用的快照之前区块的修改合并到快照的身份状态中
+def revoke_snapshot_identities(snapshot, revisions):
+    for revision in revisions:
+        for tran_hash in revision["removed"]:
+            record = snapshot["identities"].get(tran_hash)
+            if record is not None:
+                record["status"] = "revoked"
+                record["message"] = None
+
+
+# 并发模型：
+# chain 由读写锁 chain_lock 保护，追加、替换区块和整条链替换时持有写锁，读取区块时持有读锁
+# 区块写时复制：修改区块时生成新的区块对象替换链中的旧对象，已返回给读线程的区块不会再被修改
+# peer_list 写时复制：由 membership 在修改时生成新列表，读线程直接使用当前列表即为一致的快照
+# transaction_pool 自身是线程安全的
 class BlockChain:
-    def __init__(self, host="127.0.0.1", port=8000, test_mode=False, max_transactions=8):
-        self.info = {"host": host, "port": port, "term": 0}
-        self.peer_list = []
+    def __init__(self, host="127.0.0.1", port=8000, test_mode=False, max_transactions=8,
+                 memory_budget=32 * 1024 * 1024, light_mode=False, pool_capacity=10000):
+        # codec: 支持的二进制区块编码版本，随节点信息交换，其他节点据此选择发送格式
+        self.info = {"host": host, "port": port, "term": 0, "codec": blockCodec.VERSION}
+        # 带版本号的节点列表，心跳只传递增量
+        # 节点被删除时关闭与其通信的连接
+        self.membership = Membership(on_remove=self.close_peer)
         self.chain = []
-        self.transaction_pool = []
+        self.chain_lock = RWLock()
+        # 同一时间只进行一次同步
+        self.sync_lock = threading.Lock()
+        # 线程安全的交易池，由 BlockProducer 打包出块；pool_capacity 为池中最多等待的交易数
+        self.transaction_pool = TransactionPool(capacity=pool_capacity)
+        # follower 转发给 leader 的交易合并成批发送
+        self.forwarder = TransactionForwarder(self.forward_transactions)
+        # 出块与修改区块时持有，保证读取链尾和追加区块的原子性
+        self.block_lock = threading.RLock()
         self.public_key = ""
         self.private_key = ""
         self.max_transactions = max_transactions
         self.character = "candidate"
         self.leader = {}
         self.chameleon = {}
+        # 反序列化后的变色龙哈希参数，g 和 y 带有固定底数预计算表
+        self.chameleon_params = {}
         self.current_term = 1
         self.testmode = test_mode
+        # 区块与交易的哈希索引，非测试模式下与区块存储一起持久化
+        self.index = ChainIndex()
+        # 区块高度 -> MerkleTree，撤销交易时使用
+        self.merkle_cache = OrderedDict()
+        self.merkle_lock = threading.Lock()
+        # 本地区块存储，测试模式下不使用
+        self.store = None
+        # 非测试模式下链为惰性加载，memory_budget 为常驻内存的区块大小上限（字节）
+        self.memory_budget = memory_budget
+        # 轻节点只同步区块头，通过包含性证明验证交易
+        self.light = light_mode
+        # 节点间通信，带连接池与超时
+        self.transport = PeerTransport()
+        # leader 最近一次制作的快照
+        self.snapshot = None
+        # 本节点启动时使用的快照，链为 PrunedChain 时不为 None
+        self.bootstrap_snapshot = None
+        # 从 leader 收到的最高区块高度，用于计算同步延迟
+        self.leader_height = 0
 
     def init(self, peer=None):
         try:
@@ -49,10 +179,13 @@ class BlockChain:
                     "x": self.chameleon["x"],
                     "y": self.chameleon["y"]
                 }, open('./identity.json', 'w'))
+        self.load_chameleon(self.chameleon)
         try:
             self.chain = self.load_chain_data()
         except FileNotFoundError:
             pass
+        # 使用持久化的索引，只补充索引之后新写入的区块；索引与链不一致时在后台重建
+        self.index.load(self.chain, snapshot=self.bootstrap_snapshot)
         if peer:
             # 当指定了同步节点时，同步网络信息
             return self.gossip(peer)
@@ -63,21 +196,93 @@ class BlockChain:
             self.character = "leader"
             # 如果本地没有链的信息则创建新的
             if len(self.chain) == 0:
-                self.broadcast_block(self.generate_block())
+                self.seal_block([])
             return True
 
+    # 加载变色龙哈希参数
+    # g、y 在 leader 任期内不变，只反序列化一次并建立预计算表
+    def load_chameleon(self, chameleon):
+        self.chameleon = chameleon
+        self.chameleon_params = {
+            "g": hashTool.FixedBase(hashTool.chameleon_deserialize(chameleon["g"])),
+            "y": hashTool.FixedBase(hashTool.chameleon_deserialize(chameleon["y"]))
+        }
+        if "x" in chameleon:
+            self.chameleon_params["x"] = hashTool.chameleon_deserialize(chameleon["x"])
+
     def load_chain_data(self):
         if self.testmode:
             return self.chain
         else:
-            try:
-                return json.load(open('./chain.json', 'r'))
-            except FileNotFoundError:
-                return []
+            if self.store is None:
+                self.store = BlockStore('./chain_data')
+                self.index = ChainIndex(os.path.join('./chain_data', 'chain_index.db'))
+            # 兼容旧版本保存的 chain.json
+            if len(self.store) == 0 and os.path.exists('./chain.json'):
+                self.store.reset(json.load(open('./chain.json', 'r')))
+            # 从快照启动的节点，存储中的第一个区块为快照对应的区块
+            if os.path.exists('./snapshot.json'):
+                snapshot = json.load(open('./snapshot.json', 'r'))
+                if len(self.store) and self.store.get(0)["block_hash"] == snapshot["header"]["block_hash"]:
+                    revoke_snapshot_identities(snapshot, self.load_snapshot_revisions())
+                    self.bootstrap_snapshot = snapshot
+                    return PrunedChain(snapshot["height"], LazyChain(self.store, self.memory_budget))
+                # 写入快照的过程中断，丢弃后重新同步
+                self.remove_snapshot()
+                self.store.reset([])
+            return LazyChain(self.store, self.memory_budget)
 
+    # 读取从快照启动后应用过的、快照之前区块的修改
+    def load_snapshot_revisions(self):
+        revisions = []
+        try:
+            with open('./snapshot_revisions.json', 'r') as f:
+                for line in f:
+                    try:
+                        revisions.append(json.loads(line))
+                    except ValueError:
+                        # 写入中途崩溃留下的不完整记录
+                        break
+        except FileNotFoundError:
+            pass
+        return revisions
+
+    # 删除本地快照及其之后应用的修改
+    def remove_snapshot(self):
+        for path in ('./snapshot.json', './snapshot_revisions.json'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    # 将链尾新增的区块追加写入存储
+    @tracing.traced("save_chain_data")
     def save_chain_data(self):
         if not self.testmode:
-            json.dump(self.chain, open('./chain.json', 'w'))
+            for height in range(getattr(self.chain, "base", 0) + len(self.store), len(self.chain)):
+                self.store.append(self.chain[height])
+
+    # 记录被修改的区块
+    def save_block(self, height):
+        if not self.testmode:
+            self.store.revise(height - getattr(self.chain, "base", 0), self.chain[height])
+
+    # 用同步得到的区块替换整条链
+    # blocks 为写入临时存储的 LazyChain 时，直接换入该存储的数据
+    def replace_chain(self, blocks):
+        with self.chain_lock.write():
+            if self.testmode:
+                self.chain = blocks
+            else:
+                if isinstance(blocks, LazyChain):
+                    self.store.swap(blocks.store)
+                else:
+                    self.store.reset(blocks)
+                self.chain = LazyChain(self.store, self.memory_budget)
+                if self.bootstrap_snapshot is not None:
+                    self.remove_snapshot()
+            self.bootstrap_snapshot = None
+            with self.merkle_lock:
+                self.merkle_cache.clear()
+            self.index.rebuild(self.chain)
 
     # 与 peer 通信
     def gossip(self, peer):
@@ -100,9 +305,12 @@ class BlockChain:
                     if info['character'] == "leader":
                         # 将获取到的leader信息写入
                         self.leader = info["leader"]
-                        self.chameleon = info["leader"]["chameleon"]
+                        self.load_chameleon(info["leader"]["chameleon"])
                         self.info["term"] = info["current_term"]
                         self.character = "follower"
+                        # 新节点先从 leader 的快照启动，再同步快照之后的区块
+                        if len(self.chain) == 0:
+                            self.bootstrap()
                         # 同步区块
                         self.sync_block()
                     else:
@@ -117,20 +325,32 @@ class BlockChain:
                 return True
             else:
                 # 如果该节点无法正常访问，则从列表中删除
-                self.peer_list.remove(peer)
+                self.remove_peer(peer)
                 return False
         except:
             return False
 
-    # 添加新节点
+    @property
+    def peer_list(self):
+        return self.membership.peers()
+
+    # 添加新节点，host 与 port 相同的旧记录会被替换
     def add_peer(self, peer):
-        peer_list_copy = self.peer_list.copy()
-        for node in peer_list_copy:
-            if node["host"] == peer["host"] and node["port"] == peer["port"]:
-                self.peer_list.remove(node)
-        self.peer_list.append(peer)
+        self.membership.add(peer)
         return True
 
+    # 删除节点，节点不在列表中时忽略
+    def remove_peer(self, peer):
+        self.membership.remove(peer)
+
+    # 关闭与节点的连接，节点从列表中删除时由 membership 调用
+    def close_peer(self, peer):
+        self.transport.close(peer)
+
+    # 用 leader 发来的完整节点列表替换本地列表（旧版本 leader 的心跳）
+    def set_peers(self, peers):
+        self.membership.replace(peers)
+
     def test_connection(self, peer, code):
         url = "http://{host}:{port}/daemon".format(**peer)
         message = json.dumps({
@@ -150,12 +370,13 @@ class BlockChain:
     # 选举节点
     def election(self):
         leader_term = self.leader["term"] + 1
+        peer_list = self.peer_list
         peer_term = {}
-        for i in range(0, len(self.peer_list)):
-            peer_term[self.peer_list[i]["term"]] = i
+        for i in range(0, len(peer_list)):
+            peer_term[peer_list[i]["term"]] = i
         for i in range(leader_term, self.info["term"]):
             if i in peer_term:
-                url = "http://{host}:{port}/election".format(**self.peer_list[peer_term[i]])
+                url = "http://{host}:{port}/election".format(**peer_list[peer_term[i]])
                 message = json.dumps({
                     "code": 2
                 })
@@ -174,11 +395,14 @@ class BlockChain:
         self.leader = {"host": self.info['host'], "port": self.info['port'], "public_key": self.public_key,
                        "term": self.info['term']}
         self.character = "leader"
-        peer_list_copy = self.peer_list.copy()
-        for node in peer_list_copy:
+        # 新节点从 leader 的快照启动；本节点自身可能是从快照启动的（没有快照之前的区块），
+        # 或者持有的是之前任期的快照，立即制作新的快照，而不是等到下一个 SNAPSHOT_INTERVAL
+        if len(self.chain):
+            self.make_snapshot()
+        for node in self.peer_list:
             self.current_term = max(self.current_term, node["term"] + 1)
             if node["host"] == self.info["host"] and node["port"] == self.info["port"]:
-                self.peer_list.remove(node)
+                self.remove_peer(node)
                 continue
             url = "http://{host}:{port}/election".format(**node)
             message = json.dumps({
@@ -193,7 +417,7 @@ class BlockChain:
                 else:
                     raise Exception
             except:
-                self.peer_list.remove(node)
+                self.remove_peer(node)
 
     # 选举
     # 接收到的term小于等于自己，就认可
@@ -213,12 +437,16 @@ class BlockChain:
             return None
 
     # 生成区块
-    # data: transaction 构成的 array
-    def generate_block(self):
-        if len(self.chain):
-            # 当前链长度不为零，则读取最新块的数据
-            latest_block = self.chain[-1]
-        else:
+    # transactions: transaction 构成的 array，为 None 时取走交易池中的全部交易
+    @tracing.traced("generate_block")
+    @GENERATE_BLOCK_SECONDS.time()
+    def generate_block(self, transactions=None):
+        if transactions is None:
+            transactions = self.transaction_pool.take()
+        # 读取最新块的数据
+        with self.chain_lock.read():
+            latest_block = self.chain[-1] if len(self.chain) else None
+        if latest_block is None:
             # 当前链长为0，表示新建节点，初始化创世区块
             latest_block = {
                 "index": -1,
@@ -227,26 +455,28 @@ class BlockChain:
             transaction = {
                 "message": "genesis block"
             }
-            self.transaction_pool.append(self.sign_transaction(transaction))
+            transactions.append(self.sign_transaction(transaction))
 
         # 当前交易池中没有数据，则填充null
-        if len(self.transaction_pool) == 0:
+        if len(transactions) == 0:
             transaction = {
                 "message": "NULL"
             }
-            self.transaction_pool.append(self.sign_transaction(transaction))
+            transactions.append(self.sign_transaction(transaction))
 
         # 区块头信息：index timestamp previous_hash merkle_root，用这些计算hash
         index = latest_block['index'] + 1
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         previous_hash = latest_block["block_hash"]
-        merkle_tree = hashTool.merkel_tree(self.transaction_pool)
+        with tracing.span("merkle_tree", transactions=len(transactions)):
+            merkle_tree = hashTool.merkel_tree(transactions)
         merkle_root = merkle_tree["hash"]
         block_msg = str(index) + timestamp + previous_hash + merkle_root
-        r, s, block_hash = hashTool.chameleon_hash(
-            hashTool.chameleon_deserialize(self.chameleon["g"]),
-            hashTool.chameleon_deserialize(self.chameleon["y"]),
-            block_msg)
+        with tracing.span("chameleon_hash"):
+            r, s, block_hash = hashTool.chameleon_hash(
+                self.chameleon_params["g"],
+                self.chameleon_params["y"],
+                block_msg)
         # 组成区块
         block = {
             "index": index,
@@ -258,85 +488,365 @@ class BlockChain:
             "r": hashTool.chameleon_serialize(r),
             "s": hashTool.chameleon_serialize(s)
         }
-        self.transaction_pool = []
         return block
 
+    # 打包一批交易生成新区块并广播，由 BlockProducer 调用
+    # 每 SNAPSHOT_INTERVAL 个区块制作一次快照
+    @tracing.traced("seal_block")
+    @SEAL_BLOCK_SECONDS.time()
+    def seal_block(self, transactions):
+        with self.block_lock:
+            # generate_block 会向列表中补充创世或 NULL 交易，失败时只放回原有的交易
+            batch = list(transactions)
+            block = None
+            try:
+                block = self.generate_block(transactions)
+                results = self.broadcast_block(block)
+            except Exception:
+                SEAL_BLOCK_FAILURES.inc()
+                if block is None or self.index.block_height(block["block_hash"]) is None:
+                    # 区块没有写入链中，交易放回交易池等待下次出块
+                    self.transaction_pool.requeue(batch)
+                else:
+                    self.transaction_pool.release(batch)
+                raise
+            # 交易已进入链索引，从交易池的去重集合中移除
+            self.transaction_pool.release(batch)
+            SEALED_TRANSACTIONS.inc(len(batch))
+        if block["index"] % SNAPSHOT_INTERVAL == 0 and block["index"] > 0:
+            self.make_snapshot()
+        return results
+
+    # 制作快照：链尾区块头（含变色龙哈希）与此时的身份和撤销状态，由 leader 签名
+    def make_snapshot(self):
+        with self.chain_lock.read():
+            height = len(self.chain) - 1
+            header = block_header(self.chain[height])
+            identities = self.index.export_identities()
+        snapshot = {
+            "height": height,
+            "header": header,
+            "identities": identities["identities"],
+            "public_keys": identities["public_keys"],
+            "messages": identities["messages"],
+            "public_key": self.public_key
+        }
+        snapshot["signature"] = hashTool.sign(self.private_key, signed_message(snapshot))
+        self.snapshot = snapshot
+        return snapshot
+
+    # 验证快照：由当前 leader 签名，区块头的变色龙哈希有效
+    def verify_snapshot(self, snapshot):
+        try:
+            if snapshot["public_key"] != self.leader["public_key"] or snapshot["header"]["index"] != snapshot["height"]:
+                return False
+            if not hashTool.validate_signature(public_key=snapshot["public_key"], signature=snapshot["signature"],
+                                               message=signed_message(snapshot)):
+                return False
+            return blockVerifier.verify_block(self.chameleon_params["g"], self.chameleon_params["y"],
+                                              block_header(snapshot["header"]))
+        except (KeyError, TypeError):
+            return False
+
+    # 从 leader 的最新快照启动，之后只需同步快照之后的区块
+    # 快照之前的区块不会被同步，链为 PrunedChain
+    def bootstrap(self):
+        url = "http://{host}:{port}/snapshot".format(**self.leader)
+        try:
+            r = requests.get(url=url, timeout=SYNC_TIMEOUT)
+            snapshot = json.loads(r.text).get("snapshot")
+        except:
+            return False
+        if not snapshot or not self.verify_snapshot(snapshot):
+            return False
+        header = block_header(snapshot["header"])
+        with self.chain_lock.write():
+            if self.testmode:
+                blocks = [header]
+            else:
+                self.remove_snapshot()
+                json.dump(snapshot, open('./snapshot.json', 'w'))
+                self.store.reset([header])
+                blocks = LazyChain(self.store, self.memory_budget)
+            self.chain = PrunedChain(snapshot["height"], blocks)
+            self.bootstrap_snapshot = snapshot
+            with self.merkle_lock:
+                self.merkle_cache.clear()
+            self.index.rebuild(self.chain, snapshot=snapshot)
+        return True
+
     # 将生成的区块链广播出去
+    # 并发发送给所有节点，返回每个节点的发送结果 {"host:port": {"ok", "status", "elapsed", "error"}}
+    @tracing.traced("broadcast_block")
+    @BROADCAST_BLOCK_SECONDS.time()
     def broadcast_block(self, block):
-        # 验证区块
-        if len(self.chain) == 0 or block["previous_hash"] == self.chain[-1]["block_hash"]:
-            self.chain.append(block)
-        self.save_chain_data()
-        for peer in self.peer_list:
-            url = "http://{host}:{port}/block".format(**peer)
-            message = json.dumps({
+        with self.chain_lock.write():
+            # 验证区块
+            if len(self.chain) == 0 or block["previous_hash"] == self.chain[-1]["block_hash"]:
+                self.chain.append(block)
+                self.index.add_block(len(self.chain) - 1, block)
+            self.save_chain_data()
+        return self.push_block(self.peer_list, block)
+
+    # 发送完整区块，支持二进制编码的节点接收二进制格式，其他节点接收 JSON
+    @tracing.traced("push_block")
+    def push_block(self, peers, block):
+        binary_peers = [peer for peer in peers if peer.get("codec") == blockCodec.VERSION]
+        json_peers = [peer for peer in peers if peer.get("codec") != blockCodec.VERSION]
+        results = {}
+        if binary_peers:
+            results.update(self.transport.broadcast(binary_peers, "/block", blockCodec.encode_block(block),
+                                                    headers={"Content-type": blockCodec.CONTENT_TYPE}))
+        if json_peers:
+            results.update(self.transport.broadcast(json_peers, "/block", {
                 "code": 4,
                 "block": block
-            })
-            r = requests.post(url=url, data=message,
-                              headers={'Content-type': 'application/json', 'Accept': 'text/plain'})
-        return True
+            }))
+        return results
 
     # 同步区块
+    # 从本地链尾开始按高度分页向 leader 请求区块，响应为逐行的区块（NDJSON），边接收边验证并写入链中
+    # 同步中断后再次调用会从本地已验证的链尾继续
+    @tracing.traced("sync_block")
     def sync_block(self):
-        if len(self.chain):
-            latest_hash = self.chain[-1]["block_hash"]
-        else:
-            latest_hash = "Empty"
-        url = "http://{host}:{port}/block".format(**self.leader)
+        # 已有线程在同步时直接返回
+        if not self.sync_lock.acquire(blocking=False):
+            return
+        url = "http://{host}:{port}/block/range".format(**self.leader)
+        sync_start = time.perf_counter()
         try:
-            r = requests.get(url=url, params={"block_hash": latest_hash})
-            if r.status_code == 200:
-                info = json.loads(r.text)
-                if info["status"] == "OK":
-                    self.chain.extend(info["blocks"])
-                elif info["status"] == "Error":
-                    self.chain = info["blocks"]
-                self.save_chain_data()
+            while True:
+                with self.chain_lock.read():
+                    start = len(self.chain)
+                    params = {"start": start, "limit": SYNC_PAGE_SIZE}
+                    if start:
+                        params["block_hash"] = self.chain[-1]["block_hash"]
+                if self.light:
+                    params["mode"] = "header"
+                r = requests.get(url=url, params=params, stream=True, timeout=SYNC_TIMEOUT,
+                                 headers=tracing.headers({"Accept": SYNC_ACCEPT}))
+                if r.status_code == 409:
+                    # 本地链与 leader 不一致，从创世区块开始重新同步
+                    self.resync_chain(url)
+                    return
+                if r.status_code == 410:
+                    # leader 从快照启动，没有本地链尾之后的区块，改为从 leader 的快照启动后继续同步
+                    if self.bootstrap():
+                        continue
+                    return
+                if r.status_code != 200:
+                    return
+                received = 0
+                # 已提交验证、尚未写入链中的一批区块 (previous, blocks, verification)
+                pending = None
+                for blocks, trees in self.read_block_stream(r):
+                    received += len(blocks)
+                    self.leader_height = max(self.leader_height, blocks[-1]["index"])
+                    # 先提交本批区块的验证，再等待上一批的结果，进程池验证的同时继续接收
+                    if pending:
+                        previous = pending[1][-1]
+                    else:
+                        with self.chain_lock.read():
+                            previous = self.chain[-1] if len(self.chain) else None
+                    batch = (previous, blocks,
+                             blockVerifier.verify_blocks(self.chameleon, self.chameleon_params, blocks, previous, trees))
+                    if pending and not self.append_batch(*pending):
+                        batch[2].cancel()
+                        return
+                    pending = batch
+                if pending and not self.append_batch(*pending):
+                    return
+                if received < SYNC_PAGE_SIZE:
+                    return
         except:
             pass
+        finally:
+            SYNC_BLOCK_SECONDS.observe(time.perf_counter() - sync_start)
+            self.sync_lock.release()
+
+    # 从创世区块开始同步整条链，全部验证通过才替换本地链
+    # 非测试模式下验证通过的区块逐批写入临时存储，不在内存中保存整条链，完成后换入本地存储
+    def resync_chain(self, url):
+        staging = None
+        if self.testmode:
+            verified = []
+        else:
+            # 上次重新同步中断留下的临时存储
+            shutil.rmtree(SYNC_STAGING_PATH, ignore_errors=True)
+            staging = BlockStore(SYNC_STAGING_PATH, fsync=False)
+            verified = LazyChain(staging, self.memory_budget)
+        try:
+            while True:
+                params = {"start": len(verified), "limit": SYNC_PAGE_SIZE}
+                if verified:
+                    params["block_hash"] = verified[-1]["block_hash"]
+                if self.light:
+                    params["mode"] = "header"
+                r = requests.get(url=url, params=params, stream=True, timeout=SYNC_TIMEOUT,
+                                 headers=tracing.headers({"Accept": SYNC_ACCEPT}))
+                if r.status_code == 410:
+                    # leader 从快照启动，没有创世区块，改为从 leader 的快照启动
+                    self.bootstrap()
+                    return
+                if r.status_code != 200:
+                    return
+                received = 0
+                # 与 sync_block 相同，等待上一批的验证结果时下一批已经提交
+                pending = None
+                for blocks, trees in self.read_block_stream(r):
+                    received += len(blocks)
+                    if pending:
+                        previous = pending[0][-1]
+                    else:
+                        previous = verified[-1] if verified else None
+                    batch = (blocks, blockVerifier.verify_blocks(self.chameleon, self.chameleon_params, blocks,
+                                                                 previous, trees))
+                    if pending and not stage_batch(verified, *pending):
+                        batch[1].cancel()
+                        return
+                    pending = batch
+                if pending and not stage_batch(verified, *pending):
+                    return
+                if received < SYNC_PAGE_SIZE:
+                    break
+            self.replace_chain(verified)
+            staging = None
+        finally:
+            if staging is not None:
+                staging.close()
+                shutil.rmtree(SYNC_STAGING_PATH, ignore_errors=True)
+
+    # 读取区块流，每次返回最多 SYNC_BATCH_SIZE 个区块及其 MerkleTree (blocks, trees)
+    # 根据响应的 Content-Type 解析二进制编码或逐行的 JSON；JSON 格式的区块没有预先构建的树，对应项为 None
+    def read_block_stream(self, response):
+        if response.headers.get("Content-Type", "").startswith(blockCodec.CONTENT_TYPE):
+            stream = blockCodec.decode_frames(response.iter_content(chunk_size=64 * 1024))
+        else:
+            stream = ((json.loads(line), None) for line in response.iter_lines() if line)
+        blocks, trees = [], []
+        for blk, tree in stream:
+            if self.light:
+                blk, tree = block_header(blk), None
+            blocks.append(blk)
+            trees.append(tree)
+            if len(blocks) >= SYNC_BATCH_SIZE:
+                yield blocks, trees
+                blocks, trees = [], []
+        if blocks:
+            yield blocks, trees
+
+    # 按高度范围逐个返回区块，用于流式发送
+    # 每批区块在读锁内取出，发送过程中不持有锁
+    def iter_blocks(self, start, end, header_only=False):
+        with self.chain_lock.read():
+            end = min(end, len(self.chain))
+        for height in range(start, end, SYNC_BATCH_SIZE):
+            with self.chain_lock.read():
+                blocks = self.chain[height:min(height + SYNC_BATCH_SIZE, end)]
+            for blk in blocks:
+                yield block_header(blk) if header_only else blk
+
+    # 本地最早保存的区块高度，从快照启动时为快照高度
+    def chain_base(self):
+        return getattr(self.chain, "base", 0)
+
+    # 检查本地指定高度的区块哈希是否一致
+    def check_block(self, height, block_hash):
+        with self.chain_lock.read():
+            return getattr(self.chain, "base", 0) <= height < len(self.chain) and \
+                self.chain[height]["block_hash"] == block_hash
+
+    # 验证并追加同步得到的区块，返回追加的区块数
+    # 区块链接关系顺序检查，变色龙哈希与 merkle 根由进程池并行验证，验证通过的区块按顺序依次写入链中
+    # 验证期间不持有锁，写入前确认链尾未被其他线程改变
+    # trees: 可选，解码时构建的 MerkleTree，含义同 blockVerifier.verify_blocks
+    @tracing.traced("append_blocks")
+    def append_blocks(self, blocks, trees=None):
+        with self.chain_lock.read():
+            previous = self.chain[-1] if len(self.chain) else None
+        return self.append_verified(previous, blockVerifier.verify_blocks(self.chameleon, self.chameleon_params,
+                                                                          blocks, previous, trees))
+
+    # 写入同步中的一批区块并保存，全部验证通过时返回 True
+    def append_batch(self, previous, blocks, verification):
+        appended = self.append_verified(previous, verification)
+        SYNCED_BLOCKS.inc(appended)
+        if appended < len(blocks):
+            # 区块验证失败，停止同步
+            return False
+        self.save_chain_data()
+        return True
+
+    # 按顺序写入验证通过的区块，previous 为验证时使用的链尾，返回写入的区块数
+    def append_verified(self, previous, verification):
+        verified = list(verification)
+        with self.chain_lock.write():
+            tail = self.chain[-1] if len(self.chain) else None
+            if (tail and tail["block_hash"]) != (previous and previous["block_hash"]):
+                return 0
+            for blk in verified:
+                self.chain.append(blk)
+                self.index.add_block(len(self.chain) - 1, blk)
+        return len(verified)
 
     # 发送区块
     # latest_hash 对方拥有的最新块的哈希
     # 如果返回值为[]说明对方同步到最新了
     # 否则返回剩余所有区块
     # 如果查不到，返回 False
-    def send_block(self, latest_hash):
+    # header_only 为 True 时只返回区块头，供轻节点同步
+    def send_block(self, latest_hash, header_only=False):
         if latest_hash:
-            for i in range(0, len(self.chain)):
-                if self.chain[i]["block_hash"] == latest_hash:
-                    return self.chain[i + 1:]
-            return False
+            height = self.index.block_height(latest_hash)
+            if height is None:
+                return False
+            with self.chain_lock.read():
+                blocks = self.chain[height + 1:]
         else:
-            return self.chain
+            with self.chain_lock.read():
+                blocks = self.chain[:]
+        if header_only:
+            return [block_header(blk) for blk in blocks]
+        return blocks
 
     # 接收区块
-    def recv_block(self, block):
-        # 区块头验证
-        block_msg = str(block['index']) + block["timestamp"] + block["previous_hash"] + block[
-            "merkle_root"]
-        block_hash = hashTool.chameleon_verify(g=hashTool.chameleon_deserialize(self.chameleon["g"]),
-                                               y=hashTool.chameleon_deserialize(self.chameleon["y"]),
-                                               msg=block_msg,
-                                               r=hashTool.chameleon_deserialize(block["r"]),
-                                               s=hashTool.chameleon_deserialize(block["s"]))
+    # tree: 可选，解码二进制区块时构建的 MerkleTree，验证 merkle 根并放入缓存，撤销交易时无需重新构建
+    @tracing.traced("recv_block")
+    @RECV_BLOCK_SECONDS.time()
+    def recv_block(self, block, tree=None):
+        if self.light:
+            block, tree = block_header(block), None
+        # 区块头验证（变色龙哈希与 merkle 根）
         # 当区块头验证成功
-        if hashTool.chameleon_serialize(block_hash) == block["block_hash"]:
-            # 先看是否是最新区块
-            if block["previous_hash"] == self.chain[-1]["block_hash"]:
-                self.chain.append(block)
-                return True
-            else:
+        with VERIFY_BLOCK_SECONDS.time(), tracing.span("verify_block"):
+            verified = blockVerifier.verify_block(self.chameleon_params["g"], self.chameleon_params["y"], block, tree)
+        if verified:
+            self.leader_height = max(self.leader_height, block["index"])
+            with self.chain_lock.write():
+                # 先看是否是最新区块
+                if block["previous_hash"] == self.chain[-1]["block_hash"]:
+                    self.chain.append(block)
+                    self.index.add_block(len(self.chain) - 1, block)
+                    self.cache_merkle_tree(len(self.chain) - 1, tree)
+                    self.save_chain_data()
+                    return True
                 # 如果新区块接续不上，查找是否是修改后的区块
-                for blk in self.chain:
-                    if blk["block_hash"] == block["block_hash"]:
-                        # 更新区块信息：
-                        for key in block:
-                            blk[key] = block[key]
-                        return True
-                # 如果不是更新的区块，则触发同步
-                self.sync_block()
-                return True
+                height = self.index.block_height(block["block_hash"])
+                if height is not None:
+                    # 更新区块信息（生成新的区块对象替换旧区块）：
+                    blk = dict(self.chain[height])
+                    blk.update(block)
+                    with self.index.revision(height):
+                        self.chain[height] = blk
+                        with self.merkle_lock:
+                            self.merkle_cache.pop(height, None)
+                        self.cache_merkle_tree(height, tree)
+                        self.index.update_block(height, blk)
+                        self.save_block(height)
+                    return True
+            # 如果不是更新的区块，则触发同步
+            self.sync_block()
+            return True
         else:
             # 如果区块头验证失败，直接返回False
             return False
@@ -349,114 +859,389 @@ class BlockChain:
             data = {"code": 6, "action": "REVOKE", "msg": msg}
             url = "http://{host}:{port}/block".format(**self.leader)
             requests.post(url=url, data=json.dumps(data),
-                              headers={'Content-type': 'application/json', 'Accept': 'text/plain'})
+                          headers=tracing.headers({'Content-type': 'application/json', 'Accept': 'text/plain'}))
         else:
-            block_hash = msg["block_hash"]
-            transaction_hash = msg["transaction_hash"]
-            # 在链上查询要修改的块
-            for block in self.chain:
-                # 找到对应的块
-                if block['block_hash'] == block_hash:
-                    # 查询具体交易并修改
-                    status, new_tree = self.revoke_transaction(block["merkle_tree"], transaction_hash)
-                    if status:
-                        block["merkle_tree"] = new_tree
-                        block["merkle_root"] = new_tree["hash"]
-                        # 重新计算hash
-                        index = block["index"]
-                        timestamp = block["timestamp"]
-                        previous_hash = block["previous_hash"]
-                        merkle_root = block["merkle_root"]
-                        block_msg = str(index) + timestamp + previous_hash + merkle_root
-                        r, s = hashTool.chameleon_adjust(
-                            hashTool.chameleon_deserialize(self.chameleon["g"]),
-                            hashTool.chameleon_deserialize(self.chameleon["x"]),
-                            block_msg,
-                            hashTool.chameleon_deserialize(block["block_hash"]))
-                        # 更新区块中的r和s值
-                        block["r"] = hashTool.chameleon_serialize(r)
-                        block["s"] = hashTool.chameleon_serialize(s)
-                        # 插入更新区块的交易
-                        info = {
-                            "index": block["index"],
-                            "new_r": block["r"],
-                            "new_s": block["s"],
-                            "new_MH_root": block["merkle_root"]
-                        }
-                        update_transaction = {"message": json.dumps(info)}
-                        self.transaction_pool.append(self.sign_transaction(update_transaction))
-                        # 将修改后的区块广播出去
-                        self.broadcast_block(block)
-                        return True
+            return self.revoke_from_blocks([msg])[0]
+
+    # 批量修改区块中的交易
+    # msgs: [{"block_hash": xx, "transaction_hash": xx}, ...]
+    # 按区块分组，同一区块中的交易一起替换为占位叶子，每个区块只重新计算一次 r、s 并广播一次，
+    # 所有被修改区块的信息写入同一条更新交易
+    # 返回值：与 msgs 顺序一致的撤销结果列表
+    @tracing.traced("revoke_from_blocks")
+    def revoke_from_blocks(self, msgs):
+        # 如果自己不是leader，则整批转发给leader处理
+        if self.character != "leader":
+            url = "http://{host}:{port}/block".format(**self.leader)
+            try:
+                r = requests.post(url=url, data=json.dumps({"code": 6, "action": "REVOKE_BATCH", "msgs": msgs}),
+                                  headers=tracing.headers({'Content-type': 'application/json', 'Accept': 'text/plain'}))
+                if r.status_code == 200 and json.loads(r.text)["code"] == 1:
+                    return json.loads(r.text)["results"]
+            except:
+                pass
+            return [False] * len(msgs)
+        results = [False] * len(msgs)
+        # 区块高度 -> 该区块中待撤销交易在 msgs 中的序号
+        groups = OrderedDict()
+        for i in range(len(msgs)):
+            try:
+                height = self.index.block_height(msgs[i]["block_hash"])
+            except (KeyError, TypeError):
+                continue
+            if height is not None:
+                groups.setdefault(height, []).append(i)
+        updates = []
+        # [(修改后的区块, 被撤销的交易哈希列表), ...]
+        revised = []
+        # 与出块互斥，避免修改区块的同时生成新区块
+        with self.block_lock:
+            for height in groups:
+                # 修改 merkle 树与重新计算 r、s 期间持有写锁，读线程不会看到修改到一半的区块
+                with self.chain_lock.write():
+                    # 生成新的区块对象，已被其他线程取得的旧区块保持不变
+                    block = dict(self.chain[height])
+                    revoked = []
+                    try:
+                        for i in groups[height]:
+                            transaction_hash = msgs[i].get("transaction_hash")
+                            # 查询具体交易并修改
+                            location = self.index.locate_transaction(transaction_hash)
+                            status, new_tree = self.revoke_transaction(block.get("merkle_tree"), transaction_hash, height)
+                            if status:
+                                block["merkle_tree"] = new_tree
+                                revoked.append((transaction_hash, location[1]))
+                                results[i] = True
+                        if not revoked:
+                            continue
+                        block["merkle_root"] = block["merkle_tree"]["hash"]
+                        self.rehash_block(block)
+                        # 替换区块，更新索引并记录修改
+                        with self.index.revision(height):
+                            self.chain[height] = block
+                            tree = self.merkle_tree(height)
+                            for transaction_hash, position in revoked:
+                                self.index.revoke_transaction(height, transaction_hash, tree.leaves[position])
+                            self.save_block(height)
+                    except Exception:
+                        # 缓存中的 merkle 树可能已被部分修改，丢弃后从链中的区块重新构建
+                        with self.merkle_lock:
+                            self.merkle_cache.pop(height, None)
+                        raise
+                updates.append({
+                    "index": block["index"],
+                    "new_r": block["r"],
+                    "new_s": block["s"],
+                    "new_MH_root": block["merkle_root"]
+                })
+                revised.append((block, [transaction_hash for transaction_hash, position in revoked]))
+            # 插入更新区块的交易，只修改了一个区块时与单条撤销的格式相同
+            if updates:
+                info = updates[0] if len(updates) == 1 else {"updates": updates}
+                update_transaction = {"message": json.dumps(info)}
+                self.transaction_pool.append(self.sign_transaction(update_transaction))
+        # 将区块的修改广播出去
+        for block, removed in revised:
+            self.broadcast_revision(block, removed)
+        return results
+
+    # 广播区块修改
+    # 只发送区块哈希、被撤销的交易哈希、新的 r、s 与 merkle_root，由各节点在本地修改并验证
+    # 修改由 leader 签名，从快照启动、没有该区块的节点据此更新身份状态
+    # 无法应用修改的节点（例如缺少该区块或交易）改为接收完整区块
+    def broadcast_revision(self, block, removed):
+        peer_list = self.peer_list
+        revision = {
+            "block_hash": block["block_hash"],
+            "removed": removed,
+            "merkle_root": block["merkle_root"],
+            "r": block["r"],
+            "s": block["s"]
+        }
+        revision["signature"] = hashTool.sign(self.private_key, signed_message(revision))
+        results = self.transport.broadcast(peer_list, "/block", {
+            "code": 5,
+            "revision": revision
+        })
+        failed = []
+        for peer in peer_list:
+            result = results[peer_key(peer)]
+            try:
+                if result["ok"] and json.loads(result["response"])["code"] == 1:
+                    continue
+            except (KeyError, TypeError, ValueError):
+                pass
+            failed.append(peer)
+        if failed:
+            results.update(self.push_block(failed, block))
+        return results
+
+    # 应用 leader 发来的区块修改
+    # revision: {"block_hash", "removed": [被撤销的交易哈希, ...], "merkle_root", "r", "s", "signature"}
+    # 将被撤销的交易替换为占位叶子后，检查 merkle 根与 revision 一致，且新的 r、s 仍满足原区块哈希
+    # 轻节点没有 merkle 树，只更新并验证区块头
+    # 返回值：是否成功应用，失败时本地区块保持不变
+    @tracing.traced("apply_revision")
+    def apply_revision(self, revision):
+        try:
+            height = self.index.block_height(revision["block_hash"])
+            removed = list(revision["removed"])
+            changes = {"merkle_root": revision["merkle_root"], "r": revision["r"], "s": revision["s"]}
+        except (KeyError, TypeError):
+            return False
+        if height is None:
+            return self.apply_pruned_revision(revision)
+        with self.chain_lock.write():
+            block = dict(self.chain[height])
+            block.update(changes)
+            if not blockVerifier.verify_block(self.chameleon_params["g"], self.chameleon_params["y"],
+                                              block_header(block)):
+                return False
+            # 从快照启动的节点，快照对应的区块也只有区块头
+            if self.light or "merkle_tree" not in block:
+                self.chain[height] = block
+                self.save_block(height)
+                return True
+            tree = self.merkle_tree(height)
+            positions = []
+            for tran_hash in removed:
+                position = tree.position(tran_hash)
+                if position is None:
+                    break
+                block["merkle_tree"] = tree.tombstone(position, block["merkle_tree"],
+                                                      chainIndex.is_identity_transaction(tree.leaves[position]))
+                positions.append(position)
+            if len(positions) != len(removed) or tree.root != block["merkle_root"]:
+                # 缓存中的 merkle 树可能已被部分修改，丢弃后从链中的区块重新构建
+                with self.merkle_lock:
+                    self.merkle_cache.pop(height, None)
+                return False
+            with self.index.revision(height):
+                self.chain[height] = block
+                for tran_hash, position in zip(removed, positions):
+                    self.index.revoke_transaction(height, tran_hash, tree.leaves[position])
+                self.save_block(height)
+        return True
+
+    # 应用快照之前（已被裁剪）区块的修改
+    # 本地没有该区块，无法验证 merkle 根与 r、s，改为验证 leader 对修改内容的签名，然后只更新身份状态
+    # 应用过的修改追加到 snapshot_revisions.json，重启后与快照一起恢复
+    def apply_pruned_revision(self, revision):
+        if self.bootstrap_snapshot is None:
+            return False
+        try:
+            if not isinstance(revision["removed"], list) or \
+                    not all(isinstance(tran_hash, str) for tran_hash in revision["removed"]) or \
+                    not hashTool.validate_signature(public_key=self.leader["public_key"],
+                                                    signature=revision["signature"], message=signed_message(revision)):
+                return False
+        except (KeyError, TypeError):
             return False
+        with self.chain_lock.write():
+            if not self.testmode:
+                with open('./snapshot_revisions.json', 'a') as f:
+                    f.write(json.dumps(revision) + "\n")
+            self.index.revoke_pruned(revision["removed"])
+        return True
+
+    # merkle_root 改变后重新计算 r 和 s，使区块哈希保持不变
+    @tracing.traced("chameleon_adjust")
+    def rehash_block(self, block):
+        block_msg = str(block["index"]) + block["timestamp"] + block["previous_hash"] + block["merkle_root"]
+        r, s = hashTool.chameleon_adjust(
+            self.chameleon_params["g"],
+            self.chameleon_params["x"],
+            block_msg,
+            hashTool.chameleon_deserialize(block["block_hash"]))
+        # 更新区块中的r和s值
+        block["r"] = hashTool.chameleon_serialize(r)
+        block["s"] = hashTool.chameleon_serialize(s)
 
     # 查询具体交易并且进行撤销操作
-    # merkle_tree (list): 待修改区块中的 merkle tree
+    # merkle_tree (dict): 待修改区块中的 merkle tree
     # tran_hash (string): 需要撤销的交易的哈希值
-    # 返回值  (bool, list): 返回执行是否成功，以及重构后的 merkle tree
-    def revoke_transaction(self, merkle_tree, tran_hash):
-        tmp_transaction_list = []
-        hashTool.from_merkel_to_list(merkle_tree, tmp_transaction_list)
-        copy_list = tmp_transaction_list.copy()
-        for i in range(len(copy_list)):
-            # 找到具体交易
-            if copy_list[i]["hash"] == tran_hash:
-                # 操作：将找到的交易直接删除
-                tmp_transaction_list.remove(copy_list[i])
-        # 尝试重构 merkle tree
-        # 如果当前交易数不为0，则进行树结构的重构
-        if len(tmp_transaction_list):
-            # 检查是否真的删除了某条交易，如果没有变化则说明提供的撤销信息有误
-            if copy_list == tmp_transaction_list:
-                return False, merkle_tree
-            # 否则尝试对删除后的交易池重构
-            else:
-                try:
-                    return True, hashTool.merkel_tree(tmp_transaction_list)
-                except:
-                    # 如果重构失败，则返回空
-                    return False, []
-        # 如果撤销之后交易数为0，为了保持区块结构，添加一个 NULL 交易补充
-        else:
-            return True, hashTool.merkel_tree([self.sign_transaction({"message": "NULL"})])
+    # height (int): 待修改区块的高度，用于通过索引定位交易
+    # 返回值  (bool, dict): 返回执行是否成功，以及修改后的 merkle tree
+    # 被撤销的交易替换为占位叶子，只需重新计算该叶子到根路径上的哈希，只复制路径上的节点，merkle_tree 本身不变
+    # 需要在持有 chain_lock 写锁时调用
+    def revoke_transaction(self, merkle_tree, tran_hash, height):
+        # 通过索引定位交易，如果交易不在该区块中则说明提供的撤销信息有误
+        location = self.index.locate_transaction(tran_hash)
+        if location is None or location[0] != height:
+            return False, merkle_tree
+        tree = self.merkle_tree(height)
+        if tree.position(tran_hash) != location[1]:
+            return False, merkle_tree
+        return True, tree.tombstone(location[1], merkle_tree,
+                                    chainIndex.is_identity_transaction(tree.leaves[location[1]]))
 
-    # 验证交易签名
-    def verify_transaction(self, transaction):
+    # 获取区块对应的数组存储 merkle 树，最近使用的保存在缓存中
+    # 需要在持有 chain_lock 时调用
+    def merkle_tree(self, height):
+        with self.merkle_lock:
+            tree = self.merkle_cache.pop(height, None)
+        if tree is None:
+            tree = MerkleTree.from_nested(self.chain[height]["merkle_tree"])
+        with self.merkle_lock:
+            tree = self.merkle_cache.setdefault(height, tree)
+            if len(self.merkle_cache) > 64:
+                self.merkle_cache.popitem(last=False)
+        return tree
+
+    # 将已构建的 merkle 树放入缓存，tree 为 None 时不做处理
+    def cache_merkle_tree(self, height, tree):
+        if tree is None:
+            return
+        with self.merkle_lock:
+            self.merkle_cache[height] = tree
+            if len(self.merkle_cache) > 64:
+                self.merkle_cache.popitem(last=False)
+
+    # 生成交易的包含性证明
+    # 返回值：{"block_hash", "index", "transaction", "proof"}，查不到返回 None
+    def transaction_proof(self, tran_hash):
+        location = self.index.locate_transaction(tran_hash)
+        if location is None or self.light:
+            return None
+        height, position = location
+        with self.chain_lock.read():
+            tree = self.merkle_tree(height)
+            return {
+                "block_hash": self.chain[height]["block_hash"],
+                "index": height,
+                "transaction": tree.leaves[position],
+                "proof": tree.proof(position)
+            }
+
+    # 用本地区块头验证包含性证明，并验证交易本身的签名
+    def verify_inclusion(self, proof):
         try:
-            t_from = transaction["from"]
-            t_message = transaction["message"]
-            t_signature = transaction["signature"]
-            t_hash = transaction["hash"]
-            # 验证哈希
-            current_hash = sha256(
-                bytes.fromhex(t_from) + t_message.encode() + t_signature.encode()).hexdigest()
-            if t_hash != current_hash:
-                # 哈希验证失败
+            height = self.index.block_height(proof["block_hash"])
+            if height is None:
                 return False
-            # 验证签名
-            if hashTool.validate_signature(public_key=t_from, signature=t_signature, message=t_message.encode()):
-                return True
-            else:
-                return False
-        except KeyError:
+            transaction = proof["transaction"]
+            with self.chain_lock.read():
+                merkle_root = self.chain[height]["merkle_root"]
+            return verify_proof(transaction["hash"], proof["proof"], merkle_root) and \
+                self.verify_transaction(transaction)
+        except (KeyError, TypeError):
+            return False
+
+    # 查询身份状态
+    # key: 公钥或身份信息，by: "key" 按公钥查询，"message" 按身份信息查询
+    # 返回值：{"from", "message", "hash", "index", "status"}，查不到返回 None
+    # 轻节点向 leader 查询身份记录，并用证明在本地区块头上验证仍有效的身份
+    def find_identity(self, key, by=chainIndex.KEY):
+        if not self.light:
+            return self.index.find_identity(key, by)
+        try:
+            url = "http://{host}:{port}/api/find".format(**self.leader)
+            r = requests.get(url=url, params={"key": key, "by": by})
+            identity = json.loads(r.text).get("identity")
+            if identity is None or identity["status"] != "active":
+                return identity
+            url = "http://{host}:{port}/proof".format(**self.leader)
+            r = requests.get(url=url, params={"transaction_hash": identity["hash"]})
+            proof = json.loads(r.text).get("proof")
+            if proof and self.verify_inclusion(proof):
+                return identity
+        except:
+            pass
+        return None
+
+    # 验证交易哈希
+    def verify_transaction_hash(self, transaction):
+        try:
+            current_hash = sha256(
+                bytes.fromhex(transaction["from"]) + transaction["message"].encode() +
+                transaction["signature"].encode()).hexdigest()
+            return transaction["hash"] == current_hash
+        except (KeyError, AttributeError, TypeError, ValueError):
+            return False
+
+    # 验证交易签名
+    @tracing.traced("verify_transaction")
+    @VERIFY_TRANSACTION_SECONDS.time()
+    def verify_transaction(self, transaction):
+        if not self.verify_transaction_hash(transaction):
+            # 哈希验证失败
             return False
+        # 验证签名
+        return hashTool.validate_signature(public_key=transaction["from"], signature=transaction["signature"],
+                                           message=transaction["message"].encode())
+
+    # 批量验证交易，签名验证交给进程池并行处理
+    # 返回与 transactions 顺序一致的验证结果列表
+    @tracing.traced("verify_transactions")
+    @VERIFY_TRANSACTIONS_SECONDS.time()
+    def verify_transactions(self, transactions):
+        results = [self.verify_transaction_hash(t) for t in transactions]
+        pending = [i for i in range(len(transactions)) if results[i]]
+        checked = hashTool.validate_signatures(
+            [(transactions[i]["from"], transactions[i]["signature"], transactions[i]["message"].encode())
+             for i in pending])
+        for i, result in zip(pending, checked):
+            results[i] = result
+        return results
 
     # 将交易缓存在本地交易池
+    # 返回 True 表示已接收；False 表示交易无效或重复；None 表示交易池已满，客户端应稍后重试
     def add_transaction(self, transaction):
-        # 如果自己不是leader节点，则将数据发送给leader处理
+        # 如果自己不是leader节点，则将数据发送给leader处理，与其他请求的交易合并发送
         if self.character != 'leader':
-            url = "http://{host}:{port}/transaction".format(**self.leader)
-            r = requests.post(url=url, data=json.dumps({"code": 3, "transaction": transaction}),
-                              headers={'Content-type': 'application/json', 'Accept': 'text/plain'})
-            if r.status_code == 200 and json.loads(r.text)["code"] == 1:
-                return True
-            return False
-        elif self.verify_transaction(transaction):
-            self.transaction_pool.append(transaction)
-            # 触发生成新区块
-            if len(self.transaction_pool) >= self.max_transactions:
-                new_block = self.generate_block()
-                self.broadcast_block(new_block)
-            return True
+            return self.forwarder.forward([transaction])[0]
+        elif self.is_known_transaction(transaction) or not self.verify_transaction(transaction):
+            result = False
         else:
+            # 只负责放入交易池，由 BlockProducer 按数量或等待时间出块
+            result = self.admit_transaction(transaction)
+        TRANSACTIONS.inc(result=ADMISSION_LABELS[result])
+        return result
+
+    # 批量缓存交易，返回与 transactions 顺序一致的结果列表，取值含义与 add_transaction 相同
+    def add_transactions(self, transactions):
+        # 如果自己不是leader节点，则将数据整批发送给leader处理
+        if self.character != 'leader':
+            return self.forwarder.forward(transactions)
+        # 先用哈希去重，重复的交易不再验证签名
+        results = [False] * len(transactions)
+        pending = [i for i in range(len(transactions)) if not self.is_known_transaction(transactions[i])]
+        checked = self.verify_transactions([transactions[i] for i in pending])
+        for i, result in zip(pending, checked):
+            if result:
+                results[i] = self.admit_transaction(transactions[i])
+        for result in (True, False, None):
+            count = results.count(result)
+            if count:
+                TRANSACTIONS.inc(count, result=ADMISSION_LABELS[result])
+        return results
+
+    # 将一批交易发送给 leader，由 forwarder 的后台线程调用
+    def forward_transactions(self, transactions):
+        if self.character == 'leader':
+            # 等待发送期间成为了 leader，直接在本地处理
+            return self.add_transactions(transactions)
+        try:
+            r = self.transport.post(self.leader, "/transaction", {"code": 3, "transactions": transactions},
+                                    timeout=FORWARD_TIMEOUT)
+            results = json.loads(r.text).get("results") if r.status_code in (200, 429) else None
+            # leader 返回的结果需与转发的交易一一对应
+            if isinstance(results, list) and len(results) == len(transactions):
+                return results
+        except:
+            pass
+        return [False] * len(transactions)
+
+    # 交易已在交易池中或已上链，已被撤销的交易同样视为已知，重放撤销前的交易不会被再次接收
+    def is_known_transaction(self, transaction):
+        tran_hash = transaction.get("hash") if isinstance(transaction, dict) else None
+        if not isinstance(tran_hash, str):
             return False
+        return tran_hash in self.transaction_pool or self.index.is_known(tran_hash)
+
+    # 放入交易池，池满时返回 None
+    def admit_transaction(self, transaction):
+        status = self.transaction_pool.add(transaction)
+        if status == txPool.FULL:
+            return None
+        return status == txPool.ADDED
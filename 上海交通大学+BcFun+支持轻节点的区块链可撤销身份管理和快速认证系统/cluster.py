@@ -0,0 +1,510 @@
+import http.client
+import json
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+import requests
+from transaction_tool import make_identity
+
+# 本地多节点集群测试
+# 在回环地址上启动 N 个测试模式的节点（每个节点一个 website.py 进程组），通过真实的 HTTP 接口施加交易与撤销负载，
+# 可以杀死节点或划分网络，最后报告端到端确认延迟、各 follower 的同步延迟和 leader 故障切换时间
+#
+# 每个节点的出站请求都经过本程序为它启动的 HTTP 代理（通过 http_proxy 环境变量），代理知道请求的来源节点和目标节点，
+# 据此模拟网络分区（直接断开连接）和链路延迟，节点代码无需任何修改
+
+# 代理转发时去掉的逐跳请求头
+HOP_HEADERS = ("connection", "keep-alive", "proxy-connection", "proxy-authorization", "transfer-encoding", "te",
+               "trailer", "upgrade")
+# 查询身份时每个请求包含的最多 key 数
+FIND_BATCH = 500
+
+
+def percentile(samples, p):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))]
+
+
+def summary(samples):
+    return {"count": len(samples), "p50": percentile(samples, 50), "p99": percentile(samples, 99),
+            "max": max(samples) if samples else None}
+
+
+# 节点出站请求的代理
+class ProxyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.forward()
+
+    def do_POST(self):
+        self.forward()
+
+    def forward(self):
+        url = urlsplit(self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        cluster = self.server.cluster
+        if not cluster.reachable(self.server.node, url.port):
+            # 网络不通：不返回任何响应直接断开，发送方得到连接错误
+            self.close_connection = True
+            return
+        if cluster.latency:
+            time.sleep(cluster.latency)
+        headers = dict((k, v) for k, v in self.headers.items() if k.lower() not in HOP_HEADERS)
+        try:
+            conn = http.client.HTTPConnection(url.hostname, url.port, timeout=cluster.proxy_timeout)
+            conn.request(self.command, url.path + ("?" + url.query if url.query else ""), body, headers)
+            resp = conn.getresponse()
+        except (OSError, http.client.HTTPException):
+            # 目标节点已停止
+            self.close_connection = True
+            return
+        self.send_response(resp.status)
+        for k, v in resp.getheaders():
+            if k.lower() not in HOP_HEADERS:
+                self.send_header(k, v)
+        if resp.getheader("Content-Length") is None:
+            # 流式响应（例如 /block/range）读到连接关闭为止
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.end_headers()
+        try:
+            while True:
+                chunk = resp.read(65536)
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+        except (OSError, http.client.HTTPException):
+            self.close_connection = True
+        conn.close()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class NodeProxy(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, cluster, node):
+        super(NodeProxy, self).__init__(("127.0.0.1", 0), ProxyHandler)
+        self.cluster = cluster
+        self.node = node
+
+
+class Cluster:
+    def __init__(self, size, base_port=18500, latency=0, workdir=None):
+        self.size = size
+        self.ports = [base_port + i for i in range(size)]
+        self.latency = latency
+        self.proxy_timeout = 60
+        self.workdir = workdir or tempfile.mkdtemp(prefix="bcfun-cluster-")
+        self.processes = {}
+        self.proxies = {}
+        # 节点 -> 分区编号，编号相同的节点之间可以通信
+        self.groups = dict((i, 0) for i in range(size))
+        self.local = threading.local()
+
+    # 本程序自己的请求直接发送，不经过代理
+    def session(self):
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+            self.local.session.trust_env = False
+        return self.local.session
+
+    def url(self, node, path):
+        return "http://127.0.0.1:%d%s" % (self.ports[node], path)
+
+    def node_of(self, port):
+        try:
+            return self.ports.index(int(port))
+        except (ValueError, TypeError):
+            return None
+
+    def reachable(self, source, port):
+        target = self.node_of(port)
+        return target is None or self.groups[source] == self.groups[target]
+
+    def alive(self):
+        return [i for i in range(self.size) if i in self.processes]
+
+    def start(self):
+        for i in range(self.size):
+            self.launch(i)
+        for i in range(self.size):
+            self.wait_ready(i)
+        self.init_node(0, {"genesis": "1"})
+        for i in range(1, self.size):
+            # 逐个加入，避免 leader 分配重复的 term
+            self.init_node(i, {"host": "127.0.0.1", "port": str(self.ports[0])})
+
+    def launch(self, node):
+        proxy = NodeProxy(self, node)
+        threading.Thread(target=proxy.serve_forever, daemon=True).start()
+        self.proxies[node] = proxy
+        path = os.path.join(self.workdir, "node%d" % node)
+        os.makedirs(path, exist_ok=True)
+        env = dict(os.environ)
+        for key in ("no_proxy", "NO_PROXY"):
+            env.pop(key, None)
+        env["http_proxy"] = env["HTTP_PROXY"] = "http://127.0.0.1:%d" % proxy.server_address[1]
+        log = open(os.path.join(path, "node.log"), "w")
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "website.py")
+        self.processes[node] = subprocess.Popen(
+            [sys.executable, script, "-t", "-a", "127.0.0.1", "-p", str(self.ports[node])],
+            cwd=path, env=env, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+
+    def wait_ready(self, node, timeout=30):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                self.session().get(self.url(node, "/init"), timeout=1)
+                return
+            except requests.RequestException:
+                time.sleep(0.2)
+        raise RuntimeError("node %d did not start, see %s" % (node, self.workdir))
+
+    def init_node(self, node, form):
+        self.session().post(self.url(node, "/init"), data=form, timeout=60)
+        if self.status(node) is None:
+            raise RuntimeError("node %d failed to initialize, see %s" % (node, self.workdir))
+
+    # 节点的角色、leader 与节点列表，节点不可达时返回 None
+    def status(self, node):
+        try:
+            r = self.session().post(self.url(node, "/gossip"), data=json.dumps({"code": 1}), timeout=5)
+            return json.loads(r.text)
+        except (requests.RequestException, ValueError):
+            return None
+
+    # 当前 leader 的节点编号：所有存活且可达的节点认同同一个 leader，且该节点自认为 leader
+    def leader(self):
+        views = [self.status(i) for i in self.alive()]
+        keys = set()
+        for view in views:
+            if view is None:
+                return None
+            keys.add(str(view["leader"].get("port")))
+        if len(keys) != 1:
+            return None
+        node = self.node_of(keys.pop())
+        if node not in self.processes:
+            return None
+        view = self.status(node)
+        return node if view and view["character"] == "leader" else None
+
+    # 杀死节点的整个进程组（Flask 的自动重载会启动子进程）
+    def kill(self, node):
+        process = self.processes.pop(node, None)
+        if process is None:
+            return
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        process.wait()
+
+    # 将 nodes 与其余节点隔离
+    def partition(self, nodes):
+        for node in nodes:
+            self.groups[node] = 1
+
+    def heal(self):
+        for node in self.groups:
+            self.groups[node] = 0
+
+    def stop(self, keep=False):
+        for node in list(self.processes):
+            self.kill(node)
+        for proxy in self.proxies.values():
+            proxy.shutdown()
+        if not keep:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+# 确认跟踪
+# 定期向各节点查询已提交的身份，记录每笔交易在每个节点上首次满足 predicate 的时间
+class Tracker(threading.Thread):
+    def __init__(self, cluster, predicate, interval=0.2):
+        super(Tracker, self).__init__()
+        self.daemon = True
+        self.cluster = cluster
+        self.predicate = predicate
+        self.interval = interval
+        # key -> 提交时间
+        self.submitted = {}
+        # 节点 -> {key: 确认时间}
+        self.seen = dict((i, {}) for i in range(cluster.size))
+        self.lock = threading.Lock()
+        self.stopped = False
+
+    def submit(self, keys, when):
+        with self.lock:
+            for key in keys:
+                self.submitted[key] = when
+
+    def pending(self, node):
+        with self.lock:
+            return [key for key in self.submitted if key not in self.seen[node]]
+
+    def poll(self, node):
+        keys = self.pending(node)
+        for i in range(0, len(keys), FIND_BATCH):
+            try:
+                r = self.cluster.session().post(self.cluster.url(node, "/api/find"),
+                                                data=json.dumps({"keys": keys[i:i + FIND_BATCH]}), timeout=10)
+                identities = json.loads(r.text)["identities"]
+            except (requests.RequestException, ValueError, KeyError):
+                return
+            now = time.time()
+            for key, identity in identities.items():
+                if identity and self.predicate(identity):
+                    self.seen[node].setdefault(key, now)
+
+    def run(self):
+        while not self.stopped:
+            start = time.time()
+            for node in self.cluster.alive():
+                self.poll(node)
+            time.sleep(max(0, self.interval - (time.time() - start)))
+
+    # 等待所有被接收的交易在 nodes 上确认，超时返回 False
+    def wait(self, nodes, timeout):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if all(not self.pending(node) for node in nodes):
+                return True
+            time.sleep(self.interval)
+        return False
+
+    # leader: 交易被 leader 确认的节点；nodes: 参与统计的节点
+    def report(self, leader, nodes):
+        with self.lock:
+            submitted = dict(self.submitted)
+        committed = self.seen[leader]
+        commit = [committed[k] - submitted[k] for k in submitted if k in committed]
+        confirm = []
+        for key in submitted:
+            times = [self.seen[node].get(key) for node in nodes]
+            if None not in times:
+                confirm.append(max(times) - submitted[key])
+        lag = {}
+        for node in nodes:
+            if node != leader:
+                lag[node] = summary([self.seen[node][k] - committed[k] for k in committed if k in self.seen[node]])
+                lag[node]["missing"] = len(submitted) - len(self.seen[node])
+        return {"submitted": len(submitted), "committed": len(committed), "commit_latency": summary(commit),
+                "confirm_latency": summary(confirm), "sync_lag": lag}
+
+
+# 以固定速率提交交易，batch 为 1 时使用表单逐条提交，否则以 NDJSON 批量提交
+# 返回被拒绝（结果不为 true）的交易数
+def drive_transactions(cluster, tracker, transactions, rate, batch, clients):
+    batches = [transactions[i:i + batch] for i in range(0, len(transactions), batch)]
+    rejected = [0]
+    lock = threading.Lock()
+    start = time.time()
+
+    def client(worker):
+        for k in range(worker, len(batches), clients):
+            if rate:
+                delay = start + k * batch / rate - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            node = random.choice(cluster.alive())
+            items = batches[k]
+            when = time.time()
+            try:
+                if batch == 1:
+                    r = cluster.session().post(cluster.url(node, "/transaction/add"), data=items[0], timeout=60)
+                    results = [json.loads(r.text)["code"] == 1]
+                else:
+                    body = "\n".join(json.dumps(t) for t in items)
+                    r = cluster.session().post(cluster.url(node, "/transaction/batch"), data=body, timeout=60,
+                                               headers={"Content-type": "application/x-ndjson"})
+                    results = json.loads(r.text)["results"]
+            except (requests.RequestException, ValueError, KeyError):
+                results = [False] * len(items)
+            # 只跟踪被接收的交易
+            tracker.submit([t["from"] for t, result in zip(items, results) if result is True], when)
+            with lock:
+                rejected[0] += sum(1 for result in results if result is not True)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return rejected[0]
+
+
+# 撤销已确认的身份，先从 leader 查询交易所在的区块，再按批发送给随机节点
+def drive_revocations(cluster, tracker, leader, transactions, batch):
+    msgs = []
+    for transaction in transactions:
+        try:
+            r = cluster.session().get(cluster.url(leader, "/proof"), params={"transaction_hash": transaction["hash"]},
+                                      timeout=10)
+            proof = json.loads(r.text)["proof"]
+            msgs.append(({"block_hash": proof["block_hash"], "transaction_hash": transaction["hash"]},
+                         transaction["from"]))
+        except (requests.RequestException, ValueError, KeyError):
+            pass
+    rejected = len(transactions) - len(msgs)
+    for i in range(0, len(msgs), batch):
+        group = msgs[i:i + batch]
+        node = random.choice(cluster.alive())
+        when = time.time()
+        try:
+            r = cluster.session().post(cluster.url(node, "/block"), timeout=60, data=json.dumps(
+                {"code": 6, "action": "REVOKE_BATCH", "msgs": [msg for msg, key in group]}))
+            results = json.loads(r.text)["results"]
+        except (requests.RequestException, ValueError, KeyError):
+            results = [False] * len(group)
+        tracker.submit([key for (msg, key), result in zip(group, results) if result is True], when)
+        rejected += sum(1 for result in results if result is not True)
+    return rejected
+
+
+# 杀死 leader，测量其余节点重新认同一个存活 leader 的时间，超时返回 None
+def measure_failover(cluster, timeout):
+    old = cluster.leader()
+    cluster.kill(old)
+    start = time.time()
+    while time.time() - start < timeout:
+        leader = cluster.leader()
+        if leader is not None:
+            return old, leader, time.time() - start
+        time.sleep(0.2)
+    return old, None, None
+
+
+def print_report(report):
+    def fmt(value):
+        return "-" if value is None else "%.3fs" % value
+
+    for phase in ("transactions", "revocations"):
+        if phase not in report:
+            continue
+        result = report[phase]
+        print("\n[{0}] submitted {1}, rejected {2}, committed {3}".format(
+            phase, result["submitted"], result["rejected"], result["committed"]))
+        for name in ("commit_latency", "confirm_latency"):
+            s = result[name]
+            print("  {0:<16} n={1:<6} p50={2:<9} p99={3:<9} max={4}".format(
+                name, s["count"], fmt(s["p50"]), fmt(s["p99"]), fmt(s["max"])))
+        for node, s in sorted(result["sync_lag"].items()):
+            print("  lag node{0:<8} n={1:<6} p50={2:<9} p99={3:<9} max={4:<9} missing={5}".format(
+                node, s["count"], fmt(s["p50"]), fmt(s["p99"]), fmt(s["max"]), s["missing"]))
+    if "partition" in report:
+        print("\n[partition] isolated {0}, catch-up after heal: {1}".format(
+            report["partition"]["nodes"], dict((n, fmt(t)) for n, t in report["partition"]["catch_up"].items())))
+    if "failover" in report:
+        result = report["failover"]
+        print("\n[failover] killed node{0}, new leader {1}, failover {2}, first commit {3}".format(
+            result["old_leader"], "-" if result["new_leader"] is None else "node%d" % result["new_leader"],
+            fmt(result["failover_time"]), fmt(result["first_commit"])))
+    print("\n[nodes] " + ", ".join("node%d:%s" % (node, character) for node, character in report["characters"]))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument('-n', '--nodes', type=int, default=3, help='number of nodes')
+    parser.add_argument('-p', '--port', type=int, default=18500, help='port of the first node')
+    parser.add_argument('-t', '--transactions', type=int, default=200, help='identities to register')
+    parser.add_argument('-r', '--rate', type=float, default=50, help='transactions per second, 0 for unlimited')
+    parser.add_argument('-b', '--batch', type=int, default=1, help='transactions per request, 1 for form posts')
+    parser.add_argument('-c', '--clients', type=int, default=4, help='concurrent client threads')
+    parser.add_argument('--revocations', type=int, default=20, help='identities to revoke after registration')
+    parser.add_argument('--latency', type=float, default=0, help='added latency per node-to-node request, ms')
+    parser.add_argument('--partition', type=int, default=0, help='followers to isolate during the load')
+    parser.add_argument('--partition-time', type=float, default=5, help='seconds before the partition heals')
+    parser.add_argument('--kill-leader', action="store_true", help='kill the leader and measure failover')
+    parser.add_argument('--poll', type=float, default=0.2, help='confirmation polling interval, seconds')
+    parser.add_argument('--timeout', type=float, default=60, help='seconds to wait for each phase')
+    parser.add_argument('-o', '--output', help='write the report as JSON to OUTPUT')
+    parser.add_argument('--keep', action="store_true", help='keep node logs in the work directory')
+    args = parser.parse_args()
+
+    cluster = Cluster(args.nodes, base_port=args.port, latency=args.latency / 1000)
+    report = {"nodes": args.nodes}
+    try:
+        print("Starting {0} nodes in {1}".format(args.nodes, cluster.workdir))
+        cluster.start()
+        leader = cluster.leader()
+        print("Leader is node{0}".format(leader))
+
+        with ProcessPoolExecutor() as executor:
+            identities = list(executor.map(make_identity, ["Identity_Cluster_%d_%d" % (int(time.time()), i)
+                                                           for i in range(args.transactions)], chunksize=64))
+        transactions = [transaction for transaction, private_key in identities]
+
+        tracker = Tracker(cluster, lambda identity: True, args.poll)
+        tracker.start()
+        isolated = []
+        if args.partition:
+            isolated = random.sample([i for i in cluster.alive() if i != leader], args.partition)
+            cluster.partition(isolated)
+            heal = threading.Timer(args.partition_time, cluster.heal)
+            heal.start()
+            print("Isolated {0} for {1}s".format(isolated, args.partition_time))
+        print("Submitting {0} transactions".format(len(transactions)))
+        rejected = drive_transactions(cluster, tracker, transactions, args.rate, args.batch, args.clients)
+        if args.partition:
+            heal.join()
+            healed = time.time()
+        tracker.wait(cluster.alive(), args.timeout)
+        tracker.stopped = True
+        report["transactions"] = tracker.report(leader, cluster.alive())
+        report["transactions"]["rejected"] = rejected
+        if args.partition:
+            report["partition"] = {"nodes": isolated, "catch_up": dict(
+                (node, max(tracker.seen[node].values()) - healed if not tracker.pending(node) else None)
+                for node in isolated)}
+
+        if args.revocations:
+            committed = [t for t in transactions if t["from"] in tracker.seen[leader]][:args.revocations]
+            revoker = Tracker(cluster, lambda identity: identity["status"] == "revoked", args.poll)
+            revoker.start()
+            print("Revoking {0} identities".format(len(committed)))
+            rejected = drive_revocations(cluster, revoker, leader, committed, max(args.batch, 1))
+            revoker.wait(cluster.alive(), args.timeout)
+            revoker.stopped = True
+            report["revocations"] = revoker.report(leader, cluster.alive())
+            report["revocations"]["rejected"] = rejected
+
+        if args.kill_leader:
+            print("Killing the leader")
+            old, new, elapsed = measure_failover(cluster, args.timeout)
+            first_commit = None
+            if new is not None:
+                # 故障切换后第一笔交易的确认时间
+                transaction, private_key = make_identity("Identity_Failover_%d" % int(time.time()))
+                probe = Tracker(cluster, lambda identity: True, args.poll)
+                probe.start()
+                probe.submit([transaction["from"]], time.time())
+                cluster.session().post(cluster.url(new, "/transaction/add"), data=transaction, timeout=60)
+                if probe.wait([new], args.timeout):
+                    first_commit = probe.seen[new][transaction["from"]] - probe.submitted[transaction["from"]]
+                probe.stopped = True
+            report["failover"] = {"old_leader": old, "new_leader": new, "failover_time": elapsed,
+                                  "first_commit": first_commit}
+
+        report["characters"] = [(node, (cluster.status(node) or {}).get("character", "unreachable"))
+                                for node in cluster.alive()]
+        print_report(report)
+        if args.output:
+            json.dump(report, open(args.output, "w"), indent=2)
+    finally:
+        cluster.stop(args.keep)
@@ -4,6 +4,11 @@ import random
 import requests
 import json
 from blockchain import BlockChain
+from util import metrics
+
+# 心跳请求的耗时与失败次数，role 为发送方的角色
+HEARTBEAT_SECONDS = metrics.histogram("bcfun_heartbeat_seconds", "Time of one daemon heartbeat request")
+HEARTBEAT_FAILURES = metrics.counter("bcfun_heartbeat_failures_total", "Failed daemon heartbeat requests")
 
 
 class BcDaemon(threading.Thread):
@@ -11,44 +16,68 @@ class BcDaemon(threading.Thread):
         super(BcDaemon, self).__init__()
         self.bc = bc
         self.sync_time = dict()
+        # 各 follower 已确认的节点列表版本 (epoch, version)
+        self.acked = dict()
 
     # leader 的守护进程
+    # 各 follower 的心跳通过 transport 的线程池并发发送，每个请求有独立的超时，一个节点无响应不会拖慢其他节点
+    # 心跳只携带对方已确认版本之后的节点列表增量，对方版本未知或不一致时携带完整列表
     def leader_daemon(self):
         while True:
             time.sleep(random.random() + 6)
-            # 更新leader的peer_list
-            peer_list_copy = self.bc.peer_list.copy()
-            for peer in peer_list_copy:
+            # peer_list 为写时复制，直接取当前列表作为快照
+            futures = []
+            for peer in self.bc.peer_list:
                 if time.time() - self.sync_time.get(peer["term"], 0) <= 5:
                     continue
-                else:
-                    url = "http://{host}:{port}/daemon".format(**peer)
-                    message = json.dumps({
-                        "code": 6,
-                        "leader": self.bc.leader,
-                        "peers": peer_list_copy
-                    })
-                    try:
-                        r = requests.post(url=url, data=message)
-                        if r.status_code != 200 or json.loads(r.text)["message"] != "Success":
-                            raise Exception
-                        self.set_sync_time(time.time(), peer["term"])
-                    except:
-                        self.bc.peer_list.remove(peer)
+                futures.append((peer, self.bc.transport.executor.submit(self.heartbeat, peer)))
+            for peer, future in futures:
+                if not future.result():
+                    HEARTBEAT_FAILURES.inc(role="leader")
+                    self.bc.remove_peer(peer)
+
+    # 向一个 follower 发送心跳，成功时记录其确认的版本
+    def heartbeat(self, peer):
+        epoch, version = self.acked.get(peer["term"], (None, None))
+        message = {
+            "code": 6,
+            "leader": self.bc.leader,
+            "delta": self.bc.membership.delta(epoch, version)
+        }
+        if version is None:
+            # 对方的版本未知，可能是只认完整列表的旧版本 follower（其响应中没有版本号），同时携带完整列表
+            message["peers"] = self.bc.peer_list
+        try:
+            with HEARTBEAT_SECONDS.time(role="leader"):
+                r = self.bc.transport.post(peer, "/daemon", message)
+            result = json.loads(r.text)
+            if r.status_code != 200 or result["message"] != "Success":
+                return False
+            self.set_sync_time(time.time(), peer["term"])
+            self.set_acked(peer["term"], result.get("epoch"), result.get("version"))
+            return True
+        except Exception:
+            return False
 
     def follower_daemon(self):
         while True:
             time.sleep(random.random() * 5)
             url = "http://{host}:{port}/daemon".format(**self.bc.leader)
-            message = json.dumps({
+            message = json.dumps(dict({
                 "code": 6,
                 "info": self.bc.info
-            })
+            }, **self.bc.membership.state()))
             try:
-                r = requests.post(url=url, data=message)
+                with HEARTBEAT_SECONDS.time(role="follower"):
+                    r = requests.post(url=url, data=message)
                 if r.status_code == 200:
                     if json.loads(r.text)["code"] == 1:
-                        self.bc.peer_list = json.loads(r.text)["peers"].copy()
+                        result = json.loads(r.text)
+                        # 增量与本地版本不一致时忽略，下一次心跳会按新的版本重新计算
+                        if "delta" in result:
+                            self.bc.membership.apply(result["delta"])
+                        else:
+                            self.bc.set_peers(result["peers"])
                     else:  # 如果leader信息有误，重新初始化
                         if json.loads(r.text)["leader"]["host"] == self.bc.info["host"] and \
                                 json.loads(r.text)["leader"]["post"] == self.bc.info["post"]:
@@ -58,11 +87,15 @@ class BcDaemon(threading.Thread):
                 else:
                     raise Exception
             except:
+                HEARTBEAT_FAILURES.inc(role="follower")
                 break
 
     def set_sync_time(self, new_time, term):
         self.sync_time[term] = new_time
 
+    def set_acked(self, term, epoch, version):
+        self.acked[term] = (epoch, version)
+
     def run(self):
         while True:
             if self.bc.character == "leader":
@@ -0,0 +1,36 @@
+import threading
+import time
+from blockchain import BlockChain
+from util import tracing
+
+
+# 出块线程
+# 接收交易的请求只把交易放入交易池，由该线程在交易数达到 max_transactions 或最早一笔交易等待超过 max_latency 秒时打包出块
+# 生成与广播区块期间新到达的交易进入交易池的另一个缓冲区，不会被阻塞
+class BlockProducer(threading.Thread):
+    def __init__(self, bc: BlockChain, max_latency=5):
+        super(BlockProducer, self).__init__()
+        self.bc = bc
+        self.max_latency = max_latency
+
+    def run(self):
+        while True:
+            if self.bc.character != "leader":
+                time.sleep(1)
+                continue
+            transactions = self.bc.transaction_pool.wait_batch(self.bc.max_transactions, self.max_latency)
+            if not transactions:
+                continue
+            if self.bc.character != "leader":
+                # 等待期间失去 leader 身份，将交易转交给新的 leader
+                self.bc.transaction_pool.release(transactions)
+                self.bc.add_transactions(transactions)
+                continue
+            # 每次出块是一条独立的 trace，区块推送会把 trace id 带给各 follower
+            with tracing.trace("produce_block", transactions=len(transactions)) as span:
+                try:
+                    self.bc.seal_block(transactions)
+                except Exception as e:
+                    # 未写入链中的交易已由 seal_block 放回交易池，下次出块时重试
+                    # 失败次数由 seal_block 计入 bcfun_seal_block_failures_total，原因记录在 trace 中
+                    span.attrs["error"] = repr(e)
@@ -0,0 +1,44 @@
+import base64
+import os
+from hashlib import sha256
+from util.merkle import MerkleTree
+
+
+# 生成格式与真实交易相同的身份交易（签名为随机字节，不需要 Charm 与 ecdsa）
+def make_transaction(message):
+    public_key = os.urandom(64).hex()
+    signature = base64.b64encode(os.urandom(64)).decode()
+    return {
+        "from": public_key,
+        "message": message,
+        "signature": signature,
+        "hash": sha256(bytes.fromhex(public_key) + message.encode() + signature.encode()).hexdigest()
+    }
+
+
+def make_transactions(count, prefix="identity"):
+    return [make_transaction("%s-%d" % (prefix, i)) for i in range(count)]
+
+
+# 生成区块，r、s、block_hash 只需满足编码格式，不参与变色龙哈希验证
+def make_block(index, transactions=None, previous_hash=""):
+    if transactions is None:
+        transactions = make_transactions(3, "block%d" % index)
+    tree = MerkleTree(transactions)
+    return {
+        "index": index,
+        "timestamp": "2026-10-18 12:00:%02d" % (index % 60),
+        "previous_hash": previous_hash,
+        "merkle_root": tree.root,
+        "merkle_tree": tree.to_nested(),
+        "block_hash": "0:" + base64.b64encode(os.urandom(16)).decode(),
+        "r": "0:" + base64.b64encode(os.urandom(24)).decode(),
+        "s": "0:" + base64.b64encode(os.urandom(24)).decode()
+    }
+
+
+def make_chain(length):
+    chain = []
+    for index in range(length):
+        chain.append(make_block(index, previous_hash=chain[-1]["block_hash"] if chain else ""))
+    return chain
@@ -0,0 +1,82 @@
+import json
+import unittest
+from tests.helpers import make_block, make_transactions
+from util import blockCodec
+from util.merkle import MerkleTree, tombstone
+
+
+def header_of(block):
+    return dict((key, block[key]) for key in block if key != "merkle_tree")
+
+
+class BlockCodecTest(unittest.TestCase):
+    def test_round_trip(self):
+        for size in (1, 2, 7, 64):
+            block = make_block(size, make_transactions(size))
+            data = blockCodec.encode_block(block)
+            self.assertEqual(data[:2], blockCodec.MAGIC)
+            self.assertLess(len(data), len(json.dumps(block)))
+            self.assertEqual(blockCodec.decode_block(data), block)
+
+    def test_mixed_leaves(self):
+        transactions = make_transactions(6)
+        transactions[1] = tombstone(transactions[1], identity=True)
+        # 非标准交易：多余字段、大写十六进制、创世交易
+        transactions[2] = dict(transactions[2], extra=1)
+        transactions[3] = dict(transactions[3], hash=transactions[3]["hash"].upper())
+        transactions[4] = {"message": "genesis block", "from": transactions[4]["from"],
+                           "signature": transactions[4]["signature"], "hash": transactions[4]["hash"]}
+        block = make_block(3, transactions)
+        self.assertEqual(blockCodec.decode_block(blockCodec.encode_block(block)), block)
+
+    def test_decode_block_tree(self):
+        block = make_block(5, make_transactions(9))
+        decoded, tree = blockCodec.decode_block_tree(blockCodec.encode_block(block))
+        self.assertEqual(decoded, block)
+        self.assertIsInstance(tree, MerkleTree)
+        self.assertEqual(tree.root, block["merkle_root"])
+        self.assertEqual(tree.to_nested(), block["merkle_tree"])
+
+    def test_header_only(self):
+        header = header_of(make_block(2))
+        decoded, tree = blockCodec.decode_block_tree(blockCodec.encode_block(header))
+        self.assertEqual(decoded, header)
+        self.assertIsNone(tree)
+
+    def test_json_fallback(self):
+        # 含有未知字段或字段类型不符时整体以 JSON 保存
+        block = dict(make_block(1), extra="x")
+        data = blockCodec.encode_block(block)
+        self.assertEqual(data[:1], b"{")
+        self.assertEqual(blockCodec.decode_block_tree(data), (block, None))
+        block = dict(make_block(1), index="1")
+        self.assertEqual(blockCodec.decode_block(blockCodec.encode_block(block)), block)
+
+    def test_text_fields(self):
+        block = make_block(0)
+        block["previous_hash"] = ""
+        block["timestamp"] = "时间"
+        block["r"] = "not a group element"
+        self.assertEqual(blockCodec.decode_block(blockCodec.encode_block(block)), block)
+
+    def test_corrupt(self):
+        data = blockCodec.encode_block(make_block(4))
+        with self.assertRaises(ValueError):
+            blockCodec.decode_block(data[:len(data) // 2])
+        with self.assertRaises(ValueError):
+            blockCodec.decode_block(b"XX" + data[2:])
+
+    def test_frames(self):
+        blocks = [make_block(0), header_of(make_block(1)), make_block(2, make_transactions(20))]
+        stream = b"".join(blockCodec.encode_frame(block) for block in blocks)
+        for chunk_size in (1, 7, 1000, len(stream)):
+            chunks = [stream[i:i + chunk_size] for i in range(0, len(stream), chunk_size)]
+            decoded = list(blockCodec.decode_frames(chunks))
+            self.assertEqual([block for block, tree in decoded], blocks)
+            self.assertEqual([tree is None for block, tree in decoded], [False, True, False])
+        with self.assertRaises(ValueError):
+            list(blockCodec.decode_frames([stream[:-3]]))
+
+
+if __name__ == "__main__":
+    unittest.main()
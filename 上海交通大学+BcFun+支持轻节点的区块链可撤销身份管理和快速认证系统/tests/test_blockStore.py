@@ -0,0 +1,157 @@
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+from tests.helpers import make_chain
+from util.blockStore import BlockStore, INDEX_HEADER
+
+
+class BlockStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "chain_data")
+        self.stores = []
+
+    def tearDown(self):
+        for store in self.stores:
+            try:
+                store.close()
+            except OSError:
+                pass
+        shutil.rmtree(self.directory)
+
+    def open(self, path=None, **kwargs):
+        store = BlockStore(path or self.path, fsync=False, **kwargs)
+        self.stores.append(store)
+        return store
+
+    def close(self, store):
+        store.close()
+        self.stores.remove(store)
+
+    def assertChain(self, store, chain):
+        self.assertEqual(len(store), len(chain))
+        self.assertEqual(store.load_all(), chain)
+
+    def test_append_and_reopen(self):
+        chain = make_chain(5)
+        store = self.open()
+        for block in chain:
+            store.append(block)
+        self.assertEqual(store.get(3), chain[3])
+        self.assertEqual(store.get_by_hash(chain[4]["block_hash"]), chain[4])
+        self.assertIsNone(store.get_by_hash("missing"))
+        self.close(store)
+        self.assertChain(self.open(), chain)
+
+    def test_index_file_mode(self):
+        self.open()
+        mode = stat.S_IMODE(os.stat(os.path.join(self.path, "index.dat")).st_mode)
+        self.assertEqual(mode & 0o133, 0)
+
+    def test_revise_and_reset(self):
+        chain = make_chain(4)
+        store = self.open()
+        store.reset(chain)
+        revised = dict(chain[1], r="0:cmV2aXNlZA==")
+        store.revise(1, revised)
+        chain[1] = revised
+        self.assertChain(store, chain)
+        self.close(store)
+        store = self.open()
+        self.assertChain(store, chain)
+        replacement = make_chain(2)
+        store.reset(replacement)
+        self.close(store)
+        self.assertChain(self.open(), replacement)
+
+    def test_torn_tail(self):
+        chain = make_chain(3)
+        store = self.open()
+        for block in chain:
+            store.append(block)
+        self.close(store)
+        segment = os.path.join(self.path, "segment_000000.log")
+        size = os.path.getsize(segment)
+        # 最后一条记录只写入了一部分
+        with open(segment, "r+b") as f:
+            f.truncate(size - 5)
+        store = self.open()
+        self.assertChain(store, chain[:2])
+        # 不完整的记录被截掉
+        segment_number, offset, length = store.location(1)[0]
+        self.assertEqual(os.path.getsize(segment), offset + length)
+        # 截断后可以继续追加
+        store.append(chain[2])
+        self.close(store)
+        self.assertChain(self.open(), chain)
+
+    def test_corrupt_tail(self):
+        chain = make_chain(3)
+        store = self.open()
+        for block in chain:
+            store.append(block)
+        self.close(store)
+        segment = os.path.join(self.path, "segment_000000.log")
+        with open(segment, "r+b") as f:
+            f.seek(-3, os.SEEK_END)
+            f.write(b"\xff\xff\xff")
+        self.assertChain(self.open(), chain[:2])
+
+    def test_index_recovery(self):
+        chain = make_chain(6)
+        store = self.open()
+        for block in chain[:4]:
+            store.append(block)
+        self.close(store)
+        index_path = os.path.join(self.path, "index.dat")
+        # 索引缺失时从头扫描重建
+        os.remove(index_path)
+        store = self.open()
+        self.assertChain(store, chain[:4])
+        self.close(store)
+        # 索引文件头损坏
+        with open(index_path, "r+b") as f:
+            f.write(b"\x00" * INDEX_HEADER.size)
+        store = self.open()
+        self.assertChain(store, chain[:4])
+        self.close(store)
+        # 索引落后于数据：只补扫索引之后的记录
+        with open(index_path, "rb") as f:
+            stale = f.read()
+        store = self.open()
+        for block in chain[4:]:
+            store.append(block)
+        self.close(store)
+        with open(index_path, "wb") as f:
+            f.write(stale)
+        self.assertChain(self.open(), chain)
+
+    def test_segments(self):
+        chain = make_chain(8)
+        store = self.open(segment_size=1024)
+        for block in chain:
+            store.append(block)
+        self.assertGreater(len(store.segments()), 1)
+        self.close(store)
+        self.assertChain(self.open(segment_size=1024), chain)
+
+    def test_swap(self):
+        store = self.open()
+        store.reset(make_chain(5))
+        chain = make_chain(3)
+        staging = self.open(os.path.join(self.directory, "staging"))
+        for block in chain:
+            staging.append(block)
+        self.stores.remove(staging)
+        store.swap(staging)
+        self.assertFalse(os.path.exists(staging.path))
+        self.assertChain(store, chain)
+        self.assertEqual(store.get_by_hash(chain[2]["block_hash"]), chain[2])
+        self.close(store)
+        self.assertChain(self.open(), chain)
+
+
+if __name__ == "__main__":
+    unittest.main()
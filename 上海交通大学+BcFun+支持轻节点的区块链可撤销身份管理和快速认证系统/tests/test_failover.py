@@ -0,0 +1,67 @@
+import importlib.util
+import json
+import threading
+import unittest
+from tests.helpers import make_transactions
+
+
+# 节点依赖 Charm-Crypto，未安装时跳过
+@unittest.skipUnless(importlib.util.find_spec("charm"), "requires Charm-Crypto")
+class FailoverTest(unittest.TestCase):
+    def setUp(self):
+        import website
+        from blockchain import BlockChain
+        from werkzeug.serving import make_server
+        self.website = website
+        self.BlockChain = BlockChain
+        self.server = make_server("127.0.0.1", 0, website.app, threaded=True)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.saved = (getattr(website, "bc", None), website.bc_init)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.website.bc, self.website.bc_init = self.saved
+
+    def serve(self, node):
+        self.website.bc = node
+        self.website.bc_init = True
+        return dict(node.leader, host="127.0.0.1", port=self.server.server_port)
+
+    def follower(self, chameleon, leader):
+        from util import hashTool
+        node = self.BlockChain(test_mode=True, max_transactions=4)
+        node.public_key, node.private_key = hashTool.generate_ECDSA_keys()
+        node.load_chameleon(chameleon)
+        node.leader = leader
+        node.character = "follower"
+        return node
+
+    def test_join_after_snapshot_leader_failover(self):
+        first = self.BlockChain(test_mode=True, max_transactions=4)
+        first.init()
+        transactions = make_transactions(12)
+        for i in range(0, 8, 4):
+            first.seal_block(transactions[i:i + 4])
+        first.make_snapshot()
+        # second 从 first 的快照启动，没有快照之前的区块
+        second = self.follower(first.chameleon, self.serve(first))
+        self.assertTrue(second.bootstrap())
+        first.seal_block(transactions[8:])
+        second.sync_block()
+        self.assertGreater(second.chain_base(), 0)
+        self.assertEqual(second.chain[-1]["block_hash"], first.chain[-1]["block_hash"])
+        # first 故障，second 成为 leader，新节点仍能加入
+        second.be_leader()
+        third = self.follower(second.chameleon, self.serve(second))
+        self.assertTrue(third.bootstrap())
+        third.sync_block()
+        self.assertEqual(third.chain[-1]["block_hash"], second.chain[-1]["block_hash"])
+        # 从头同步的请求被拒绝，而不是返回无法衔接的区块
+        client = self.website.app.test_client()
+        r = client.get("/block/range?start=0")
+        self.assertEqual(r.status_code, 410)
+        self.assertEqual(json.loads(r.data)["code"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
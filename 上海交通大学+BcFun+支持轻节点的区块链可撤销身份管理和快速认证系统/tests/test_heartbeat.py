@@ -0,0 +1,75 @@
+import importlib.util
+import json
+import unittest
+
+
+class Response:
+    def __init__(self, result):
+        self.status_code = 200
+        self.text = json.dumps(result)
+
+
+def peer(port, term=1):
+    return {"host": "127.0.0.1", "port": port, "term": term}
+
+
+# 新版本的 leader 与只认完整节点列表的旧版本 follower 之间的心跳
+# 节点依赖 Charm-Crypto，未安装时跳过
+@unittest.skipUnless(importlib.util.find_spec("charm"), "requires Charm-Crypto")
+class HeartbeatTest(unittest.TestCase):
+    def setUp(self):
+        import website
+        from blockchain import BlockChain
+        from daemon import BcDaemon
+        self.website = website
+        self.saved = (getattr(website, "bc", None), getattr(website, "th", None), website.bc_init)
+        self.bc = BlockChain(test_mode=True)
+        self.bc.init()
+        for port in (1, 2, 3):
+            self.bc.add_peer(peer(port))
+        self.daemon = BcDaemon(bc=self.bc)
+        website.bc, website.th, website.bc_init = self.bc, self.daemon, True
+
+    def tearDown(self):
+        self.website.bc, self.website.th, self.website.bc_init = self.saved
+
+    def test_old_follower_heartbeat(self):
+        client = self.website.app.test_client()
+        r = client.post("/daemon", data=json.dumps({"code": 6, "info": peer(1)}))
+        result = json.loads(r.data)
+        self.assertEqual(result["code"], 1)
+        self.assertEqual(result["peers"], self.bc.peer_list)
+        # 新版本的 follower 报告版本后只收到增量
+        state = self.bc.membership.state()
+        r = client.post("/daemon", data=json.dumps(dict({"code": 6, "info": peer(1)}, **state)))
+        result = json.loads(r.data)
+        self.assertNotIn("peers", result)
+        self.assertEqual((result["delta"]["added"], result["delta"]["removed"]), ([], []))
+
+    def test_leader_heartbeat_to_old_follower(self):
+        messages = []
+        responses = {
+            # 旧版本的 follower：响应中没有版本号
+            1: {"status": "OK", "message": "Success", "code": 1},
+            2: dict({"status": "OK", "message": "Success", "code": 1}, **self.bc.membership.state())
+        }
+
+        def post(target, path, data, timeout=None, headers=None):
+            messages.append((target["port"], data))
+            return Response(responses[target["port"]])
+        self.bc.transport.post = post
+        for _ in range(2):
+            self.assertTrue(self.daemon.heartbeat(peer(1)))
+            self.assertTrue(self.daemon.heartbeat(peer(2, term=2)))
+        sent = dict(((port, i // 2), data) for i, (port, data) in enumerate(messages))
+        # 旧版本的 follower 每次都收到完整列表
+        self.assertEqual(sent[1, 0]["peers"], self.bc.peer_list)
+        self.assertEqual(sent[1, 1]["peers"], self.bc.peer_list)
+        # 新版本的 follower 确认版本后只收到增量
+        self.assertIn("peers", sent[2, 0])
+        self.assertNotIn("peers", sent[2, 1])
+        self.assertIn("since", sent[2, 1]["delta"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+import unittest
+from util.membership import Membership
+
+
+def peer(port, term=1):
+    return {"host": "127.0.0.1", "port": port, "term": term}
+
+
+def ports(membership):
+    return sorted(member["port"] for member in membership.peers())
+
+
+class MembershipTest(unittest.TestCase):
+    def setUp(self):
+        self.removed = []
+        self.leader = Membership(history=4)
+        self.follower = Membership(on_remove=self.removed.append)
+
+    def sync(self):
+        state = self.follower.state()
+        delta = self.leader.delta(state["epoch"], state["version"])
+        self.assertTrue(self.follower.apply(delta))
+        self.assertEqual(self.follower.state(), self.leader.state())
+        self.assertEqual(ports(self.follower), ports(self.leader))
+        return delta
+
+    def test_full_list_then_deltas(self):
+        for port in (1, 2, 3):
+            self.leader.add(peer(port))
+        # 第一次同步没有共同的历史，发送完整列表
+        self.assertIn("peers", self.sync())
+        self.leader.remove(peer(2))
+        self.leader.add(peer(4))
+        delta = self.sync()
+        self.assertEqual(delta["added"], [peer(4)])
+        self.assertEqual(delta["removed"], [["127.0.0.1", "2"]])
+        self.assertEqual(self.removed, [peer(2)])
+        # 没有变化时增量为空
+        delta = self.sync()
+        self.assertEqual((delta["added"], delta["removed"]), ([], []))
+
+    def test_replaced_record(self):
+        self.leader.add(peer(1))
+        self.sync()
+        self.leader.add(peer(1, term=2))
+        self.assertEqual(self.sync()["added"], [peer(1, term=2)])
+        self.assertTrue(self.follower.contains(peer(1, term=2)))
+        self.assertFalse(self.follower.contains(peer(1)))
+        self.assertEqual(self.removed, [])
+
+    def test_history_overflow(self):
+        self.leader.add(peer(1))
+        self.sync()
+        for port in range(2, 10):
+            self.leader.add(peer(port))
+        self.assertIn("peers", self.sync())
+
+    def test_full_list_removes_missing_peers(self):
+        for port in (1, 2, 3):
+            self.leader.add(peer(port))
+        self.sync()
+        other = Membership()
+        other.add(peer(3))
+        self.assertTrue(self.follower.apply(other.delta()))
+        self.assertEqual(ports(self.follower), [3])
+        self.assertEqual(sorted(member["port"] for member in self.removed), [1, 2])
+
+    def test_mismatched_delta(self):
+        self.leader.add(peer(1))
+        self.sync()
+        delta = self.leader.delta(self.leader.epoch, self.leader.version)
+        self.leader.add(peer(2))
+        stale = self.leader.delta(self.leader.epoch, self.leader.version - 1)
+        self.follower.add(peer(5))
+        # 本地修改后换成自己的 epoch，增量不再适用
+        self.assertFalse(self.follower.apply(stale))
+        self.assertFalse(self.follower.apply(dict(delta, since=delta["since"] + 1)))
+        state = self.follower.state()
+        self.assertIn("peers", self.leader.delta(state["epoch"], state["version"]))
+        self.sync()
+        self.assertEqual(ports(self.follower), [1, 2])
+        self.assertEqual(self.removed, [peer(5)])
+
+    def test_follower_without_version(self):
+        # 旧版本的 follower 不报告 (epoch, version)，只认完整列表，每次都按完整列表整体替换
+        for port in (1, 2, 3):
+            self.leader.add(peer(port))
+        self.follower.replace(self.leader.delta()["peers"])
+        self.leader.remove(peer(2))
+        self.leader.add(peer(4))
+        delta = self.leader.delta()
+        self.assertIn("peers", delta)
+        self.follower.replace(delta["peers"])
+        self.assertEqual(ports(self.follower), [1, 3, 4])
+        self.assertEqual(self.removed, [peer(2)])
+
+    def test_local_changes(self):
+        self.follower.add(peer(1))
+        self.follower.add(peer(1))
+        self.assertEqual(self.follower.state()["version"], 1)
+        self.follower.remove(peer(7))
+        self.follower.replace([peer(2), peer(3)])
+        self.assertEqual(ports(self.follower), [2, 3])
+        self.assertEqual(self.removed, [peer(1)])
+        self.assertEqual(len(self.follower), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import copy
+import unittest
+from hashlib import sha256
+from tests.helpers import make_transactions
+from util.merkle import MerkleTree, nested_leaves, verify_proof, tombstone_hash
+
+
+# 与 hashTool.merkel_tree 相同的规则计算根：两两合并，奇数个时最后一个节点直接提升
+def reference_root(leaves):
+    level = [bytes.fromhex(leaf["hash"]) for leaf in leaves]
+    while len(level) > 1:
+        upper = [sha256(level[i] + level[i + 1]).digest() for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            upper.append(level[-1])
+        level = upper
+    return level[0].hex()
+
+
+class MerkleTreeTest(unittest.TestCase):
+    def test_root_matches_reference(self):
+        for size in range(1, 18):
+            leaves = make_transactions(size)
+            tree = MerkleTree(leaves)
+            self.assertEqual(tree.root, reference_root(leaves))
+            self.assertEqual(MerkleTree.from_nested(tree.to_nested()).root, tree.root)
+            self.assertEqual(nested_leaves(tree.to_nested()), leaves)
+
+    def test_empty_tree(self):
+        with self.assertRaises(ValueError):
+            MerkleTree([])
+
+    def test_replace_matches_rebuilt_tree(self):
+        for size in (1, 2, 5, 8, 13):
+            leaves = make_transactions(size)
+            tree = MerkleTree(leaves)
+            first = nested = tree.to_nested()
+            original = copy.deepcopy(first)
+            replacement = make_transactions(size, "replacement")
+            for position in range(size):
+                leaves[position] = replacement[position]
+                nested = tree.replace(position, replacement[position], nested)
+                rebuilt = MerkleTree(leaves)
+                self.assertEqual(tree.root, rebuilt.root)
+                self.assertEqual(nested, rebuilt.to_nested())
+                self.assertEqual(tree.position(replacement[position]["hash"]), position)
+            # 写时复制，旧的嵌套结构保持不变
+            self.assertEqual(first, original)
+
+    def test_patch_after_replace(self):
+        leaves = make_transactions(7)
+        tree = MerkleTree(leaves)
+        nested = tree.to_nested()
+        leaf = make_transactions(1, "patched")[0]
+        self.assertIsNone(tree.replace(4, leaf))
+        leaves[4] = leaf
+        self.assertEqual(tree.patch(nested, 4), MerkleTree(leaves).to_nested())
+
+    def test_proof(self):
+        for size in range(1, 18):
+            leaves = make_transactions(size)
+            tree = MerkleTree(leaves)
+            for position in range(size):
+                proof = tree.proof(position)
+                self.assertTrue(verify_proof(leaves[position]["hash"], proof, tree.root))
+                if size > 1:
+                    self.assertFalse(verify_proof(leaves[(position + 1) % size]["hash"], proof, tree.root))
+            self.assertFalse(verify_proof(leaves[0]["hash"], tree.proof(0), "00" * 32))
+
+    def test_proof_after_replace(self):
+        leaves = make_transactions(9)
+        tree = MerkleTree(leaves)
+        tree.replace(8, make_transactions(1, "replacement")[0])
+        for position in range(9):
+            self.assertTrue(verify_proof(tree.leaves[position]["hash"], tree.proof(position), tree.root))
+
+    def test_tombstone(self):
+        leaves = make_transactions(4)
+        tree = MerkleTree(leaves)
+        nested = tree.tombstone(2, tree.to_nested(), identity=True)
+        leaf = tree.leaves[2]
+        # 公钥参与占位叶子哈希的计算，身份信息不以任何形式保留
+        self.assertEqual(leaf["hash"], tombstone_hash(leaves[2]["hash"], leaves[2]["from"]))
+        self.assertNotEqual(leaf["hash"], tombstone_hash(leaves[2]["hash"]))
+        self.assertEqual(leaf["revoked"], leaves[2]["hash"])
+        self.assertEqual(leaf["key"], leaves[2]["from"])
+        self.assertEqual(set(leaf), {"from", "message", "signature", "hash", "revoked", "key"})
+        self.assertIsNone(tree.position(leaves[2]["hash"]))
+        self.assertEqual(tree.position(leaf["hash"]), 2)
+        self.assertEqual(MerkleTree.from_nested(nested).root, tree.root)
+
+
+if __name__ == "__main__":
+    unittest.main()
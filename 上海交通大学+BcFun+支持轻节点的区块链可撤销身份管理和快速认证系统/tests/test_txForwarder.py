@@ -0,0 +1,33 @@
+import unittest
+from tests.helpers import make_transactions
+from util.txForwarder import TransactionForwarder
+
+
+class TransactionForwarderTest(unittest.TestCase):
+    def test_batches_share_round_trip(self):
+        sent = []
+        forwarder = TransactionForwarder(lambda batch: sent.append(batch) or [True] * len(batch),
+                                         max_count=4, max_latency=0.01)
+        transactions = make_transactions(6)
+        futures = forwarder.submit(transactions[:3]) + forwarder.submit(transactions[3:])
+        self.assertEqual([future.result(timeout=5) for future in futures], [True] * 6)
+        self.assertEqual(sum(sent, []), transactions)
+        self.assertEqual(len(sent[0]), 4)
+
+    def test_invalid_results(self):
+        transactions = make_transactions(3)
+        for results in ([True], [True] * 4, {"results": [True] * 3}, None):
+            forwarder = TransactionForwarder(lambda batch: results, max_latency=0.01)
+            # 结果与交易对应不上时整批失败，每笔交易都得到结果
+            futures = forwarder.submit(transactions)
+            self.assertEqual([future.result(timeout=5) for future in futures], [False] * 3)
+
+    def test_send_error(self):
+        def send(batch):
+            raise ConnectionError
+        forwarder = TransactionForwarder(send, max_latency=0.01)
+        self.assertEqual(forwarder.forward(make_transactions(2)), [False, False])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import threading
+import time
+import unittest
+from tests.helpers import make_transactions
+from util import txPool
+from util.txPool import TransactionPool
+
+
+class TransactionPoolTest(unittest.TestCase):
+    def test_capacity_and_duplicates(self):
+        pool = TransactionPool(capacity=3)
+        transactions = make_transactions(5)
+        self.assertEqual([pool.add(transaction) for transaction in transactions[:3]], [txPool.ADDED] * 3)
+        self.assertEqual(pool.add(transactions[0]), txPool.DUPLICATE)
+        self.assertEqual(pool.add(transactions[3]), txPool.FULL)
+        # 节点自己生成的交易不受容量限制，但仍然去重
+        pool.append(transactions[3])
+        pool.append(transactions[3])
+        self.assertEqual(len(pool), 4)
+        self.assertIn(transactions[3]["hash"], pool)
+
+    def test_take_keeps_dedup_until_release(self):
+        pool = TransactionPool(capacity=2)
+        transactions = make_transactions(3)
+        pool.add(transactions[0])
+        pool.add(transactions[1])
+        batch = pool.take()
+        self.assertEqual(batch, transactions[:2])
+        self.assertEqual(len(pool), 0)
+        # 正在出块的交易仍然计入去重与容量
+        self.assertEqual(pool.add(transactions[0]), txPool.DUPLICATE)
+        self.assertEqual(pool.add(transactions[2]), txPool.FULL)
+        pool.release(batch)
+        self.assertEqual(pool.add(transactions[2]), txPool.ADDED)
+        self.assertEqual(pool.add(transactions[0]), txPool.ADDED)
+
+    def test_take_max_count(self):
+        pool = TransactionPool()
+        transactions = make_transactions(5)
+        pool.extend(transactions)
+        self.assertEqual(pool.take(2), transactions[:2])
+        self.assertEqual(list(pool), transactions[2:])
+        self.assertEqual(pool.take(), transactions[2:])
+
+    def test_requeue(self):
+        pool = TransactionPool(capacity=3)
+        transactions = make_transactions(3)
+        pool.add(transactions[0])
+        pool.add(transactions[1])
+        batch = pool.take()
+        pool.add(transactions[2])
+        # 出块失败的交易放回最前面，仍然参与去重
+        pool.requeue(batch)
+        self.assertEqual(list(pool), transactions)
+        self.assertEqual(pool.add(transactions[0]), txPool.DUPLICATE)
+        # 放回的交易不受容量限制
+        pool = TransactionPool(capacity=2)
+        pool.extend(transactions[:2])
+        batch = pool.take()
+        self.assertEqual(pool.add(transactions[2]), txPool.FULL)
+        pool.requeue(batch)
+        self.assertEqual(list(pool), transactions[:2])
+
+    def test_wait_batch(self):
+        pool = TransactionPool()
+        transactions = make_transactions(4)
+        pool.extend(transactions[:1])
+        start = time.time()
+        batch = pool.wait_batch(4, 0.05)
+        self.assertEqual(batch, transactions[:1])
+        self.assertGreaterEqual(time.time() - start, 0.04)
+        pool.release(batch)
+        # 交易数达到 max_count 时立即返回
+        threading.Timer(0.01, pool.extend, args=(transactions,)).start()
+        self.assertEqual(pool.wait_batch(4, 10), transactions)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,9 +4,17 @@ import ecdsa
 import json
 from argparse import ArgumentParser
 import requests
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from itertools import islice
 from util import hashTool
 
+# 批量模式：每次提交的交易数，以及交易池已满时的重试间隔（秒）
+BULK_BATCH_SIZE = 500
+RETRY_DELAY = 0.5
+MAX_RETRY_DELAY = 10
+
 
 def generate_ECDSA_keys():
     sk = ecdsa.SigningKey.generate(curve=ecdsa.SECP256k1)  # this is your sign (private key)
@@ -43,6 +51,62 @@ def validate_signature(public_key, signature, message):
         return False
 
 
+# 为一条身份信息生成新的密钥并签名，由进程池调用
+def make_identity(message):
+    public_key, private_key = generate_ECDSA_keys()
+    return sign_transaction(public_key, private_key, {"message": message}), private_key
+
+
+# 以 NDJSON 提交一批交易，交易池已满（429）时等待后只重发被拒绝的交易
+# 返回与 transactions 顺序一致的结果列表
+def submit_batch(address, transactions):
+    results = [None] * len(transactions)
+    pending = list(range(len(transactions)))
+    delay = RETRY_DELAY
+    while pending:
+        body = "\n".join(json.dumps(transactions[i]) for i in pending)
+        r = requests.post("http://{0}/transaction/batch".format(address), data=body,
+                          headers={"Content-type": "application/x-ndjson"})
+        if r.status_code not in (200, 429):
+            raise requests.HTTPError("Node returned {0}".format(r.status_code))
+        for i, result in zip(pending, r.json()["results"]):
+            results[i] = result
+        pending = [i for i in pending if results[i] is None]
+        if pending:
+            print("Transaction pool full, retry {0} transactions in {1}s".format(len(pending), delay))
+            time.sleep(delay)
+            delay = min(delay * 2, MAX_RETRY_DELAY)
+    return results
+
+
+# 批量模式：并行生成密钥并签名，签好一批提交一批
+# output 不为空时逐行写入交易、私钥与提交结果
+def bulk(address, messages, batch_size, workers, output):
+    accepted, rejected = 0, 0
+    start = time.time()
+    out = open(output, "w") if output else None
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        identities = executor.map(make_identity, messages, chunksize=64)
+        while True:
+            batch = list(islice(identities, batch_size))
+            if not batch:
+                break
+            results = submit_batch(address, [transaction for transaction, private_key in batch])
+            for (transaction, private_key), result in zip(batch, results):
+                if result:
+                    accepted += 1
+                else:
+                    rejected += 1
+                if out:
+                    out.write(json.dumps({"transaction": transaction, "private_key": private_key,
+                                          "result": result}) + "\n")
+            print("Submitted {0}, accepted {1}, rejected {2}".format(accepted + rejected, accepted, rejected))
+    if out:
+        out.close()
+    elapsed = time.time() - start
+    print("Done in {0:.2f}s, {1:.1f} tx/s".format(elapsed, (accepted + rejected) / elapsed if elapsed else 0))
+
+
 if __name__ == "__main__":
     try:
         key_info = json.load(open("./client_id.json", "r"))
@@ -54,12 +118,26 @@ if __name__ == "__main__":
 
     parser = ArgumentParser()
     parser.add_argument('-a', '--address', help='target ip and port of transaction, e.g. 127.0.0.1:8000')
+    parser.add_argument('-n', '--count', type=int, help='bulk mode: register COUNT example identities and exit')
+    parser.add_argument('-f', '--file', help='bulk mode: register one identity per line of FILE and exit')
+    parser.add_argument('-b', '--batch-size', type=int, default=BULK_BATCH_SIZE, help='transactions per request')
+    parser.add_argument('-w', '--workers', type=int, help='signing processes, default to the number of CPUs')
+    parser.add_argument('-o', '--output', help='bulk mode: write transactions, private keys and results to OUTPUT')
     args = parser.parse_args()
 
+    if args.count or args.file:
+        if args.file:
+            messages = [line.strip() for line in open(args.file, "r") if line.strip()]
+        else:
+            prefix = "Identity_Example_" + datetime.now().strftime("%H%M%S")
+            messages = ["{0}_{1}".format(prefix, i) for i in range(args.count)]
+        bulk(args.address, messages, args.batch_size, args.workers, args.output)
+        exit(0)
+
     message = "Identity_Example_" + datetime.now().strftime("%H%M%S")
     transaction = sign_transaction(public_key, private_key, {"message": message})
     while True:
-        print("Action:\n[1] Add New\n[2] Revoke")
+        print("Action:\n[1] Add New\n[2] Revoke\n[3] Batch Revoke")
         action = int(input("action:"))
         if action == 1:
             message = "Identity_Example_" + datetime.now().strftime("%H%M%S")
@@ -75,7 +153,9 @@ if __name__ == "__main__":
                 }
                 print(json.dumps(trans_show, indent=4))
                 r = requests.post("http://{0}/transaction/add".format(args.address), data=transaction)
-                if r.status_code != 200:
+                if r.status_code == 429:
+                    print("Transaction pool of {0} is full, please retry later.".format(args.address))
+                elif r.status_code != 200:
                     print("Node Error, please check if {0} is still alive!".format(args.address))
                 else:
                     print(r.text)
@@ -84,6 +164,20 @@ if __name__ == "__main__":
             tran_hash = input("Transaction Hash:")
             msg = {"code": 6, "action": "REVOKE", "msg": {"block_hash": blk_hash, "transaction_hash": tran_hash}}
             r = requests.post("http://{0}/block".format(args.address), data=json.dumps(msg))
+            if r.status_code != 200:
+                print("Node Error, please check if {0} is still alive!".format(args.address))
+            else:
+                print(r.text)
+        elif action == 3:
+            # 每行输入 "区块哈希 交易哈希"，空行结束
+            msgs = []
+            while True:
+                line = input("Block Hash, Transaction Hash:").split()
+                if len(line) != 2:
+                    break
+                msgs.append({"block_hash": line[0], "transaction_hash": line[1]})
+            msg = {"code": 6, "action": "REVOKE_BATCH", "msgs": msgs}
+            r = requests.post("http://{0}/block".format(args.address), data=json.dumps(msg))
             if r.status_code != 200:
                 print("Node Error, please check if {0} is still alive!".format(args.address))
             else:
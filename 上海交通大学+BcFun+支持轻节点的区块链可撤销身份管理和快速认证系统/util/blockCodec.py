@@ -0,0 +1,229 @@
+import base64
+import binascii
+import json
+import struct
+from itertools import accumulate
+from util.merkle import MerkleTree, nested_leaves
+
+# 区块的二进制编码，用于本地存储和节点间传输
+# 公钥、签名、哈希与变色龙哈希参数以原始字节保存，merkle 树只保存叶子列表，解码时由叶子构建一次数组存储的 merkle 树，
+# 嵌套结构由该树直接生成，验证区块时复用同一棵树，无需再次计算哈希
+# 每个字段都带长度前缀；无法按原始字节保存的字段以文本保存，含有未知字段的区块整体以 JSON 保存，编码总是无损的
+MAGIC = b"BC"
+VERSION = 1
+CONTENT_TYPE = "application/x-bcfun-block"
+
+# 区块头：魔数, 版本号, 区块高度, 标志位, 叶子数量
+BLOCK_HEADER = struct.Struct("<2sBQBI")
+# 字段：类型, 长度
+FIELD = struct.Struct("<BI")
+# 标准交易中公钥、哈希与签名的字节数
+KEY_SIZE = 64
+HASH_SIZE = 32
+SIGNATURE_SIZE = 64
+SIGNATURE_B64_SIZE = 88
+# 数据流中每个区块前的长度
+FRAME = struct.Struct("<I")
+
+# 标志位：区块包含 merkle 树（轻节点的区块只有区块头）
+FLAG_TREE = 1
+
+# 按顺序保存的区块头字段
+HEADER_FIELDS = ("timestamp", "previous_hash", "merkle_root", "block_hash", "r", "s")
+BLOCK_KEYS = frozenset(("index", "merkle_tree") + HEADER_FIELDS)
+
+# 字段类型
+TEXT = 0  # utf-8 文本
+HEX = 1  # 十六进制字符串
+BASE64 = 2  # base64 字符串
+ELEMENT = 3  # 变色龙哈希参数的序列化结果 "类型:base64"
+
+# 交易类型
+LEAF_JSON = 0
+LEAF_RAW = 1
+
+
+def encode_element(value):
+    prefix, _, data = value.partition(":")
+    if not prefix.isdigit() or int(prefix) > 255:
+        raise ValueError("not a group element")
+    return bytes([int(prefix)]) + base64.b64decode(data, validate=True)
+
+
+def decode_element(raw):
+    return str(raw[0]) + ":" + base64.b64encode(raw[1:]).decode()
+
+
+# 字段类型 -> (编码, 解码)
+FIELD_CODECS = (
+    (HEX, bytes.fromhex, lambda raw: raw.hex()),
+    (ELEMENT, encode_element, decode_element),
+    (BASE64, lambda value: base64.b64decode(value, validate=True), lambda raw: base64.b64encode(raw).decode()),
+)
+FIELD_DECODERS = dict([(TEXT, lambda raw: raw.decode())] + [(codec[0], codec[2]) for codec in FIELD_CODECS])
+
+
+# 编码字符串字段，依次尝试能够还原出原字符串的紧凑表示
+def pack_field(value):
+    if value:
+        for tag, encode, decode in FIELD_CODECS:
+            try:
+                raw = encode(value)
+                if decode(raw) == value:
+                    return FIELD.pack(tag, len(raw)) + raw
+            except (ValueError, IndexError):
+                pass
+    raw = value.encode()
+    return FIELD.pack(TEXT, len(raw)) + raw
+
+
+def unpack_field(data, offset):
+    tag, length = FIELD.unpack_from(data, offset)
+    offset += FIELD.size
+    return FIELD_DECODERS[tag](bytes(data[offset:offset + length])), offset + length
+
+
+# 交易按列存放：先是每个交易的类型，然后依次是所有标准交易的公钥、哈希、签名、消息长度、消息，
+# 最后是其他交易（例如撤销占位叶子）的 JSON 长度与 JSON，整列一次转换，避免逐个字段打包
+def is_standard(leaf):
+    try:
+        return len(leaf) == 4 and len(leaf["from"]) == 2 * KEY_SIZE and len(leaf["hash"]) == 2 * HASH_SIZE and \
+            len(leaf["signature"]) == SIGNATURE_B64_SIZE and isinstance(leaf["message"], str)
+    except (KeyError, TypeError):
+        return False
+
+
+def pack_columns(leaves):
+    try:
+        senders = "".join([leaf["from"] for leaf in leaves])
+        hashes = "".join([leaf["hash"] for leaf in leaves])
+        sender_bytes = bytes.fromhex(senders)
+        hash_bytes = bytes.fromhex(hashes)
+        signatures = [binascii.a2b_base64(leaf["signature"]) for leaf in leaves]
+    except (ValueError, TypeError):
+        return None
+    if sender_bytes.hex() != senders or hash_bytes.hex() != hashes:
+        return None
+    for leaf, signature in zip(leaves, signatures):
+        if len(signature) != SIGNATURE_SIZE or binascii.b2a_base64(signature, newline=False).decode() != leaf["signature"]:
+            return None
+    messages = [leaf["message"].encode() for leaf in leaves]
+    lengths = struct.pack("<%dI" % len(messages), *[len(message) for message in messages])
+    return sender_bytes + hash_bytes + b"".join(signatures) + lengths + b"".join(messages)
+
+
+def pack_leaves(leaves):
+    kinds = [is_standard(leaf) for leaf in leaves]
+    columns = pack_columns([leaf for leaf, kind in zip(leaves, kinds) if kind])
+    if columns is None:
+        # 整列转换失败（例如含有大写的十六进制），逐个检查
+        kinds = [kind and pack_columns([leaf]) is not None for leaf, kind in zip(leaves, kinds)]
+        columns = pack_columns([leaf for leaf, kind in zip(leaves, kinds) if kind])
+    others = [json.dumps(leaf).encode() for leaf, kind in zip(leaves, kinds) if not kind]
+    lengths = struct.pack("<%dI" % len(others), *[len(other) for other in others])
+    return bytes(kinds) + columns + lengths + b"".join(others)
+
+
+def unpack_lengths(data, offset, count):
+    lengths = struct.unpack_from("<%dI" % count, data, offset)
+    return lengths, offset + 4 * count
+
+
+def unpack_leaves(data, offset, count):
+    kinds = bytes(data[offset:offset + count])
+    offset += count
+    standard = kinds.count(LEAF_RAW)
+    senders = bytes(data[offset:offset + KEY_SIZE * standard]).hex()
+    offset += KEY_SIZE * standard
+    hashes = bytes(data[offset:offset + HASH_SIZE * standard]).hex()
+    offset += HASH_SIZE * standard
+    signatures = bytes(data[offset:offset + SIGNATURE_SIZE * standard])
+    offset += SIGNATURE_SIZE * standard
+    lengths, offset = unpack_lengths(data, offset, standard)
+    ends = list(accumulate(lengths, initial=0))
+    messages = bytes(data[offset:offset + ends[-1]])
+    offset += ends[-1]
+    raw = [{
+        "from": senders[2 * KEY_SIZE * i:2 * KEY_SIZE * (i + 1)],
+        "message": messages[ends[i]:ends[i + 1]].decode(),
+        "signature": binascii.b2a_base64(signatures[SIGNATURE_SIZE * i:SIGNATURE_SIZE * (i + 1)], newline=False).decode(),
+        "hash": hashes[2 * HASH_SIZE * i:2 * HASH_SIZE * (i + 1)]
+    } for i in range(standard)]
+    if standard == count:
+        return raw, offset
+    lengths, offset = unpack_lengths(data, offset, count - standard)
+    others = []
+    for length in lengths:
+        others.append(json.loads(bytes(data[offset:offset + length])))
+        offset += length
+    raw.reverse()
+    others.reverse()
+    leaves = [raw.pop() if kind == LEAF_RAW else others.pop() for kind in kinds]
+    return leaves, offset
+
+
+# 编码区块，返回 bytes
+def encode_block(block):
+    if not set(block) <= BLOCK_KEYS or not isinstance(block.get("index"), int) or \
+            not all(isinstance(block.get(key), str) for key in HEADER_FIELDS):
+        return json.dumps(block).encode()
+    leaves = nested_leaves(block["merkle_tree"]) if "merkle_tree" in block else []
+    flags = FLAG_TREE if "merkle_tree" in block else 0
+    parts = [BLOCK_HEADER.pack(MAGIC, VERSION, block["index"], flags, len(leaves))]
+    for key in HEADER_FIELDS:
+        parts.append(pack_field(block[key]))
+    parts.append(pack_leaves(leaves))
+    return b"".join(parts)
+
+
+# 解码区块，兼容 JSON 格式；数据损坏或版本不支持时抛出 ValueError
+def decode_block(data):
+    return decode_block_tree(data)[0]
+
+
+# 解码区块，同时返回由叶子构建的 MerkleTree（区块没有 merkle 树或为 JSON 格式时为 None）
+# 返回值：(block, tree)
+def decode_block_tree(data):
+    if data[:1] == b"{":
+        return json.loads(data), None
+    data = memoryview(data)
+    try:
+        magic, version, index, flags, count = BLOCK_HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("unsupported block encoding")
+        offset = BLOCK_HEADER.size
+        block = {"index": index}
+        for key in HEADER_FIELDS:
+            block[key], offset = unpack_field(data, offset)
+        leaves, offset = unpack_leaves(data, offset, count)
+    except (struct.error, KeyError, IndexError, UnicodeDecodeError) as e:
+        raise ValueError("corrupt block encoding") from e
+    if not flags & FLAG_TREE:
+        return block, None
+    tree = MerkleTree(leaves)
+    block["merkle_tree"] = tree.to_nested()
+    return block, tree
+
+
+# 编码区块流，每个区块前带有长度
+def encode_frame(block):
+    payload = encode_block(block)
+    return FRAME.pack(len(payload)) + payload
+
+
+# 从字节块迭代器中逐个解码区块，返回值同 decode_block_tree
+def decode_frames(chunks):
+    buffer = b""
+    for chunk in chunks:
+        buffer += chunk
+        offset = 0
+        while len(buffer) - offset >= FRAME.size:
+            length = FRAME.unpack_from(buffer, offset)[0]
+            if len(buffer) - offset - FRAME.size < length:
+                break
+            offset += FRAME.size
+            yield decode_block_tree(buffer[offset:offset + length])
+            offset += length
+        buffer = buffer[offset:]
+    if buffer:
+        raise ValueError("truncated block stream")
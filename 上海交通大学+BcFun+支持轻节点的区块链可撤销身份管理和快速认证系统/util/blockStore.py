@@ -0,0 +1,289 @@
+import mmap
+import os
+import shutil
+import struct
+import threading
+import zlib
+from util import blockCodec
+
+# 记录头：crc32, 操作类型, 区块高度, block_hash 长度, 数据长度
+HEADER = struct.Struct("<IBQHI")
+# 偏移量索引文件头：魔数, 已覆盖的段号, 已覆盖的段内偏移量, 索引项数量
+INDEX_HEADER = struct.Struct("<4sIQQ")
+INDEX_MAGIC = b"BIDX"
+# 偏移量索引项：完整区块的 (段号, 偏移量, 长度)，最近一次修改记录的 (段号, 偏移量, 长度)
+INDEX_ENTRY = struct.Struct("<IQIIQI")
+
+# 操作类型
+OP_PUT = 1  # 追加完整区块
+OP_REVISE = 2  # 区块修改，记录修改后的完整区块，只需保留最近一次修改
+OP_RESET = 3  # 链被整体替换，之前的记录全部作废
+
+
+# 追加写入的区块存储
+# 数据按顺序写入 segment_xxxxxx.log 文件，每条记录带 crc 校验，读取时通过 mmap 直接定位
+# 区块使用 blockCodec 的二进制格式保存，旧版本写入的 JSON 记录仍可读取
+# 偏移量索引保存在 index.dat 中，按区块高度定长存放，启动时只需校验并补扫索引之后新写入的记录，
+# 不需要读取整条链；索引缺失或与数据不一致时从头扫描重建
+# 数据中遇到不完整或校验失败的记录则从该处截断，以从写入中途崩溃中恢复
+class BlockStore:
+    def __init__(self, path, segment_size=64 * 1024 * 1024, fsync=True):
+        self.path = path
+        self.segment_size = segment_size
+        self.fsync = fsync
+        self.length = 0
+        self.hashes = None
+        self.segment = 0
+        self.writer = None
+        self.maps = {}
+        # 写入与重新映射段文件时持有，允许多个线程同时读取
+        self.lock = threading.RLock()
+        os.makedirs(self.path, exist_ok=True)
+        self.index_fd = os.open(os.path.join(self.path, "index.dat"), os.O_RDWR | os.O_CREAT, 0o644)
+        self.recover()
+
+    def segment_path(self, segment):
+        return os.path.join(self.path, "segment_%06d.log" % segment)
+
+    def segments(self):
+        result = []
+        for name in os.listdir(self.path):
+            if name.startswith("segment_") and name.endswith(".log"):
+                result.append(int(name[8:-4]))
+        return sorted(result)
+
+    # 加载偏移量索引，并补扫索引未覆盖的记录
+    def recover(self):
+        segments = self.segments()
+        start = self.load_index(segments)
+        if start is None:
+            # 索引不可用，从头重建
+            self.reset_index()
+            start = (segments[0], 0) if segments else (0, 0)
+        for i in range(len(segments)):
+            segment = segments[i]
+            if segment < start[0]:
+                continue
+            valid_end = self.scan_segment(segment, start[1] if segment == start[0] else 0)
+            if valid_end is not None:
+                # 截断损坏的尾部，并丢弃之后的段
+                with open(self.segment_path(segment), "r+b") as f:
+                    f.truncate(valid_end)
+                for later in segments[i + 1:]:
+                    os.remove(self.segment_path(later))
+                segments = segments[:i + 1]
+                break
+        self.segment = segments[-1] if segments else 0
+        self.writer = open(self.segment_path(self.segment), "ab")
+        self.write_index_header()
+
+    # 读取索引文件，返回索引已覆盖到的 (段号, 偏移量)，索引不可用时返回 None
+    def load_index(self, segments):
+        size = os.fstat(self.index_fd).st_size
+        if size < INDEX_HEADER.size or (size - INDEX_HEADER.size) % INDEX_ENTRY.size:
+            return None
+        magic, segment, offset, length = INDEX_HEADER.unpack(os.pread(self.index_fd, INDEX_HEADER.size, 0))
+        if magic != INDEX_MAGIC or (size - INDEX_HEADER.size) // INDEX_ENTRY.size < length:
+            return None
+        if segments and (segment not in segments or os.path.getsize(self.segment_path(segment)) < offset):
+            return None
+        self.length = length
+        # 校验最后一个索引项指向的记录，防止索引文件写入不完整
+        if self.length and not self.check_record(self.location(self.length - 1)[0]):
+            return None
+        return segment, offset
+
+    # 清空索引，文件头在重建完成后才重新写入，重建中途崩溃时下次启动会再次重建
+    def reset_index(self):
+        os.ftruncate(self.index_fd, 0)
+        os.pwrite(self.index_fd, bytes(INDEX_HEADER.size), 0)
+        self.length = 0
+        self.hashes = None
+
+    def write_index_header(self):
+        offset = self.writer.tell() if self.writer else 0
+        os.pwrite(self.index_fd, INDEX_HEADER.pack(INDEX_MAGIC, self.segment, offset, self.length), 0)
+
+    def write_index_entry(self, height, base, revision):
+        os.pwrite(self.index_fd, INDEX_ENTRY.pack(*(base + revision)),
+                  INDEX_HEADER.size + height * INDEX_ENTRY.size)
+
+    # 读取区块高度对应的 (完整区块位置, 修改记录位置)
+    def location(self, height):
+        entry = INDEX_ENTRY.unpack(os.pread(self.index_fd, INDEX_ENTRY.size,
+                                            INDEX_HEADER.size + height * INDEX_ENTRY.size))
+        return entry[:3], entry[3:]
+
+    # 扫描单个段文件，返回 None 表示文件完整，否则返回最后一条有效记录的结束位置
+    def scan_segment(self, segment, offset=0):
+        with open(self.segment_path(segment), "rb") as f:
+            f.seek(offset)
+            while True:
+                header = f.read(HEADER.size)
+                if len(header) == 0:
+                    return None
+                if len(header) < HEADER.size:
+                    return offset
+                crc, op, height, hash_len, payload_len = HEADER.unpack(header)
+                body = f.read(hash_len + payload_len)
+                if len(body) < hash_len + payload_len or zlib.crc32(header[4:] + body) != crc:
+                    return offset
+                length = HEADER.size + hash_len + payload_len
+                self.apply(op, height, body[:hash_len].decode(), (segment, offset, length))
+                offset += length
+
+    # 将一条记录应用到偏移量索引
+    def apply(self, op, height, block_hash, location):
+        if op == OP_RESET:
+            self.reset_index()
+            self.write_index_header()
+        elif op == OP_PUT:
+            self.write_index_entry(self.length, location, (0, 0, 0))
+            self.length += 1
+            if self.hashes is not None:
+                self.hashes[block_hash] = height
+        elif op == OP_REVISE and height < self.length:
+            self.write_index_entry(height, self.location(height)[0], location)
+
+    def write(self, op, height, block_hash, payload):
+        with self.lock:
+            self.write_record(op, height, block_hash, payload)
+
+    def write_record(self, op, height, block_hash, payload):
+        if self.writer.tell() >= self.segment_size:
+            self.writer.close()
+            self.segment += 1
+            self.writer = open(self.segment_path(self.segment), "ab")
+        hash_bytes = block_hash.encode()
+        body = HEADER.pack(0, op, height, len(hash_bytes), len(payload))[4:] + hash_bytes + payload
+        record = struct.pack("<I", zlib.crc32(body)) + body
+        offset = self.writer.tell()
+        self.writer.write(record)
+        self.writer.flush()
+        if self.fsync:
+            os.fsync(self.writer.fileno())
+        # 数据落盘后再更新索引
+        self.apply(op, height, block_hash, (self.segment, offset, len(record)))
+        self.write_index_header()
+
+    # 在链尾追加区块
+    def append(self, block):
+        self.write(OP_PUT, self.length, block["block_hash"], blockCodec.encode_block(block))
+
+    # 记录区块的修改
+    def revise(self, height, block):
+        self.write(OP_REVISE, height, block["block_hash"], blockCodec.encode_block(block))
+
+    # 整条链被替换时调用
+    def reset(self, chain):
+        with self.lock:
+            self.write(OP_RESET, 0, "", b"")
+            for block in chain:
+                self.append(block)
+
+    # 用另一个存储（例如重新同步时写入的临时存储）替换本存储的数据，staging 的目录随后被删除
+    # 先清空索引并从后往前删除旧的段文件，再按顺序移入新的段文件，最后换入新的索引
+    # 中途崩溃时目录中剩下的总是旧链或新链的前缀，下次启动时由 recover 扫描恢复
+    def swap(self, staging):
+        with self.lock:
+            with staging.lock:
+                staging.close()
+                segments = staging.segments()
+                for segment in segments:
+                    with open(staging.segment_path(segment), "rb") as f:
+                        os.fsync(f.fileno())
+                self.writer.close()
+                for mapped in self.maps.values():
+                    mapped.close()
+                self.maps = {}
+                self.reset_index()
+                os.fsync(self.index_fd)
+                for segment in reversed(self.segments()):
+                    os.remove(self.segment_path(segment))
+                for segment in segments:
+                    os.replace(staging.segment_path(segment), self.segment_path(segment))
+                os.close(self.index_fd)
+                os.replace(os.path.join(staging.path, "index.dat"), os.path.join(self.path, "index.dat"))
+                shutil.rmtree(staging.path)
+            self.index_fd = os.open(os.path.join(self.path, "index.dat"), os.O_RDWR | os.O_CREAT, 0o644)
+            self.length = 0
+            self.hashes = None
+            self.recover()
+
+    # 通过 mmap 读取记录，段文件增长后重新映射
+    def read_record(self, location):
+        segment, offset, length = location
+        with self.lock:
+            mapped = self.maps.get(segment)
+            if mapped is None or offset + length > len(mapped):
+                if mapped is not None:
+                    mapped.close()
+                with open(self.segment_path(segment), "rb") as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.maps[segment] = mapped
+            return mapped[offset:offset + length]
+
+    def check_record(self, location):
+        segment, offset, length = location
+        if not os.path.exists(self.segment_path(segment)) or \
+                os.path.getsize(self.segment_path(segment)) < offset + length:
+            return False
+        record = self.read_record(location)
+        return zlib.crc32(record[4:]) == struct.unpack("<I", record[:4])[0]
+
+    def read_payload(self, location):
+        record = self.read_record(location)
+        hash_len = HEADER.unpack(record[:HEADER.size])[3]
+        return blockCodec.decode_block(record[HEADER.size + hash_len:])
+
+    def read_hash(self, location):
+        record = self.read_record(location)
+        hash_len = HEADER.unpack(record[:HEADER.size])[3]
+        return record[HEADER.size:HEADER.size + hash_len].decode()
+
+    # 按高度读取单个区块
+    def get(self, height):
+        base, revision = self.location(height)
+        if revision[2]:
+            changes = self.read_payload(revision)
+            if "index" in changes:
+                return changes
+            # 旧版本的修改记录只包含变化的字段
+            block = self.read_payload(base)
+            block.update(changes)
+            return block
+        return self.read_payload(base)
+
+    # 区块在存储中的大小，用于估算缓存占用
+    def size(self, height):
+        base, revision = self.location(height)
+        return base[2] + revision[2]
+
+    # 按哈希读取单个区块，查不到返回 None
+    # 哈希表在第一次查询时通过读取记录头建立
+    def get_by_hash(self, block_hash):
+        with self.lock:
+            if self.hashes is None:
+                hashes = {}
+                for height in range(self.length):
+                    hashes[self.read_hash(self.location(height)[0])] = height
+                self.hashes = hashes
+        height = self.hashes.get(block_hash)
+        if height is None:
+            return None
+        return self.get(height)
+
+    def load_all(self):
+        return [self.get(height) for height in range(self.length)]
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+        for mapped in self.maps.values():
+            mapped.close()
+        self.maps = {}
+        os.close(self.index_fd)
+
+    def __len__(self):
+        return self.length
@@ -0,0 +1,123 @@
+import os
+from util import hashTool
+from util.merkle import MerkleTree
+
+# 同步的区块数不少于该值时交给进程池验证
+PARALLEL_THRESHOLD = 8
+# 进程池中每个任务最多包含的区块数量，区块较少时缩小，使每个工作进程都有任务
+CHUNK_SIZE = 16
+# 进程池的工作进程数（与 hashTool.get_process_pool 一致）
+WORKERS = os.cpu_count() or 1
+
+# 工作进程中缓存的预计算表，(g, y) 序列化字符串 -> (FixedBase, FixedBase)
+fixed_bases = {}
+
+
+# 参与区块哈希计算的区块头信息
+def block_message(block):
+    return str(block["index"]) + block["timestamp"] + block["previous_hash"] + block["merkle_root"]
+
+
+def get_fixed_bases(g, y):
+    if (g, y) not in fixed_bases:
+        fixed_bases[(g, y)] = (hashTool.FixedBase(hashTool.chameleon_deserialize(g)),
+                               hashTool.FixedBase(hashTool.chameleon_deserialize(y)))
+    return fixed_bases[(g, y)]
+
+
+# 验证单个区块：变色龙哈希与 block_hash 一致，并且 merkle 树与 merkle_root 一致（只有区块头时跳过）
+# g, y: 反序列化后的群元素或 FixedBase
+# tree: 可选，解码时已由叶子构建的 MerkleTree，直接比较其根，不再由嵌套结构重新构建
+def verify_block(g, y, block, tree=None):
+    try:
+        block_hash = hashTool.chameleon_verify(g=g, y=y, msg=block_message(block),
+                                               r=hashTool.chameleon_deserialize(block["r"]),
+                                               s=hashTool.chameleon_deserialize(block["s"]))
+        if hashTool.chameleon_serialize(block_hash) != block["block_hash"]:
+            return False
+        if tree is not None:
+            return tree.root == block["merkle_root"]
+        if "merkle_tree" in block:
+            return MerkleTree.from_nested(block["merkle_tree"]).root == block["merkle_root"]
+        return True
+    except (KeyError, TypeError, ValueError):
+        return False
+
+
+# 去掉 merkle 树的区块，merkle 根已在本进程中验证过时只需把区块头交给进程池
+def without_tree(block):
+    result = {}
+    for key in block:
+        if key != "merkle_tree":
+            result[key] = block[key]
+    return result
+
+
+# 在进程池中执行的任务，g, y 为序列化字符串
+def verify_block_chunk(g, y, blocks):
+    g, y = get_fixed_bases(g, y)
+    return [verify_block(g, y, block) for block in blocks]
+
+
+# 检查区块与前一个区块的链接关系，previous 为 None 表示创世区块
+def is_linked(previous, block):
+    try:
+        if previous is None:
+            return block["index"] == 0 and block["previous_hash"] == ""
+        return block["index"] == previous["index"] + 1 and block["previous_hash"] == previous["block_hash"]
+    except (KeyError, TypeError):
+        return False
+
+
+# 一批区块的验证，创建时已把任务提交给进程池
+# 迭代时按顺序逐个返回验证通过的区块，遇到第一个验证失败的区块即停止
+class Verification:
+    def __init__(self, blocks, results, futures):
+        self.blocks = blocks
+        self.results = results
+        self.futures = futures
+
+    def __iter__(self):
+        try:
+            for block, result in zip(self.blocks, self.results):
+                if not result:
+                    return
+                yield block
+        finally:
+            self.cancel()
+
+    # 取消尚未开始的任务，验证中途失败或不再需要结果时调用
+    def cancel(self):
+        for future in self.futures:
+            future.cancel()
+
+
+# 验证一段连续的区块，立即提交验证任务，返回 Verification
+# 调用方可以在等待结果的同时接收下一批区块
+# chameleon: 序列化的变色龙哈希参数，params: 本地已反序列化的参数（区块较少时直接在当前线程验证）
+# previous: 本地链尾区块，从创世区块开始验证时为 None
+# trees: 可选，与 blocks 一一对应的 MerkleTree（解码时构建，没有时为 None），
+# 有树的区块在本进程中比较 merkle 根，进程池只验证区块头，避免传输并重建整棵 merkle 树
+def verify_blocks(chameleon, params, blocks, previous=None, trees=None):
+    if trees is None:
+        trees = [None] * len(blocks)
+    linked = []
+    for block, tree in zip(blocks, trees):
+        if not is_linked(previous, block):
+            break
+        if tree is not None:
+            if tree.root != block.get("merkle_root"):
+                break
+            block = without_tree(block)
+        linked.append(block)
+        previous = block
+    futures = []
+    if len(linked) < PARALLEL_THRESHOLD:
+        results = (verify_block(params["g"], params["y"], block) for block in linked)
+    else:
+        size = min(CHUNK_SIZE, -(-len(linked) // WORKERS))
+        chunks = [linked[i:i + size] for i in range(0, len(linked), size)]
+        pool = hashTool.get_process_pool()
+        futures = [pool.submit(verify_block_chunk, chameleon["g"], chameleon["y"], chunk) for chunk in chunks]
+        results = (result for future in futures for result in future.result())
+    return Verification(blocks[:len(linked)], results, futures)
@@ -0,0 +1,356 @@
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from util import hashTool
+from util.merkle import is_tombstone, tombstone_hash, identity_digest
+
+# find_identity 的查询方式
+KEY = "key"
+MESSAGE = "message"
+
+# 索引格式的版本，与持久化的索引不一致时重建
+SCHEMA_VERSION = "1"
+# 启动时持久化的索引落后链尾不超过该区块数时直接补齐，否则在后台补齐
+CATCH_UP_LIMIT = 256
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)",
+    "CREATE TABLE IF NOT EXISTS blocks (hash TEXT PRIMARY KEY, height INTEGER)",
+    "CREATE TABLE IF NOT EXISTS transactions (hash TEXT PRIMARY KEY, height INTEGER, position INTEGER)",
+    "CREATE INDEX IF NOT EXISTS transactions_height ON transactions (height)",
+    "CREATE TABLE IF NOT EXISTS identities (hash TEXT PRIMARY KEY, public_key TEXT, message TEXT, height INTEGER, "
+    "status TEXT)",
+    "CREATE TABLE IF NOT EXISTS public_keys (key TEXT PRIMARY KEY, hash TEXT)",
+    "CREATE TABLE IF NOT EXISTS messages (digest TEXT PRIMARY KEY, hash TEXT)",
+)
+TABLES = ("meta", "blocks", "transactions", "identities", "public_keys", "messages")
+
+
+# 链上数据的索引，保存在 sqlite 数据库中
+# blocks: block_hash -> 区块高度
+# transactions: 交易哈希 -> (区块高度, 交易在 merkle 树叶子中的位置)
+# identities: 身份交易哈希 -> 身份状态记录
+# public_keys: 公钥 -> 最新的身份交易哈希
+# messages: 身份信息的摘要 -> 最新的身份交易哈希
+# 公钥与身份信息分开索引，注册的身份信息与他人的公钥相同时不会影响按公钥的查询
+# 被撤销的身份交易在链上只剩占位叶子，重建索引时由占位叶子中的原交易哈希与公钥恢复撤销状态，
+# 被撤销身份的记录不保存身份信息原文（message 为 None），也不保留身份信息的摘要，只能按公钥查到
+# meta: length 为已索引的链长，tip 为最后一个已索引区块的哈希，base 为链的起始高度，pending 为修改中的区块高度
+# path 为 None 时索引只保存在内存中（测试模式）；否则与区块存储放在一起，节点重启时通过 load 直接使用，
+# 只需补充索引之后新写入的区块，启动时间与链长无关
+# 区块被追加、同步或修改时需要同步更新索引；所有数据库操作都在 lock 内进行
+class ChainIndex:
+    def __init__(self, path=None):
+        self.db = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        if path:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+        # 索引重建期间写操作等待重建完成，查询等待 ready
+        self.lock = threading.RLock()
+        self.ready = threading.Event()
+        self.ready.set()
+        with self.lock:
+            for statement in SCHEMA:
+                self.db.execute(statement)
+            if self.get_meta("version") != SCHEMA_VERSION:
+                for table in TABLES:
+                    self.db.execute("DROP TABLE IF EXISTS " + table)
+                for statement in SCHEMA:
+                    self.db.execute(statement)
+                self.set_meta("version", SCHEMA_VERSION)
+            self.db.commit()
+
+    def get_meta(self, key):
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, str(value)))
+
+    # 节点启动时调用：持久化的索引与链一致时只补充索引之后新写入的区块，否则重建
+    # 上次修改区块中途退出时，按链中的区块重新索引该区块
+    # snapshot: 从快照启动时使用的快照，需要重建时作为初始状态
+    def load(self, chain, snapshot=None):
+        base = getattr(chain, "base", 0)
+        with self.lock:
+            length = int(self.get_meta("length") or 0)
+            if length > base:
+                consistent = int(self.get_meta("base") or 0) == base and length <= len(chain) and \
+                    chain[length - 1]["block_hash"] == self.get_meta("tip")
+            else:
+                consistent = length == 0 and base == 0
+            if not consistent:
+                self.rebuild(chain, background=True, snapshot=snapshot)
+                return
+            for height in json.loads(self.get_meta("pending") or "[]"):
+                if base <= height < length:
+                    self.reindex_block(height, chain[height])
+            self.db.execute("DELETE FROM meta WHERE key = 'pending'")
+            self.db.commit()
+        if len(chain) - length > CATCH_UP_LIMIT:
+            self.ready.clear()
+            threading.Thread(target=self.catch_up, args=(chain, length), daemon=True).start()
+        else:
+            self.catch_up(chain, length)
+
+    # 索引 start 之后的区块
+    def catch_up(self, chain, start):
+        with self.lock:
+            for height in range(start, len(chain)):
+                self.add_block(height, chain[height])
+        self.ready.set()
+
+    # 根据整条链重建索引
+    # background 为 True 时在后台线程中重建
+    # snapshot: 从快照启动时，快照中的身份状态作为初始状态，chain 为 PrunedChain
+    def rebuild(self, chain, background=False, snapshot=None):
+        self.ready.clear()
+        if background:
+            threading.Thread(target=self.rebuild, args=(chain, False, snapshot), daemon=True).start()
+            return
+        base = getattr(chain, "base", 0)
+        with self.lock:
+            for table in TABLES:
+                if table != "meta":
+                    self.db.execute("DELETE FROM " + table)
+            self.db.execute("DELETE FROM meta WHERE key != 'version'")
+            if snapshot is not None:
+                self.seed(snapshot)
+            height = base
+            for block in chain:
+                self.index_block(height, block)
+                height += 1
+            self.set_meta("base", base)
+            if height > base:
+                self.set_meta("length", height)
+                self.set_meta("tip", chain[height - 1]["block_hash"])
+            self.db.commit()
+        self.ready.set()
+
+    # 以快照中的身份状态作为初始状态
+    def seed(self, snapshot):
+        identities = snapshot["identities"]
+        self.db.executemany("INSERT OR REPLACE INTO identities VALUES (?, ?, ?, ?, ?)", [
+            (record["hash"], record["from"], record["message"], record["index"], record["status"])
+            for record in identities.values()])
+        if "public_keys" in snapshot:
+            public_keys = snapshot["public_keys"]
+            messages = snapshot["messages"]
+        else:
+            # 旧版本的快照没有分开的公钥与身份信息索引，按区块高度依次由身份记录推出
+            public_keys, messages = {}, {}
+            for record in sorted(identities.values(), key=lambda record: record["index"]):
+                public_keys[record["from"]] = record["hash"]
+                if record["message"] is not None:
+                    messages[identity_digest(record["message"])] = record["hash"]
+        self.db.executemany("INSERT OR REPLACE INTO public_keys VALUES (?, ?)", public_keys.items())
+        self.db.executemany("INSERT OR REPLACE INTO messages VALUES (?, ?)", messages.items())
+
+    # 新区块加入链尾时调用
+    def add_block(self, height, block):
+        with self.lock:
+            self.index_block(height, block)
+            self.set_meta("length", height + 1)
+            self.set_meta("tip", block["block_hash"])
+            self.db.commit()
+
+    def index_block(self, height, block):
+        self.db.execute("INSERT OR REPLACE INTO blocks VALUES (?, ?)", (block["block_hash"], height))
+        self.index_transactions(height, block)
+
+    # 修改区块时使用：先记录修改中的区块高度，修改完成后清除
+    # 修改中途退出（包括抛出异常）时记录保留，下次 load 时按链中的区块重新索引
+    @contextmanager
+    def revision(self, height):
+        with self.lock:
+            pending = json.loads(self.get_meta("pending") or "[]")
+            self.set_meta("pending", json.dumps(pending + [height]))
+            self.db.commit()
+        yield
+        with self.lock:
+            pending = json.loads(self.get_meta("pending") or "[]")
+            if height in pending:
+                pending.remove(height)
+            self.set_meta("pending", json.dumps(pending))
+            self.db.commit()
+
+    # 区块内容被修改后（撤销交易），重建该区块的交易索引
+    # 从区块中消失的身份交易即视为被撤销
+    def update_block(self, height, block):
+        with self.lock:
+            self.reindex_block(height, block)
+            self.db.commit()
+
+    def reindex_block(self, height, block):
+        old_hashes = self.block_hashes(height)
+        self.db.execute("DELETE FROM transactions WHERE height = ?", (height,))
+        self.index_block(height, block)
+        current = set(self.block_hashes(height))
+        for tran_hash in old_hashes:
+            if tran_hash not in current:
+                self.mark_revoked(tran_hash)
+
+    def block_hashes(self, height):
+        return [row[0] for row in self.db.execute("SELECT hash FROM transactions WHERE height = ?", (height,))]
+
+    def index_transactions(self, height, block):
+        leaves = []
+        if "merkle_tree" in block:
+            hashTool.from_merkel_to_list(block["merkle_tree"], leaves)
+        self.db.executemany("INSERT OR REPLACE INTO transactions VALUES (?, ?, ?)",
+                            [(leaves[position]["hash"], height, position) for position in range(len(leaves))])
+        identities = [leaf for leaf in leaves if is_identity_transaction(leaf)]
+        if identities:
+            self.index_identities(height, identities)
+        for leaf in leaves:
+            if is_tombstone(leaf):
+                self.index_tombstone(height, leaf)
+
+    # 交易被占位叶子替换（撤销）时调用，只更新该交易对应的索引项
+    def revoke_transaction(self, height, tran_hash, leaf):
+        with self.lock:
+            position = self.db.execute("SELECT position FROM transactions WHERE hash = ?", (tran_hash,)).fetchone()[0]
+            self.db.execute("DELETE FROM transactions WHERE hash = ?", (tran_hash,))
+            self.db.execute("INSERT OR REPLACE INTO transactions VALUES (?, ?, ?)", (leaf["hash"], height, position))
+            self.mark_revoked(tran_hash)
+            self.db.commit()
+
+    # 撤销快照之前（已被裁剪）区块中的交易，本地没有这些区块，只更新身份状态
+    def revoke_pruned(self, tran_hashes):
+        with self.lock:
+            for tran_hash in tran_hashes:
+                self.mark_revoked(tran_hash)
+            self.db.commit()
+
+    # 身份被撤销后只保留公钥，身份信息原文及其摘要与链上一样被删除，各节点的记录因此一致
+    # 快照中也不会出现被撤销身份信息的摘要，无法用于验证对身份信息的猜测
+    def mark_revoked(self, tran_hash):
+        self.db.execute("UPDATE identities SET status = 'revoked', message = NULL WHERE hash = ?", (tran_hash,))
+        self.db.execute("DELETE FROM messages WHERE hash = ?", (tran_hash,))
+
+    # 同一公钥或身份信息重复注册时，以最新的记录为准
+    # 已被撤销的身份不会因为同一交易再次出现而恢复
+    def index_identities(self, height, transactions):
+        statuses = dict(self.db.execute(
+            "SELECT hash, status FROM identities WHERE hash IN (%s)" % ",".join("?" * len(transactions)),
+            [transaction["hash"] for transaction in transactions]))
+        added = [transaction for transaction in transactions if transaction["hash"] not in statuses]
+        self.db.executemany("INSERT OR REPLACE INTO identities VALUES (?, ?, ?, ?, 'active')", [
+            (transaction["hash"], transaction["from"], transaction["message"], height) for transaction in added])
+        self.db.executemany("INSERT OR REPLACE INTO public_keys VALUES (?, ?)", [
+            (transaction["from"], transaction["hash"]) for transaction in added])
+        self.db.executemany("INSERT OR REPLACE INTO messages VALUES (?, ?)", [
+            (identity_digest(transaction["message"]), transaction["hash"]) for transaction in added])
+        self.db.executemany("UPDATE identities SET height = ? WHERE hash = ?", [
+            (height, tran_hash) for tran_hash, status in statuses.items() if status != "revoked"])
+
+    # 由占位叶子恢复被撤销身份的记录
+    # 占位叶子的哈希必须由其中记录的原交易哈希与公钥得出，否则叶子中的字段不被采信；没有公钥的占位叶子对应的不是身份交易
+    def index_tombstone(self, height, leaf):
+        tran_hash = leaf.get("revoked")
+        key = leaf.get("key")
+        try:
+            if tombstone_hash(tran_hash, key) != leaf["hash"]:
+                return
+        except (TypeError, ValueError):
+            return
+        if self.db.execute("SELECT 1 FROM identities WHERE hash = ?", (tran_hash,)).fetchone():
+            self.mark_revoked(tran_hash)
+            return
+        if key is None:
+            return
+        self.db.execute("INSERT INTO identities VALUES (?, ?, NULL, ?, 'revoked')", (tran_hash, key, height))
+        self.db.execute("INSERT OR REPLACE INTO public_keys VALUES (?, ?)", (key, tran_hash))
+
+    # 查询区块高度，查不到返回 None
+    def block_height(self, block_hash):
+        if not isinstance(block_hash, str):
+            return None
+        self.ready.wait()
+        with self.lock:
+            row = self.db.execute("SELECT height FROM blocks WHERE hash = ?", (block_hash,)).fetchone()
+        return row[0] if row else None
+
+    # 查询交易位置，返回 (height, position)，查不到返回 None
+    def locate_transaction(self, tran_hash):
+        if not isinstance(tran_hash, str):
+            return None
+        self.ready.wait()
+        with self.lock:
+            row = self.db.execute("SELECT height, position FROM transactions WHERE hash = ?", (tran_hash,)).fetchone()
+        return tuple(row) if row else None
+
+    # 交易是否已上链，包括已被撤销、链上只剩占位叶子的交易
+    # 身份交易的占位叶子哈希还包含公钥，由身份记录判断
+    def is_known(self, tran_hash):
+        if not isinstance(tran_hash, str):
+            return False
+        try:
+            hashes = (tran_hash, tombstone_hash(tran_hash))
+        except ValueError:
+            hashes = (tran_hash, tran_hash)
+        self.ready.wait()
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM transactions WHERE hash IN (?, ?)", hashes).fetchone() is not None or \
+                self.db.execute("SELECT 1 FROM identities WHERE hash = ?", (tran_hash,)).fetchone() is not None
+
+    # 导出身份状态，用于生成快照，返回 {"identities", "public_keys", "messages"}
+    def export_identities(self):
+        self.ready.wait()
+        with self.lock:
+            identities = {}
+            for row in self.db.execute("SELECT hash, public_key, message, height, status FROM identities"):
+                identities[row[0]] = identity_record(row)
+            return {
+                "identities": identities,
+                "public_keys": dict(self.db.execute("SELECT key, hash FROM public_keys")),
+                "messages": dict(self.db.execute("SELECT digest, hash FROM messages"))
+            }
+
+    # 查询身份状态，查不到返回 None
+    # by: "key" 按公钥查询，"message" 按身份信息查询
+    def find_identity(self, key, by=KEY):
+        if not isinstance(key, str):
+            return None
+        self.ready.wait()
+        with self.lock:
+            if by == MESSAGE:
+                row = self.db.execute("SELECT hash FROM messages WHERE digest = ?", (identity_digest(key),)).fetchone()
+            else:
+                row = self.db.execute("SELECT hash FROM public_keys WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            row = self.db.execute("SELECT hash, public_key, message, height, status FROM identities WHERE hash = ?",
+                                  (row[0],)).fetchone()
+        if row is None:
+            return None
+        return identity_record(row)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+# 数据库中的一行 -> 身份状态记录 {"from", "message", "hash", "index", "status"}
+def identity_record(row):
+    return {"from": row[1], "message": row[2], "hash": row[0], "index": row[3], "status": row[4]}
+
+
+# 判断交易是否为用户提交的身份交易
+# 创世交易、NULL 填充交易、撤销占位叶子以及 leader 生成的区块更新交易不计入身份索引
+def is_identity_transaction(transaction):
+    if "from" not in transaction or "message" not in transaction:
+        return False
+    message = transaction["message"]
+    if message in ("genesis block", "NULL") or is_tombstone(transaction):
+        return False
+    if message.startswith("{"):
+        try:
+            info = json.loads(message)
+            # 区块更新交易，批量撤销时为 {"updates": [...]}
+            if "new_MH_root" in info or "updates" in info:
+                return False
+        except (ValueError, TypeError):
+            pass
+    return True
@@ -1,28 +1,31 @@
 import json
-from hashlib import sha256
 import ecdsa
 import base64
+import multiprocessing
+import threading
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
 from util.lss import SecretShare
+from util.merkle import MerkleTree
 from charm.toolbox.eccurve import prime192v1
 from charm.toolbox.ecgroup import ECGroup, G, ZR
 
 group = ECGroup(prime192v1)
 model = SecretShare(group)
 
+# 批量验证签名时，交易数不少于该值才交给进程池处理
+BATCH_VERIFY_THRESHOLD = 16
+# 进程池中每个任务包含的签名数量
+BATCH_VERIFY_CHUNK = 32
+process_pool = None
+process_pool_lock = threading.Lock()
+
 
 # 创建 merkel 树
 # data: ["{"from":"xx", "to": "xx", "message":"xx", "sig": "xx", "hash": "xxx}, ...]
+# 返回嵌套结构的 merkle 树，计算由数组存储的 MerkleTree 完成
 def merkel_tree(data):
-    while len(data) != 1:
-        tmp = []
-        for i in range(0, len(data), 2):
-            if i + 1 >= len(data):
-                tmp.append(data[i])
-            else:
-                new_hash = sha256(bytes.fromhex(data[i]["hash"]) + bytes.fromhex(data[i + 1]["hash"])).hexdigest()
-                tmp.append({"hash": new_hash, "data": [data[i], data[i + 1]]})
-        data = tmp
-    return data[0]
+    return MerkleTree(data).to_nested()
 
 
 # 将 merkel 树转换成 list
@@ -60,15 +63,83 @@ def sign(private_key, data):
 # message: bytes 类型的消息数据
 # 返回 True（验证成功）或 False（验证失败）
 def validate_signature(public_key, signature, message):
-    signature = base64.b64decode(signature)
     try:
-        vk = ecdsa.VerifyingKey.from_string(
-            bytes.fromhex(public_key), curve=ecdsa.SECP256k1)
+        signature = base64.b64decode(signature)
+        vk = verifying_key(public_key)
         return vk.verify(signature, message)
     except:
         return False
 
 
+# 解析公钥，结果按 LRU 缓存，避免重复解析同一公钥
+# public_key: hex string 格式的公钥
+@lru_cache(maxsize=4096)
+def verifying_key(public_key):
+    return ecdsa.VerifyingKey.from_string(bytes.fromhex(public_key), curve=ecdsa.SECP256k1)
+
+
+# 获取用于批量验证的进程池，第一次使用时创建，节点启动时会先调用一次
+# 节点进程中有多个线程，fork 出的工作进程可能继承其他线程持有的锁，因此用 spawn 方式启动工作进程
+def get_process_pool():
+    global process_pool
+    with process_pool_lock:
+        if process_pool is None:
+            process_pool = ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn"))
+        return process_pool
+
+
+# 在进程池中执行的任务，验证一组签名
+def validate_signature_chunk(items):
+    return [validate_signature(*item) for item in items]
+
+
+# 批量验证签名
+# items: [(public_key, signature, message), ...]，参数含义同 validate_signature
+# 返回与 items 顺序一致的验证结果列表
+def validate_signatures(items):
+    items = list(items)
+    if len(items) < BATCH_VERIFY_THRESHOLD:
+        return validate_signature_chunk(items)
+    chunks = [items[i:i + BATCH_VERIFY_CHUNK] for i in range(0, len(items), BATCH_VERIFY_CHUNK)]
+    results = []
+    for chunk_result in get_process_pool().map(validate_signature_chunk, chunks):
+        results.extend(chunk_result)
+    return results
+
+
+# 固定底数的幂运算
+# 对固定不变的底数（变色龙哈希中的 g 和 y）预先计算窗口表：
+# table[i][j] = base ^ (j * 2^(window * i))，求幂时按窗口拆分指数，只需查表相乘，不再需要平方运算
+# 可以直接替代群元素参与 chameleon_hash / chameleon_verify / chameleon_adjust 中的 g ** s 运算
+class FixedBase:
+    def __init__(self, base, window=4):
+        self.base = base
+        self.window = window
+        self.order = int(group.order())
+        self.identity = base ** 0
+        self.table = []
+        power = base
+        for i in range(0, self.order.bit_length(), window):
+            row = [self.identity]
+            for j in range(1, 1 << window):
+                row.append(row[-1] * power)
+            self.table.append(row)
+            power = row[-1] * power
+
+    def __pow__(self, exponent):
+        e = int(exponent) % self.order
+        mask = (1 << self.window) - 1
+        result = self.identity
+        i = 0
+        while e:
+            digit = e & mask
+            if digit:
+                result = result * self.table[i][digit]
+            e >>= self.window
+            i += 1
+        return result
+
+
 # 生成 chameleon hash 初始参数
 # 返回两个大整数，x 用来修改，y 用来生成
 def chameleon_init():
@@ -94,14 +165,12 @@ def chameleon_verify(g, y, msg, r, s):
 
 
 # 变色龙哈希的修改
+# 拉格朗日系数由 model 按份额序号缓存，K 通过多重幂运算一次恢复
 def chameleon_adjust(g, keys, msg, ch):
-    x = model.recover(keys)
-    y = {}
     ki = {}
     Ki = {}
     si = {}
     for i in keys.keys():
-        y[i] = g ** keys[i]
         ki[i] = model.elem.random(ZR)
         Ki[i] = g ** ki[i]
     K = model.recoverInExp(Ki)
@@ -0,0 +1,80 @@
+import threading
+from collections import OrderedDict
+
+
+# 惰性加载的区块链视图
+# 行为与 list 相同（len、下标、负下标、切片、迭代、append），区块按需从 BlockStore 读取
+# 只有链尾的 tail 个区块和最近访问过的区块常驻内存，总大小不超过 memory_budget 字节（链尾区块不计入淘汰）
+# 注意：通过下标取得的区块对象会被缓存，不要原地修改；修改区块时通过下标赋值替换，并调用 BlockStore.revise 持久化
+# 缓存由内部锁保护，可以被多个读线程同时访问
+class LazyChain:
+    def __init__(self, store, memory_budget=32 * 1024 * 1024, tail=16):
+        self.store = store
+        self.memory_budget = memory_budget
+        self.tail = tail
+        # 区块高度 -> (区块, 占用字节数)，按访问顺序排列
+        self.cache = OrderedDict()
+        self.cache_size = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            # 切片通常用于批量发送区块，不放入缓存以免挤掉热点区块
+            return [self.load(height, False) for height in range(*item.indices(len(self)))]
+        length = len(self)
+        if item < 0:
+            item += length
+        if item < 0 or item >= length:
+            raise IndexError("chain index out of range")
+        return self.load(item)
+
+    # 替换缓存中的区块，持久化由调用者通过 BlockStore.revise 完成
+    def __setitem__(self, item, block):
+        if item < 0:
+            item += len(self)
+        if item < 0 or item >= len(self):
+            raise IndexError("chain index out of range")
+        self.remember(item, block)
+
+    def __iter__(self):
+        for height in range(len(self)):
+            yield self.load(height, False)
+
+    def load(self, height, cache=True):
+        with self.lock:
+            if height in self.cache:
+                self.cache.move_to_end(height)
+                return self.cache[height][0]
+        block = self.store.get(height)
+        if cache:
+            self.remember(height, block)
+        return block
+
+    def remember(self, height, block):
+        size = self.store.size(height)
+        with self.lock:
+            if height in self.cache:
+                self.cache_size -= self.cache.pop(height)[1]
+            self.cache[height] = (block, size)
+            self.cache_size += size
+            self.evict()
+
+    # 按最近最少使用的顺序淘汰，链尾区块始终保留
+    def evict(self):
+        hot = len(self) - self.tail
+        for height in list(self.cache):
+            if self.cache_size <= self.memory_budget:
+                break
+            if height < hot:
+                self.cache_size -= self.cache.pop(height)[1]
+
+    def append(self, block):
+        self.store.append(block)
+        self.remember(len(self) - 1, block)
+
+    def extend(self, blocks):
+        for block in blocks:
+            self.append(block)
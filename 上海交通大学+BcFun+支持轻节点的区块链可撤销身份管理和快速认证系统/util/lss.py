@@ -1,41 +1,76 @@
 #!/usr/bin/python3.9
-from charm.toolbox.ecgroup import ECGroup, G, ZR
-from charm.toolbox.eccurve import prime192v2
+from charm.toolbox.ecgroup import ZR
 
 
 class SecretShare:
-    def __init__(self, element):
+    def __init__(self, element, window=4):
         self.elem = element
+        # 多重幂运算的窗口位数
+        self.window = window
+        # 份额序号集合 -> 拉格朗日系数，恢复时序号集合通常固定，只需计算一次
+        self.coefficients = {}
 
+    # 用 Horner 法同时计算所有份额：shares[i] = q[0] + q[1]*i + ... + q[k-1]*i^(k-1)
     def genShares(self, secret, k = 0, n = 0):
         q = [self.elem.random(ZR) for i in range(0, k)]
         q[0] = secret
         shares = {}
         for i in range(0, n+1):
-            shares[i] = 0
-            for j in range(0, k):
-                shares[i] += q[j] * (i**j)
+            shares[i] = q[k-1]
+        for j in range(k-2, -1, -1):
+            for i in range(0, n+1):
+                shares[i] = shares[i] * i + q[j]
         return shares
 
+    # 计算在 0 处插值的拉格朗日系数，按序号集合缓存
+    # 每个系数只做一次求逆：coeff_i = prod(-j) / prod(i-j)
+    def lagrangeCoefficients(self, indexes):
+        key = tuple(sorted(indexes))
+        coeffs = self.coefficients.get(key)
+        if coeffs is None:
+            coeffs = {}
+            for i in key:
+                numerator, denominator = 1, 1
+                for j in key:
+                    if i!=j:
+                        numerator *= -j
+                        denominator *= i - j
+                coeffs[i] = numerator * (self.elem.init(ZR, denominator)**(-1))
+            self.coefficients[key] = coeffs
+        return coeffs
+
     def recover(self, shares):
-        indexes = shares.keys()
+        coeffs = self.lagrangeCoefficients(shares.keys())
         output = 0
-        for i in indexes:
-            coeff = 1
-            for j in indexes:
-                if i!=j:
-                    coeff *= -j * (self.elem.init(ZR, (i-j))**(-1))
-            output += coeff*shares[i]
+        for i in shares:
+            output += coeffs[i]*shares[i]
         return output
 
     def recoverInExp(self, shares):
-        indexes = shares.keys()
-        output = self.elem.random(G)**0
-        for i in indexes:
-            coeff = 1
-            for j in indexes:
-                if i!=j:
-                    coeff *= -j * (self.elem.init(ZR, (i-j))**(-1))
-            output *= shares[i]**coeff
-        return output
+        coeffs = self.lagrangeCoefficients(shares.keys())
+        indexes = list(shares.keys())
+        return self.multiExp([shares[i] for i in indexes], [coeffs[i] for i in indexes])
 
+    # 多重幂运算 prod(bases[i] ** exponents[i])（Straus 算法）
+    # 所有指数按窗口从高位到低位同时处理，平方只需做一遍，每个底数只预计算 1 .. 2^window-1 次幂
+    def multiExp(self, bases, exponents):
+        order = int(self.elem.order())
+        exponents = [int(e) % order for e in exponents]
+        identity = bases[0]**0
+        mask = (1 << self.window) - 1
+        tables = []
+        for base in bases:
+            row = [identity, base]
+            for d in range(2, 1 << self.window):
+                row.append(row[-1] * base)
+            tables.append(row)
+        digits = (max(e.bit_length() for e in exponents) + self.window - 1) // self.window
+        output = identity
+        for shift in range((digits - 1) * self.window, -1, -self.window):
+            for _ in range(self.window):
+                output = output * output
+            for row, e in zip(tables, exponents):
+                digit = (e >> shift) & mask
+                if digit:
+                    output = output * row[digit]
+        return output
@@ -0,0 +1,162 @@
+import threading
+import uuid
+from collections import deque
+
+
+def member_key(peer):
+    return peer["host"], str(peer["port"])
+
+
+# 带版本号的节点列表
+# 以 (host, port) 为键保存节点信息，每次修改版本号加一并记录在变更日志中
+# 心跳只需要携带对方已有的版本号，据此返回之后的增量；对方落后太多或版本历史不同时返回完整列表
+# epoch 标识版本号所属的历史：follower 应用 leader 的增量后沿用 leader 的 epoch，
+# 在本地修改列表时换成自己的 epoch，之后 leader 会发送完整列表重新对齐
+# peers() 返回写时复制的列表，读线程直接使用即为一致的快照
+# on_remove: 可选，节点被删除后（包括应用增量与整体替换）以节点信息调用，在 lock 之外执行
+class Membership:
+    def __init__(self, history=1024, on_remove=None):
+        self.lock = threading.Lock()
+        self.on_remove = on_remove
+        # 本次修改中被删除的节点，释放 lock 后交给 on_remove
+        self.removed = []
+        self.own_epoch = uuid.uuid4().hex
+        self.epoch = self.own_epoch
+        self.version = 0
+        self.members = {}
+        # (版本号, 键, 节点信息)，节点信息为 None 表示删除
+        self.changes = deque(maxlen=history)
+        self.snapshot = []
+
+    def peers(self):
+        return self.snapshot
+
+    def __len__(self):
+        return len(self.snapshot)
+
+    def get(self, peer):
+        return self.members.get(member_key(peer))
+
+    # peer 在列表中且信息一致
+    def contains(self, peer):
+        try:
+            return self.members.get(member_key(peer)) == peer
+        except (KeyError, TypeError):
+            return False
+
+    # 以下修改需要在持有 lock 时调用
+    def local_change(self):
+        if self.epoch != self.own_epoch:
+            self.epoch = self.own_epoch
+            self.changes.clear()
+
+    def put(self, key, peer):
+        if peer is None:
+            self.removed.append(self.members.pop(key))
+        else:
+            self.members[key] = peer
+        self.version += 1
+        self.changes.append((self.version, key, peer))
+
+    def publish(self):
+        self.snapshot = list(self.members.values())
+
+    # 在 lock 之外调用，通知本次修改中被删除的节点
+    def notify(self):
+        with self.lock:
+            removed, self.removed = self.removed, []
+        if self.on_remove is not None:
+            for peer in removed:
+                self.on_remove(peer)
+
+    # 添加节点，相同 host 与 port 的旧记录会被替换
+    def add(self, peer):
+        key = member_key(peer)
+        with self.lock:
+            if self.members.get(key) == peer:
+                return
+            self.local_change()
+            self.put(key, peer)
+            self.publish()
+
+    # 删除节点，节点不在列表中时忽略
+    def remove(self, peer):
+        key = member_key(peer)
+        with self.lock:
+            if key not in self.members:
+                return
+            self.local_change()
+            self.put(key, None)
+            self.publish()
+        self.notify()
+
+    # 整体替换
+    def replace(self, peers):
+        with self.lock:
+            self.local_change()
+            self.reset(peers)
+            self.publish()
+        self.notify()
+
+    def reset(self, peers):
+        new_members = dict((member_key(peer), peer) for peer in peers)
+        for key in list(self.members):
+            if key not in new_members:
+                self.put(key, None)
+        for key, peer in new_members.items():
+            if self.members.get(key) != peer:
+                self.put(key, peer)
+
+    # 返回让 (epoch, since) 版本的列表变为当前版本所需的信息
+    # 增量：{"epoch", "since", "version", "added": [节点], "removed": [[host, port]]}
+    # 完整列表：{"epoch", "version", "peers": [节点]}
+    def delta(self, epoch=None, since=None):
+        with self.lock:
+            oldest = self.changes[0][0] - 1 if self.changes else self.version
+            if epoch != self.epoch or since is None or since > self.version or since < oldest:
+                return {"epoch": self.epoch, "version": self.version, "peers": list(self.members.values())}
+            latest = {}
+            for version, key, peer in self.changes:
+                if version > since:
+                    latest[key] = peer
+            return {
+                "epoch": self.epoch,
+                "since": since,
+                "version": self.version,
+                "added": [peer for peer in latest.values() if peer is not None],
+                "removed": [list(key) for key, peer in latest.items() if peer is None]
+            }
+
+    # 应用 delta 的结果，增量的基础版本与本地不一致时返回 False，需要对方发送完整列表
+    def apply(self, delta):
+        result = self.apply_delta(delta)
+        self.notify()
+        return result
+
+    def apply_delta(self, delta):
+        with self.lock:
+            if "peers" in delta:
+                old_members, self.members = self.members, {}
+                self.reset(delta["peers"])
+                for key, peer in old_members.items():
+                    if key not in self.members:
+                        self.removed.append(peer)
+            elif delta.get("epoch") != self.epoch or delta.get("since") != self.version:
+                return False
+            else:
+                for peer in delta["added"]:
+                    self.put(member_key(peer), peer)
+                for host, port in delta["removed"]:
+                    if (host, str(port)) in self.members:
+                        self.put((host, str(port)), None)
+            # 版本号沿用对方的编号，本地的变更日志不再有效
+            self.changes.clear()
+            self.epoch = delta["epoch"]
+            self.version = delta["version"]
+            self.publish()
+            return True
+
+    # 本地的版本信息，随心跳发送给 leader
+    def state(self):
+        with self.lock:
+            return {"epoch": self.epoch, "version": self.version}
@@ -0,0 +1,181 @@
+from hashlib import sha256
+
+
+# 被撤销交易的占位叶子
+# revoked 记录被撤销交易的哈希；identity 为 True 时（被撤销的是身份交易）再记录其公钥 key，
+# 重建索引时据此恢复该公钥的撤销状态，身份信息本身（包括其摘要）不再保存在链上
+# 哈希由 revoked 与 key 计算，任何节点都可以独立计算出相同的占位叶子，这两个字段也随 merkle 根一起被验证
+def tombstone(transaction, identity=False):
+    key = transaction["from"] if identity else None
+    leaf = {
+        "from": "",
+        "message": "REVOKED",
+        "signature": "",
+        "hash": tombstone_hash(transaction["hash"], key),
+        "revoked": transaction["hash"]
+    }
+    if key is not None:
+        leaf["key"] = key
+    return leaf
+
+
+def tombstone_hash(tran_hash, key=None):
+    data = b"REVOKED" + bytes.fromhex(tran_hash)
+    if key is not None:
+        data += bytes.fromhex(key)
+    return sha256(data).hexdigest()
+
+
+# 身份信息的摘要，用于按身份信息查询
+def identity_digest(message):
+    return sha256(message.encode()).hexdigest()
+
+
+def is_tombstone(transaction):
+    return transaction.get("message") == "REVOKED" and transaction.get("from") == ""
+
+
+# 将嵌套结构的 merkle 树转换成叶子列表（非递归）
+def nested_leaves(merkle):
+    result = []
+    stack = [merkle]
+    while stack:
+        node = stack.pop()
+        if "data" in node:
+            stack.extend(reversed(node["data"]))
+        else:
+            result.append(node)
+    return result
+
+
+# 数组存储的 merkle 树
+# leaves: 交易列表
+# nodes: 所有节点哈希（bytes）按层依次存放在一个数组中，offsets[level] 为该层的起始位置
+# 树的形状与 hashTool.merkel_tree 相同：两两合并，奇数个时最后一个节点直接提升到上一层
+class MerkleTree:
+    def __init__(self, leaves):
+        if len(leaves) == 0:
+            raise ValueError("merkle tree needs at least one leaf")
+        self.leaves = list(leaves)
+        self.positions = {}
+        for position in range(len(self.leaves)):
+            self.positions[self.leaves[position]["hash"]] = position
+        self.nodes = [bytes.fromhex(leaf["hash"]) for leaf in self.leaves]
+        self.offsets = [0]
+        self.sizes = [len(self.leaves)]
+        while self.sizes[-1] > 1:
+            start, size = self.offsets[-1], self.sizes[-1]
+            level = self.nodes[start:start + size]
+            self.offsets.append(len(self.nodes))
+            self.sizes.append((size + 1) // 2)
+            self.nodes.extend([sha256(level[i] + level[i + 1]).digest() for i in range(0, size - 1, 2)])
+            if size % 2:
+                self.nodes.append(level[-1])
+
+    @classmethod
+    def from_nested(cls, merkle):
+        return cls(nested_leaves(merkle))
+
+    # 计算某层第 i 个节点（i 为偶数）与其兄弟节点在上一层对应的哈希
+    def combine(self, start, size, i):
+        if i + 1 >= size:
+            return self.nodes[start + i]
+        return sha256(self.nodes[start + i] + self.nodes[start + i + 1]).digest()
+
+    @property
+    def root(self):
+        return self.nodes[-1].hex()
+
+    def __len__(self):
+        return len(self.leaves)
+
+    # 查询交易在叶子中的位置，查不到返回 None
+    def position(self, tran_hash):
+        return self.positions.get(tran_hash)
+
+    # 替换叶子并沿路径重新计算哈希，O(log n)
+    # nested: 可选，与本树对应的嵌套结构 merkle 树，不会被修改
+    # 返回值：修改后的嵌套结构根节点（只有一个叶子时根节点即为新叶子），与 nested 共享未修改的子树
+    def replace(self, position, leaf, nested=None):
+        old = self.leaves[position]
+        if self.positions.get(old["hash"]) == position:
+            del self.positions[old["hash"]]
+        self.leaves[position] = leaf
+        self.positions[leaf["hash"]] = position
+        index = position
+        self.nodes[index] = bytes.fromhex(leaf["hash"])
+        for level in range(1, len(self.sizes)):
+            child = index - index % 2
+            index //= 2
+            self.nodes[self.offsets[level] + index] = self.combine(self.offsets[level - 1], self.sizes[level - 1],
+                                                                   child)
+        if nested is not None:
+            return self.patch(nested, position)
+        return None
+
+    # 生成叶子的包含性证明
+    # 返回值：从叶子到根的兄弟节点列表 [{"hash": xx, "position": "left" / "right"}, ...]
+    # 被直接提升的层没有兄弟节点，不产生证明项
+    def proof(self, position):
+        result = []
+        index = position
+        for level in range(len(self.sizes) - 1):
+            sibling = index ^ 1
+            if sibling < self.sizes[level]:
+                result.append({
+                    "hash": self.nodes[self.offsets[level] + sibling].hex(),
+                    "position": "left" if index % 2 else "right"
+                })
+            index //= 2
+        return result
+
+    # 用占位叶子替换被撤销的交易，identity 含义同 tombstone
+    def tombstone(self, position, nested=None, identity=False):
+        return self.replace(position, tombstone(self.leaves[position], identity), nested)
+
+    # 复制根到叶子路径上的节点并更新哈希（写时复制），正在被其他线程读取的旧结构保持不变
+    def patch(self, nested, position):
+        parent, slot = None, None
+        root = node = dict(nested)
+        for level in range(len(self.sizes) - 1, 0, -1):
+            index = position >> level
+            # 由下一层直接提升的节点与下一层节点是同一对象，只需处理两两合并的节点
+            if 2 * index + 1 < self.sizes[level - 1]:
+                node["hash"] = self.nodes[self.offsets[level] + index].hex()
+                node["data"] = list(node["data"])
+                parent, slot = node["data"], (position >> (level - 1)) % 2
+                node = parent[slot] = dict(parent[slot])
+        if parent is None:
+            return self.leaves[position]
+        parent[slot] = self.leaves[position]
+        return root
+
+    # 转换成与 hashTool.merkel_tree 相同的嵌套结构，用于网页展示和与其他节点交互
+    def to_nested(self):
+        level_nodes = list(self.leaves)
+        for level in range(1, len(self.sizes)):
+            size = self.sizes[level - 1]
+            tmp = []
+            for i in range(0, size, 2):
+                if i + 1 >= size:
+                    tmp.append(level_nodes[i])
+                else:
+                    tmp.append({"hash": self.nodes[self.offsets[level] + i // 2].hex(),
+                                "data": [level_nodes[i], level_nodes[i + 1]]})
+            level_nodes = tmp
+        return level_nodes[0]
+
+
+# 验证包含性证明
+# leaf_hash: 交易哈希，proof: MerkleTree.proof 的返回值，root: 区块头中的 merkle_root
+def verify_proof(leaf_hash, proof, root):
+    try:
+        current = bytes.fromhex(leaf_hash)
+        for item in proof:
+            if item["position"] == "left":
+                current = sha256(bytes.fromhex(item["hash"]) + current).digest()
+            else:
+                current = sha256(current + bytes.fromhex(item["hash"])).digest()
+        return current.hex() == root
+    except (KeyError, TypeError, ValueError):
+        return False
@@ -0,0 +1,153 @@
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+# 监控指标：计数器、仪表盘与延迟直方图，以 Prometheus 文本格式输出
+# 指标在模块加载时创建并注册到 registry，记录时只做一次加锁的字典更新，开销很小
+# 标签以关键字参数传入，例如 ROUTE_SECONDS.observe(0.01, endpoint="block", method="GET", status="200")
+
+# 默认的直方图分桶（秒），覆盖微秒级的哈希计算到秒级的同步
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+registry = []
+
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                          for k, v in pairs) + "}"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.lock = threading.Lock()
+        self.values = {}
+        registry.append(self)
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.documentation), "# TYPE %s %s" % (self.name, self.kind)]
+        with self.lock:
+            values = dict(self.values)
+        for key in sorted(values):
+            lines.extend(self.samples(key, values[key]))
+        return lines
+
+    def samples(self, key, value):
+        return ["%s%s %s" % (self.name, format_labels(key), format_value(value))]
+
+
+# 只增不减的计数
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, value=1, **labels):
+        key = label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+
+# 可增可减的当前值，例如交易池大小
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[label_key(labels)] = value
+
+
+# 延迟直方图，每个标签组合保存各分桶的计数、总和与总数
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = label_key(labels)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self, key, state):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), state[0]):
+            cumulative += count
+            lines.append("%s_bucket%s %d" % (self.name, format_labels(key, (("le", format_value(bound)),)),
+                                             cumulative))
+        lines.append("%s_sum%s %s" % (self.name, format_labels(key), repr(state[1])))
+        lines.append("%s_count%s %d" % (self.name, format_labels(key), state[2]))
+        return lines
+
+    # 计时，可作为 with 语句或装饰器使用
+    def time(self, **labels):
+        return Timer(self, labels)
+
+
+class Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+    def __call__(self, function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.histogram.observe(time.perf_counter() - start, **self.labels)
+        return wrapper
+
+
+def counter(name, documentation):
+    return Counter(name, documentation)
+
+
+def gauge(name, documentation):
+    return Gauge(name, documentation)
+
+
+def histogram(name, documentation, buckets=DEFAULT_BUCKETS):
+    return Histogram(name, documentation, buckets)
+
+
+# 输出全部指标
+def render():
+    lines = []
+    for metric in list(registry):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,37 @@
+# 从快照启动的链
+# 只保存快照高度 base 及之后的区块，行为与 list 相同（len、下标、负下标、切片、迭代、append），下标为区块高度
+# blocks 为 list 或 LazyChain，blocks[0] 为高度 base 的区块；base 之前的区块已被裁剪，访问时抛出 IndexError，切片时跳过
+class PrunedChain:
+    def __init__(self, base, blocks):
+        self.base = base
+        self.blocks = blocks
+
+    def __len__(self):
+        return self.base + len(self.blocks)
+
+    def position(self, item):
+        length = len(self)
+        if item < 0:
+            item += length
+        if item < self.base or item >= length:
+            raise IndexError("chain index out of range")
+        return item - self.base
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(len(self))
+            return self.blocks[max(start, self.base) - self.base:max(stop, self.base) - self.base:step]
+        return self.blocks[self.position(item)]
+
+    def __setitem__(self, item, block):
+        self.blocks[self.position(item)] = block
+
+    def __iter__(self):
+        return iter(self.blocks)
+
+    def append(self, block):
+        self.blocks.append(block)
+
+    def extend(self, blocks):
+        for block in blocks:
+            self.append(block)
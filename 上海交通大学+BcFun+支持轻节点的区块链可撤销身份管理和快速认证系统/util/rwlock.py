@@ -0,0 +1,54 @@
+import threading
+from contextlib import contextmanager
+
+
+# 读写锁
+# 多个读线程可以同时持有读锁；写锁独占。有写线程等待时新的读线程需要等待，避免写线程饿死
+# 不可重入：持有读锁或写锁的线程不能再次获取同一把锁
+class RWLock:
+    def __init__(self):
+        self.condition = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writing = False
+        self.waiting_writers = 0
+
+    def acquire_read(self):
+        with self.condition:
+            while self.writing or self.waiting_writers:
+                self.condition.wait()
+            self.readers += 1
+
+    def release_read(self):
+        with self.condition:
+            self.readers -= 1
+            if self.readers == 0:
+                self.condition.notify_all()
+
+    def acquire_write(self):
+        with self.condition:
+            self.waiting_writers += 1
+            while self.writing or self.readers:
+                self.condition.wait()
+            self.waiting_writers -= 1
+            self.writing = True
+
+    def release_write(self):
+        with self.condition:
+            self.writing = False
+            self.condition.notify_all()
+
+    @contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
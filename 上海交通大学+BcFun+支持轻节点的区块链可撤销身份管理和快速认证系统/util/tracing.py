@@ -0,0 +1,211 @@
+import cProfile
+import io
+import pstats
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+# 请求追踪
+# 每个请求（或出块等后台任务）是一条 trace，由嵌套的 span 组成，每个 span 记录名称、开始时间、耗时与属性
+# 当前 trace 保存在线程局部变量中；节点间请求通过 X-Trace-Id 请求头传递 trace id，接收方沿用同一个 id，
+# 因此一次转发、撤销或区块推送在各节点上的记录可以按 trace id 关联起来
+# 没有活动的 trace 时 span 不做任何记录
+
+HEADER = "X-Trace-Id"
+# 保留最近的 trace 数量
+MAX_TRACES = 256
+
+local = threading.local()
+traces = deque(maxlen=MAX_TRACES)
+
+
+class Span:
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.start = time.time()
+        self.perf_start = time.perf_counter()
+        self.duration = None
+        self.children = []
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.perf_start
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "start": self.start,
+            "duration": self.duration,
+            "attrs": self.attrs,
+            "children": [child.to_dict() for child in list(self.children)]
+        }
+
+
+def new_id():
+    return uuid.uuid4().hex[:16]
+
+
+# 当前线程的 (trace id, 当前 span)，没有活动的 trace 时为 None
+def current():
+    return getattr(local, "context", None)
+
+
+def current_id():
+    context = current()
+    return context[0] if context else None
+
+
+# 开始一条 trace，返回 end_trace 需要的令牌；已在 trace 中时作为子 span 处理
+def start_trace(name, trace_id=None, **attrs):
+    previous = current()
+    if previous is not None:
+        span = Span(name, attrs)
+        previous[1].children.append(span)
+        local.context = (previous[0], span)
+        return previous, span, None
+    span = Span(name, attrs)
+    local.context = (trace_id or new_id(), span)
+    return None, span, profiler.begin()
+
+
+def end_trace(token):
+    previous, span, profile = token
+    span.finish()
+    context = current()
+    local.context = previous
+    profiler.end(profile)
+    if previous is None and context is not None:
+        record = span.to_dict()
+        record["trace_id"] = context[0]
+        traces.append(record)
+
+
+@contextmanager
+def trace(name, trace_id=None, **attrs):
+    token = start_trace(name, trace_id, **attrs)
+    try:
+        yield token[1]
+    finally:
+        end_trace(token)
+
+
+# 在当前 trace 中记录一个子 span
+@contextmanager
+def span(name, **attrs):
+    context = current()
+    if context is None:
+        yield None
+        return
+    child = Span(name, attrs)
+    context[1].children.append(child)
+    local.context = (context[0], child)
+    try:
+        yield child
+    finally:
+        child.finish()
+        local.context = context
+
+
+# 装饰器形式的 span
+def traced(name):
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if current() is None:
+                return function(*args, **kwargs)
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# 在其他线程中继续 context 所属的 trace（例如合并转发、线程池发送）
+@contextmanager
+def attach(context):
+    previous = current()
+    local.context = context
+    try:
+        yield
+    finally:
+        local.context = previous
+
+
+# 在 headers 的副本中加入当前 trace id，用于节点间请求
+def headers(base=None):
+    result = dict(base) if base else {}
+    trace_id = current_id()
+    if trace_id:
+        result[HEADER] = trace_id
+    return result
+
+
+# 最近的 trace，可按 trace id 过滤，新的在前
+def recent(trace_id=None, limit=50):
+    result = [record for record in reversed(list(traces)) if trace_id is None or record["trace_id"] == trace_id]
+    return result[:limit]
+
+
+# 按需性能剖析
+# 开启后在窗口期内按 rate 的比例对新开始的 trace 启用 cProfile，结束后把各次结果合并到同一份统计中
+class Profiler:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.deadline = 0
+        self.rate = 1.0
+        self.stats = None
+        self.samples = 0
+
+    def start(self, seconds, rate):
+        with self.lock:
+            self.deadline = time.time() + seconds
+            self.rate = rate
+            self.stats = None
+            self.samples = 0
+
+    def begin(self):
+        if time.time() >= self.deadline or random.random() >= self.rate:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # 当前线程已有其他剖析工具
+            return None
+        return profile
+
+    def end(self, profile):
+        if profile is None:
+            return
+        profile.disable()
+        with self.lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+            self.samples += 1
+
+    def report(self, sort="cumulative", limit=50):
+        with self.lock:
+            if self.stats is None:
+                return "No samples\n"
+            out = io.StringIO()
+            self.stats.stream = out
+            out.write("%d sampled traces\n" % self.samples)
+            self.stats.sort_stats(sort).print_stats(limit)
+            return out.getvalue()
+
+
+profiler = Profiler()
+
+
+# 剖析接下来 seconds 秒内开始的 trace，返回合并后的统计文本
+def profile(seconds, rate=1.0, sort="cumulative", limit=50):
+    profiler.start(seconds, rate)
+    time.sleep(seconds)
+    # 等待窗口内开始的 trace 结束
+    time.sleep(min(seconds, 1))
+    return profiler.report(sort, limit)
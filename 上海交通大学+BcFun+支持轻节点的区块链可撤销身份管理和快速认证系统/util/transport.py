@@ -0,0 +1,90 @@
+import json
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from util import tracing
+
+HEADERS = {'Content-type': 'application/json', 'Accept': 'text/plain'}
+
+
+def peer_key(peer):
+    return "{host}:{port}".format(**peer)
+
+
+# 节点间通信
+# 每个节点使用独立的 requests.Session 保持长连接，所有请求都带有连接和读取超时
+# broadcast 通过线程池并发发送，总耗时取决于最慢的正常节点，失联节点最多占用一个超时时间
+class PeerTransport:
+    def __init__(self, timeout=(2, 5), workers=16, pool_size=4):
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    # 获取节点对应的长连接会话
+    def session(self, peer):
+        key = peer_key(peer)
+        with self.lock:
+            session = self.sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size))
+                session.headers.update(HEADERS)
+                self.sessions[key] = session
+            return session
+
+    # 节点离开时关闭对应的连接
+    def close(self, peer):
+        with self.lock:
+            session = self.sessions.pop(peer_key(peer), None)
+        if session is not None:
+            session.close()
+
+    def url(self, peer, path):
+        return "http://{host}:{port}".format(**peer) + path
+
+    # data: dict 会被序列化为 JSON，str 则原样发送
+    # headers: 可选，覆盖默认的请求头（例如发送二进制区块时的 Content-type）
+    # 调用线程处于 trace 中时附带 trace id
+    def post(self, peer, path, data, timeout=None, headers=None):
+        if not isinstance(data, (str, bytes)):
+            data = json.dumps(data)
+        return self.session(peer).post(url=self.url(peer, path), data=data, timeout=timeout or self.timeout,
+                                       headers=tracing.headers(headers))
+
+    def get(self, peer, path, params=None, timeout=None, stream=False, headers=None):
+        return self.session(peer).get(url=self.url(peer, path), params=params, timeout=timeout or self.timeout,
+                                      stream=stream, headers=tracing.headers(headers))
+
+    # 发送一次并记录结果，不抛出异常
+    def send(self, peer, path, data, timeout=None, headers=None):
+        start = time.time()
+        result = {"ok": False, "status": None, "elapsed": 0, "error": ""}
+        try:
+            r = self.post(peer, path, data, timeout, headers)
+            result["status"] = r.status_code
+            result["ok"] = r.status_code == 200
+            result["response"] = r.text
+        except requests.RequestException as e:
+            result["error"] = type(e).__name__
+        result["elapsed"] = time.time() - start
+        return result
+
+    # 并发发送给多个节点
+    # 返回 {"host:port": {"ok", "status", "elapsed", "error", "response"}, ...}
+    def broadcast(self, peers, path, data, timeout=None, headers=None):
+        if not isinstance(data, (str, bytes)):
+            # 只序列化一次
+            data = json.dumps(data)
+        # 发送在线程池中进行，trace id 需要在调用线程中取出
+        headers = tracing.headers(headers)
+        futures = {}
+        for peer in peers:
+            futures[peer_key(peer)] = self.executor.submit(self.send, peer, path, data, timeout, headers)
+        results = {}
+        for key in futures:
+            results[key] = futures[key].result()
+        return results
@@ -0,0 +1,68 @@
+import threading
+import time
+from concurrent.futures import Future
+from util import tracing
+
+
+# 合并转发交易
+# follower 收到的交易先进入队列，后台线程每凑够 max_count 笔或最早一笔等待超过 max_latency 秒，
+# 就调用 send 整批发送给 leader；并发到达的请求共用一次往返，各自通过 Future 取回自己的结果
+# send(transactions) 返回与 transactions 顺序一致、数量相同的结果列表
+# 一批交易沿用其中第一笔交易所在请求的 trace
+class TransactionForwarder:
+    def __init__(self, send, max_count=256, max_latency=0.05):
+        self.send = send
+        self.max_count = max_count
+        self.max_latency = max_latency
+        self.queue = []
+        self.first_arrival = None
+        self.condition = threading.Condition()
+        self.thread = None
+
+    # 提交一批交易，返回与 transactions 顺序一致的 Future 列表
+    def submit(self, transactions):
+        futures = [Future() for _ in transactions]
+        with self.condition:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+            if not self.queue:
+                self.first_arrival = time.time()
+            context = tracing.current()
+            self.queue.extend((transaction, future, context) for transaction, future in zip(transactions, futures))
+            self.condition.notify()
+        return futures
+
+    # 提交并等待结果
+    def forward(self, transactions):
+        return [future.result() for future in self.submit(transactions)]
+
+    def next_batch(self):
+        with self.condition:
+            while len(self.queue) < self.max_count:
+                if self.queue:
+                    remaining = self.first_arrival + self.max_latency - time.time()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                else:
+                    self.condition.wait()
+            batch, self.queue = self.queue[:self.max_count], self.queue[self.max_count:]
+            if self.queue:
+                # 剩余交易已经等待过，立即发送下一批
+                self.first_arrival = 0
+            return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            try:
+                with tracing.attach(batch[0][2]), tracing.span("forward_transactions", count=len(batch)):
+                    results = self.send([transaction for transaction, future, context in batch])
+            except Exception:
+                results = [False] * len(batch)
+            # 结果与交易数量不一致时无法对应，整批视为失败，保证每个 Future 都会得到结果
+            if not isinstance(results, list) or len(results) != len(batch):
+                results = [False] * len(batch)
+            for (transaction, future, context), result in zip(batch, results):
+                future.set_result(result)
@@ -0,0 +1,99 @@
+import threading
+import time
+
+# add 的返回值
+ADDED = "added"
+DUPLICATE = "duplicate"
+FULL = "full"
+
+
+# 线程安全的交易池（双缓冲）
+# 接收交易的线程只向当前缓冲区追加；出块线程取走整个缓冲区并换上新的空缓冲区，两者互不阻塞
+# hashes 记录池中和正在出块的全部交易哈希，用于 O(1) 去重；出块完成（交易已进入链索引）后由 release 移除
+# 池中交易数达到 capacity 时拒绝新的交易，由调用方通知客户端稍后重试
+class TransactionPool:
+    def __init__(self, capacity=10000):
+        self.active = []
+        self.hashes = set()
+        self.capacity = capacity
+        # 当前缓冲区中最早一笔交易的到达时间
+        self.first_arrival = None
+        self.condition = threading.Condition()
+
+    # 加入一笔交易，返回 ADDED / DUPLICATE / FULL
+    def add(self, transaction):
+        with self.condition:
+            if transaction["hash"] in self.hashes:
+                return DUPLICATE
+            if len(self.hashes) >= self.capacity:
+                return FULL
+            self.push(transaction)
+            return ADDED
+
+    # 节点自己生成的交易（例如撤销后的更新交易）不受容量限制
+    def append(self, transaction):
+        with self.condition:
+            if transaction["hash"] not in self.hashes:
+                self.push(transaction)
+
+    def push(self, transaction):
+        if not self.active:
+            self.first_arrival = time.time()
+        self.active.append(transaction)
+        self.hashes.add(transaction["hash"])
+        self.condition.notify()
+
+    def extend(self, transactions):
+        for transaction in transactions:
+            self.append(transaction)
+
+    # 出块失败时把取走的交易放回当前缓冲区最前面，不受容量限制（交易仍在 hashes 中）
+    # 到达时间按放回的时间计算，出块持续失败时每 max_latency 秒重试一次
+    def requeue(self, transactions):
+        with self.condition:
+            if not transactions:
+                return
+            self.active = list(transactions) + self.active
+            self.first_arrival = time.time()
+            self.condition.notify()
+
+    # 交易已打包进区块或已转交给 leader，不再参与去重
+    def release(self, transactions):
+        with self.condition:
+            for transaction in transactions:
+                self.hashes.discard(transaction.get("hash"))
+
+    def __contains__(self, tran_hash):
+        return tran_hash in self.hashes
+
+    # 取走最多 max_count 笔交易，max_count 为 None 时全部取走
+    def take(self, max_count=None):
+        with self.condition:
+            if max_count is None or len(self.active) <= max_count:
+                batch, self.active = self.active, []
+                self.first_arrival = None
+            else:
+                # 剩余交易的到达时间不晚于 first_arrival，沿用原值
+                batch, self.active = self.active[:max_count], self.active[max_count:]
+            return batch
+
+    # 等待直到交易数达到 max_count，或最早一笔交易已等待 max_latency 秒，然后取走一批交易
+    def wait_batch(self, max_count, max_latency):
+        with self.condition:
+            while len(self.active) < max_count:
+                if self.active:
+                    remaining = self.first_arrival + max_latency - time.time()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                else:
+                    self.condition.wait()
+            return self.take(max_count)
+
+    def __len__(self):
+        return len(self.active)
+
+    # 返回当前交易的快照，用于页面展示
+    def __iter__(self):
+        with self.condition:
+            return iter(list(self.active))
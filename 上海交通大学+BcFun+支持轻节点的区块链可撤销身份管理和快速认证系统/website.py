@@ -1,6 +1,8 @@
-from flask import Flask, jsonify, render_template, request, redirect, url_for
+from flask import Flask, jsonify, render_template, request, redirect, url_for, Response, stream_with_context, g
 from blockchain import BlockChain
+from util import blockCodec, metrics, tracing, chainIndex, hashTool
 from daemon import BcDaemon
+from producer import BlockProducer
 import json
 from argparse import ArgumentParser
 import time
@@ -9,6 +11,98 @@ app = Flask(__name__)
 
 bc_init = False
 
+# NDJSON 批量提交时每组验证的交易数
+BULK_CHUNK = 1024
+
+# 身份查询方式：按公钥或按身份信息
+FIND_MODES = (chainIndex.KEY, chainIndex.MESSAGE)
+
+ROUTE_SECONDS = metrics.histogram("bcfun_http_request_seconds", "Time to handle an HTTP request")
+CHAIN_HEIGHT = metrics.gauge("bcfun_chain_height", "Height of the local chain tip")
+LEADER_HEIGHT = metrics.gauge("bcfun_leader_height", "Highest block height received from the leader")
+SYNC_LAG = metrics.gauge("bcfun_sync_lag_blocks", "Blocks the local chain is behind the leader")
+POOL_SIZE = metrics.gauge("bcfun_transaction_pool_size", "Transactions waiting in the pool")
+PEERS = metrics.gauge("bcfun_peers", "Peers in the peer list")
+IS_LEADER = metrics.gauge("bcfun_is_leader", "1 if this node is the leader")
+
+
+# 记录每个请求的处理时间；流式响应只计到开始发送为止
+# 每个请求是一条 trace，沿用请求头中的 trace id（来自其他节点的转发、撤销与区块推送），并在响应头中返回
+@app.before_request
+def start_timer():
+    g.start_time = time.perf_counter()
+    g.trace = tracing.start_trace(request.method + " " + request.path, request.headers.get(tracing.HEADER))
+
+
+@app.after_request
+def record_request(response):
+    if "start_time" in g:
+        ROUTE_SECONDS.observe(time.perf_counter() - g.start_time, endpoint=request.endpoint or "unknown",
+                              method=request.method, status=str(response.status_code))
+    trace_id = tracing.current_id()
+    if trace_id:
+        response.headers[tracing.HEADER] = trace_id
+    return response
+
+
+@app.teardown_request
+def end_trace(exception):
+    if "trace" in g:
+        tracing.end_trace(g.pop("trace"))
+
+
+# 管理接口只接受本机的请求
+def is_local_request():
+    return request.remote_addr in ("127.0.0.1", "::1")
+
+
+# 最近的 trace：?trace_id=xxx&limit=50
+@app.route('/admin/traces', methods=["GET"])
+def admin_traces():
+    if not is_local_request():
+        return json.dumps({"status": "Error", "message": "Forbidden", "code": 0}), 403
+    try:
+        limit = int(request.args.get("limit", 50))
+    except ValueError:
+        return json.dumps({"status": "OK", "message": "Parameters error", "code": 0}), 400
+    traces = tracing.recent(request.args.get("trace_id"), limit)
+    return json.dumps({"status": "OK", "message": "Success", "traces": traces, "code": 1})
+
+
+# 对接下来 seconds 秒内开始的请求与出块按 rate 的比例启用 cProfile，窗口结束后返回合并的统计
+# ?seconds=10&rate=1&sort=cumulative&limit=50
+@app.route('/admin/profile', methods=["GET"])
+def admin_profile():
+    if not is_local_request():
+        return json.dumps({"status": "Error", "message": "Forbidden", "code": 0}), 403
+    try:
+        seconds = min(float(request.args.get("seconds", 10)), 300)
+        rate = float(request.args.get("rate", 1))
+        limit = int(request.args.get("limit", 50))
+    except ValueError:
+        return json.dumps({"status": "OK", "message": "Parameters error", "code": 0}), 400
+    sort = request.args.get("sort", "cumulative")
+    try:
+        report = tracing.profile(seconds, rate, sort, limit)
+    except KeyError:
+        return json.dumps({"status": "OK", "message": "Parameters error", "code": 0}), 400
+    return Response(report, mimetype="text/plain")
+
+
+# Prometheus 格式的监控指标
+@app.route('/metrics', methods=["GET"])
+def metrics_route():
+    if bc_init:
+        height = len(bc.chain) - 1
+        leader_height = height if bc.character == "leader" else max(bc.leader_height, height)
+        CHAIN_HEIGHT.set(height)
+        LEADER_HEIGHT.set(leader_height)
+        SYNC_LAG.set(leader_height - height)
+        POOL_SIZE.set(len(bc.transaction_pool))
+        PEERS.set(len(bc.peer_list))
+        IS_LEADER.set(1 if bc.character == "leader" else 0)
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 
 @app.route('/init', methods=['POST', 'GET'])
 def init():
@@ -21,6 +115,7 @@ def init():
                 bc_init = bc.init()
                 if bc_init:
                     th.start()
+                    pd.start()
                     return redirect(url_for('home'))
                 else:
                     return redirect(url_for('init'))
@@ -28,6 +123,7 @@ def init():
                 bc_init = bc.init({"host": request.form.get('host'), "port": request.form.get('port')})
                 if bc_init:
                     th.start()
+                    pd.start()
                     return redirect(url_for('home'))
                 else:
                     return redirect(url_for('init'))
@@ -40,7 +136,7 @@ def home():
     global bc_init
     if bc_init:
         return render_template('index.html', peers=bc.peer_list, leader=bc.leader, character=bc.character,
-                               selfinfo=bc.info, blocks=bc.chain, transactions=bc.transaction_pool, chameleoninfo=bc.chameleon)
+                               selfinfo=bc.info, blocks=bc.chain, transactions=list(bc.transaction_pool), chameleoninfo=bc.chameleon)
     else:
         return redirect(url_for('init'))
 
@@ -83,24 +179,44 @@ def gossip():
 def block():
     if request.method == "GET":
         latest_hash = request.args.get("block_hash")
+        # mode=header 时只返回区块头，供轻节点同步
+        header_only = request.args.get("mode") == "header"
         if latest_hash == "Empty":
-            blocks = bc.chain
+            blocks = bc.send_block(None, header_only)
         else:
-            blocks = bc.send_block(latest_hash)
+            blocks = bc.send_block(latest_hash, header_only)
         if blocks:
             return json.dumps({"status": "OK", "blocks": blocks})
         else:
-            return json.dumps({"status": "Error", "blocks": bc.chain})
+            return json.dumps({"status": "Error", "blocks": bc.send_block(None, header_only)})
     if request.method == "POST":
+        # 二进制编码的区块，等同于 code 4
+        if request.content_type == blockCodec.CONTENT_TYPE:
+            try:
+                bc.recv_block(*blockCodec.decode_block_tree(request.get_data()))
+                return json.dumps({"status": "OK", "message": "Block RECV Success", "code": 1})
+            except ValueError:
+                return json.dumps({"status": "OK", "message": "Request error", "code": 0})
         try:
             msg_recv = json.loads(request.get_data())
             if msg_recv["code"] == 4:
                 bc.recv_block(msg_recv["block"])
                 return json.dumps({"status": "OK", "message": "Block RECV Success", "code": 1})
+            elif msg_recv["code"] == 5:
+                # 区块修改：{"code": 5, "revision": {"block_hash", "removed", "merkle_root", "r", "s"}}
+                # 无法应用时返回 code 0，leader 会改为发送完整区块
+                if bc.apply_revision(msg_recv["revision"]):
+                    return json.dumps({"status": "OK", "message": "Block REVISE Success", "code": 1})
+                else:
+                    return json.dumps({"status": "OK", "message": "Block REVISE Failed", "code": 0})
             elif msg_recv["code"] == 6:
                 if msg_recv["action"] == "REVOKE":
                     bc.revoke_from_block(msg_recv["msg"])
                     return json.dumps({"status": "OK", "message": "Block REVOKE Success", "code": 1})
+                elif msg_recv["action"] == "REVOKE_BATCH":
+                    # 批量撤销：{"code": 6, "action": "REVOKE_BATCH", "msgs": [{"block_hash", "transaction_hash"}, ...]}
+                    results = bc.revoke_from_blocks(msg_recv["msgs"])
+                    return json.dumps({"status": "OK", "message": "Block REVOKE Success", "results": results, "code": 1})
             else:
                 return json.dumps({"status": "OK", "message": "Code error", "code": 0})
         except json.decoder.JSONDecodeError:
@@ -109,18 +225,51 @@ def block():
             return json.dumps({"status": "OK", "message": "Parameters error", "code": 0})
 
 
+# 按高度范围分页同步区块
+# GET: ?start=起始高度&limit=区块数量&block_hash=起始高度前一个区块的哈希&mode=header
+# 响应为逐行的区块 JSON（NDJSON），block_hash 与本地不一致时返回 409
+# start 低于本地最早保存的区块（本节点从快照启动）时返回 410，请求方应先通过 /snapshot 启动
+# 请求头 Accept 包含 blockCodec.CONTENT_TYPE 时返回带长度前缀的二进制区块流
+@app.route('/block/range', methods=["GET"])
+def block_range():
+    try:
+        start = int(request.args.get("start", 0))
+        limit = min(int(request.args.get("limit", 1000)), 10000)
+    except ValueError:
+        return json.dumps({"status": "OK", "message": "Parameters error", "code": 0}), 400
+    latest_hash = request.args.get("block_hash")
+    if start < bc.chain_base():
+        return json.dumps({"status": "Error", "message": "Blocks pruned", "code": 0}), 410
+    if start < 0 or limit <= 0 or (start > 0 and not bc.check_block(start - 1, latest_hash)):
+        return json.dumps({"status": "Error", "message": "Chain mismatch", "code": 0}), 409
+    header_only = request.args.get("mode") == "header"
+
+    if blockCodec.CONTENT_TYPE in request.headers.get("Accept", ""):
+        def generate_binary():
+            for blk in bc.iter_blocks(start, start + limit, header_only):
+                yield blockCodec.encode_frame(blk)
+
+        return Response(stream_with_context(generate_binary()), mimetype=blockCodec.CONTENT_TYPE)
+
+    def generate():
+        for blk in bc.iter_blocks(start, start + limit, header_only):
+            yield json.dumps(blk) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
 @app.route('/transaction', methods=["POST"])
 def transaction():
     if request.method == "POST":
         try:
             msg_recv = json.loads(request.get_data())
             if msg_recv["code"] == 3:
-                if "transaction" in msg_recv:
-                    r_transaction = msg_recv["transaction"]
-                    if bc.add_transaction(r_transaction):
-                        return json.dumps({"status": "OK", "message": "Success", "code": 1})
-                    else:
-                        return json.dumps({"status": "OK", "message": "Transaction error", "code": 0})
+                if "transactions" in msg_recv:
+                    if not isinstance(msg_recv["transactions"], list):
+                        return json.dumps({"status": "OK", "message": "Parameters error", "code": 0}), 400
+                    return transaction_results(bc.add_transactions(msg_recv["transactions"]))
+                elif "transaction" in msg_recv:
+                    return transaction_result(bc.add_transaction(msg_recv["transaction"]))
                 else:
                     return json.dumps({"status": "OK", "message": "Data missing", "code": 0})
             else:
@@ -132,9 +281,12 @@ def transaction():
 
 
 # 接收用户提交的信息
+# 表单提交单条交易，或以 JSON 数组 / NDJSON 一次提交多条交易（同 /transaction/batch）
 @app.route('/transaction/add', methods=["GET", "POST"])
 def add():
     if request.method == "POST":
+        if request.is_json or request.mimetype == "application/x-ndjson":
+            return batch()
         t_from = request.form.get("from")
         t_message = request.form.get("message")
         t_signature = request.form.get("signature")
@@ -145,10 +297,124 @@ def add():
             "signature": t_signature,
             "hash": t_hash
         }
-        if bc.add_transaction(t):
-            return json.dumps({"status": "OK", "message": "Success", "code": 1})
+        return transaction_result(bc.add_transaction(t))
+
+
+# 批量提交交易
+# 请求体为 JSON 数组，或 Content-Type 为 application/x-ndjson 的逐行交易
+# NDJSON 边接收边按 BULK_CHUNK 笔一组验证并放入交易池；交易池满后剩余交易不再验证，结果均为 None
+# 返回与提交顺序一致的 results：true 已接收，false 无效或重复，null 交易池已满
+@app.route('/transaction/batch', methods=["POST"])
+def batch():
+    if request.mimetype != "application/x-ndjson":
+        transactions = request.get_json(force=True, silent=True)
+        if not isinstance(transactions, list):
+            return json.dumps({"status": "OK", "message": "Request error", "code": 0}), 400
+        return transaction_results(bc.add_transactions(transactions))
+    results = []
+    chunk = []
+    for line in request.stream:
+        if not line.strip():
+            continue
+        try:
+            chunk.append(json.loads(line))
+        except ValueError:
+            # 无法解析的行作为无效交易
+            chunk.append(None)
+        if len(chunk) >= BULK_CHUNK:
+            results.extend(add_chunk(chunk, None in results))
+            chunk = []
+    results.extend(add_chunk(chunk, None in results))
+    return transaction_results(results)
+
+
+def add_chunk(transactions, full):
+    if full:
+        return [None] * len(transactions)
+    return bc.add_transactions(transactions)
+
+
+# 交易池已满时返回 429，客户端应稍后重试
+def transaction_result(result):
+    if result is None:
+        return json.dumps({"status": "Error", "message": "Transaction pool full", "code": 0}), 429
+    elif result:
+        return json.dumps({"status": "OK", "message": "Success", "code": 1})
+    else:
+        return json.dumps({"status": "OK", "message": "Transaction error", "code": 0})
+
+
+# 批量提交的结果，有交易因交易池已满被拒绝（结果为 None）时返回 429，其余交易的结果照常返回
+def transaction_results(results):
+    if None in results:
+        return json.dumps({"status": "Error", "message": "Transaction pool full", "results": results, "code": 0}), 429
+    return json.dumps({"status": "OK", "message": "Success", "results": results, "code": 1})
+
+
+# 最新的链快照，新节点从快照启动
+@app.route('/snapshot', methods=["GET"])
+def snapshot():
+    if bc.snapshot:
+        return json.dumps({"status": "OK", "message": "Success", "snapshot": bc.snapshot, "code": 1})
+    else:
+        return json.dumps({"status": "OK", "message": "Not found", "code": 0})
+
+
+# 交易的包含性证明
+# GET: ?transaction_hash=xxx
+@app.route('/proof', methods=["GET"])
+def proof():
+    tran_hash = request.args.get("transaction_hash")
+    result = bc.transaction_proof(tran_hash) if tran_hash else None
+    if result:
+        return json.dumps({"status": "OK", "message": "Success", "proof": result, "code": 1})
+    else:
+        return json.dumps({"status": "OK", "message": "Not found", "code": 0})
+
+
+# 身份快速认证
+# by: "key" 按公钥查询，"message" 按身份信息查询（被撤销的身份不保留身份信息，只能按公钥查到）
+@app.route('/find', methods=["GET", "POST"])
+def find():
+    if request.method == "GET":
+        return render_template('find.html', by=chainIndex.KEY)
+    key = request.form.get("address", "").strip()
+    by = request.form.get("by", chainIndex.KEY)
+    if by not in FIND_MODES:
+        by = chainIndex.KEY
+    return render_template('find.html', address=key, by=by, identity=bc.find_identity(key, by) if key else None)
+
+
+# 身份快速认证的 JSON 接口
+# GET: ?key=公钥或身份信息&by=key/message
+# POST: {"keys": [公钥或身份信息, ...], "by": "key"/"message"}，批量查询
+# by 缺省为 "key"，即按公钥查询
+@app.route('/api/find', methods=["GET", "POST"])
+def api_find():
+    if request.method == "GET":
+        key = request.args.get("key")
+        by = request.args.get("by", chainIndex.KEY)
+        if not key or by not in FIND_MODES:
+            return json.dumps({"status": "OK", "message": "Parameters error", "code": 0})
+        identity = bc.find_identity(key, by)
+        if identity:
+            return json.dumps({"status": "OK", "message": "Success", "identity": identity, "code": 1})
         else:
-            return json.dumps({"status": "OK", "message": "Transaction error", "code": 0})
+            return json.dumps({"status": "OK", "message": "Not found", "code": 0})
+    if request.method == "POST":
+        try:
+            msg_recv = json.loads(request.get_data())
+            by = msg_recv.get("by", chainIndex.KEY)
+            if by not in FIND_MODES:
+                raise KeyError
+            identities = {}
+            for key in msg_recv["keys"]:
+                identities[key] = bc.find_identity(key, by)
+            return json.dumps({"status": "OK", "message": "Success", "identities": identities, "code": 1})
+        except json.decoder.JSONDecodeError:
+            return json.dumps({"status": "OK", "message": "Request error", "code": 0})
+        except (KeyError, TypeError, AttributeError):
+            return json.dumps({"status": "OK", "message": "Parameters error", "code": 0})
 
 
 @app.route('/daemon', methods=["POST"])
@@ -157,14 +423,23 @@ def daemon():
     if msg_recv["code"] == 6:
         if "leader" in msg_recv:  # Leader_daemon发来的消息
             if msg_recv["leader"] == bc.leader:
-                bc.peer_list = msg_recv["peers"]
-                return json.dumps({"status": "OK", "message": "Success", "code": 1})
+                # 新版本的 leader 发送节点列表增量，旧版本发送完整列表
+                # 增量与本地版本不一致时不应用，返回本地版本让 leader 下次按此计算
+                if "delta" in msg_recv:
+                    bc.membership.apply(msg_recv["delta"])
+                else:
+                    bc.set_peers(msg_recv["peers"])
+                return json.dumps(dict({"status": "OK", "message": "Success", "code": 1}, **bc.membership.state()))
             else:
                 return json.dumps({"status": "OK", "message": "Leader error", "code": 0})
         else:  # follower_daemon发来的消息
-            if bc.character == "leader" and msg_recv["info"] in bc.peer_list:
+            if bc.character == "leader" and bc.membership.contains(msg_recv["info"]):
                 th.set_sync_time(time.time(), msg_recv["info"]["term"])  # 更新同步时间
-                return json.dumps({"status": "OK", "message": "Success", "peers": bc.peer_list, "code": 1})
+                result = {"status": "OK", "message": "Success", "code": 1,
+                          "delta": bc.membership.delta(msg_recv.get("epoch"), msg_recv.get("version"))}
+                if "version" not in msg_recv:  # 旧版本的 follower 只认完整列表
+                    result["peers"] = bc.peer_list
+                return json.dumps(result)
             else:
                 return json.dumps({"status": "OK", "message": "Leader error", "leader": bc.leader, "code": 0})
     else:
@@ -197,6 +472,8 @@ if __name__ == "__main__":
     parser.add_argument('-p', '--port', help='port')
     parser.add_argument('-t', '--test', action="store_const", const="True",
                         help='run as random identity and do not store chian data in file')
+    parser.add_argument('-l', '--light', action="store_true",
+                        help='run as light node, only block headers are synchronized')
     args = parser.parse_args()
 
     try:
@@ -210,8 +487,13 @@ if __name__ == "__main__":
     port = args.port if args.port else config['port']
     test_mode = args.test if args.test else False
 
+    # 在启动其他线程之前创建验证签名与区块的进程池
+    hashTool.get_process_pool()
     # max_transactions 可设置为4，以方便测试。
-    bc = BlockChain(host=host, port=port, test_mode=test_mode, max_transactions=4)
+    bc = BlockChain(host=host, port=port, test_mode=test_mode, max_transactions=4, light_mode=args.light)
     th = BcDaemon(bc=bc)
     th.daemon = True
+    # 出块线程
+    pd = BlockProducer(bc=bc)
+    pd.daemon = True
     app.run(debug=True, host=host, port=port)